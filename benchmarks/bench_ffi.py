@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare runtime-parsed and precompiled CFFI bindings.
+
+Measures the time needed to make the C declarations available (parsing the
+header strings vs. importing the precompiled modules), and, if the Qmix SDK
+DLLs can be found, the per-call overhead of the polling functions used by
+`QmixPump.is_pumping` and `QmixPump.fill_level`.
+
+Build the precompiled modules first::
+
+    python -m pyqmix._build_ffi
+
+Then run::
+
+    python benchmarks/bench_ffi.py
+
+"""
+
+from __future__ import print_function
+
+import sys
+import timeit
+from importlib import import_module
+
+from cffi import FFI
+
+from pyqmix import config
+from pyqmix.library import LIBRARIES, precompiled_module_name
+from pyqmix.tools import find_dll
+
+N_PARSE = 20
+N_CALLS = 100000
+
+
+def bench_declarations(name):
+    header = LIBRARIES[name][1]
+
+    def parse():
+        ffi = FFI()
+        ffi.cdef(header)
+
+    t_parse = min(timeit.repeat(parse, number=1, repeat=N_PARSE))
+
+    try:
+        module = import_module(precompiled_module_name(name))
+    except ImportError:
+        return t_parse, None
+
+    def load():
+        if sys.version_info[0] < 3:
+            reload(module)  # noqa: F821
+        else:
+            from importlib import reload
+            reload(module)
+
+    t_load = min(timeit.repeat(load, number=1, repeat=N_PARSE))
+    return t_parse, t_load
+
+
+def bench_calls():
+    dll_dir = config.read_config().get('qmix_dll_dir', None)
+    dll_filename = LIBRARIES['pump'][0]
+    try:
+        dll_path = find_dll(dll_dir=dll_dir, dll_filename=dll_filename)
+    except ImportError:  # pywin32 is only available on Windows.
+        dll_path = None
+
+    if dll_path is None:
+        return None
+
+    libs = dict()
+
+    ffi = FFI()
+    ffi.cdef(LIBRARIES['pump'][1])
+    libs['abi'] = (ffi, ffi.dlopen(dll_path))
+
+    try:
+        module = import_module(precompiled_module_name('pump'))
+        if hasattr(module, 'lib'):
+            libs['api'] = (module.ffi, module.lib)
+        else:
+            libs['abi-precompiled'] = (module.ffi,
+                                       module.ffi.dlopen(dll_path))
+    except ImportError:
+        pass
+
+    results = dict()
+    for mode, (ffi, lib) in libs.items():
+        # Without an open bus, the calls return an error code right away,
+        # which is exactly the call path overhead we are interested in.
+        p_fill_level = ffi.new('double *')
+        is_pumping = lib.LCP_IsPumping
+        get_fill_level = lib.LCP_GetFillLevel
+
+        t_is_pumping = min(timeit.repeat(lambda: is_pumping(0),
+                                         number=N_CALLS, repeat=5))
+        t_fill_level = min(timeit.repeat(
+            lambda: get_fill_level(0, p_fill_level),
+            number=N_CALLS, repeat=5))
+
+        results[mode] = (t_is_pumping / N_CALLS, t_fill_level / N_CALLS)
+
+    return results
+
+
+def main():
+    print('Making declarations available (ms)')
+    print('%-8s %12s %12s' % ('library', 'parse', 'precompiled'))
+    for name in sorted(LIBRARIES.keys()):
+        t_parse, t_load = bench_declarations(name)
+        t_load = 'n/a' if t_load is None else '%.3f' % (t_load * 1e3)
+        print('%-8s %12.3f %12s' % (name, t_parse * 1e3, t_load))
+
+    print()
+    print('Per-call overhead (us)')
+    results = bench_calls()
+    if results is None:
+        print('Skipped: could not find the Qmix SDK pump DLL.')
+        return
+
+    print('%-16s %14s %18s' % ('mode', 'LCP_IsPumping', 'LCP_GetFillLevel'))
+    for mode, (t_is_pumping, t_fill_level) in sorted(results.items()):
+        print('%-16s %14.3f %18.3f' % (mode, t_is_pumping * 1e6,
+                                       t_fill_level * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+pyqmix benchmark suite.
+
+Measures
+
+- the per-call overhead of frequently polled `QmixPump` properties, with
+  and without `pyqmix.instrumentation` enabled,
+- the time from issuing `QmixPump.dispense()` until the command has been
+  accepted, and until the pump reports that it is pumping,
+- the completion-detection latency of waiting for an operation, i.e. the
+  time between the end of the plunger move and `wait()` returning,
+- the time needed to open and start the bus via `QmixBus`, and
+- the time needed to construct N `QmixPump` objects.
+
+By default, the benchmarks run against the simulated Qmix SDK (see
+`pyqmix.sim`) with a temporary configuration directory, so they can run on
+any machine. Completion-detection latency can only be measured exactly with
+the simulation, and is skipped otherwise.
+
+Usage::
+
+    python benchmarks/bench_pyqmix.py --output results.json
+    python benchmarks/bench_pyqmix.py --baseline results.json
+
+With ``--baseline``, every metric is compared against the saved results and
+the script exits with status 1 if any metric regressed by more than the
+tolerance (default: 20 %) and by more than twice its run-to-run spread,
+i.e. the interquartile range of its repetitions. Metrics that are mostly
+CPU-bound are timed relative to a fixed pure-Python workload, which is
+run before every repetition; they are compared by this relative time, so
+that a machine that is faster or slower overall (e.g. due to frequency
+scaling or other tenants) does not fail the comparison. Metrics measured
+only once (bus start-up and construction of the first pump) are reported,
+but never counted as regressions, since their noise cannot be estimated.
+
+"""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import timeit
+import argparse
+import platform
+import tempfile
+
+import pyqmix
+from pyqmix import config
+from pyqmix.tools import clock
+
+N_CALLS = 2000
+N_REFERENCE_CALLS = 200
+
+
+def _quantile(values, q):
+    # Linear interpolation between the closest ranks.
+    values = sorted(values)
+    position = q * (len(values) - 1)
+    i = int(position)
+    j = min(i + 1, len(values) - 1)
+    return values[i] + (values[j] - values[i]) * (position - i)
+
+
+def _median(values):
+    return _quantile(values, 0.5)
+
+
+def _spread(values):
+    return _quantile(values, 0.75) - _quantile(values, 0.25)
+
+
+def _reference_workload():
+    total = 0
+    for i in range(100):
+        total += i
+    return total
+
+
+def _reference_time():
+    # Timed next to every repetition of a CPU-bound benchmark, to track the
+    # current speed of the machine.
+    return (timeit.timeit(_reference_workload, number=N_REFERENCE_CALLS) /
+            N_REFERENCE_CALLS)
+
+
+def _summary(values, unit, references=None):
+    # The median is compared against the baseline; the interquartile range
+    # estimates how much it varies between runs. With the reference time
+    # of every repetition, the same is computed for the relative times.
+    summary = dict(value=_median(values), min=min(values), max=max(values),
+                   spread=_spread(values), n=len(values), unit=unit)
+    if references is not None:
+        relative = [v / r for v, r in zip(values, references)]
+        summary.update(relative=_median(relative),
+                       relative_spread=_spread(relative))
+    return summary
+
+
+def _per_call(func, repeat=25):
+    # Many short repetitions, so that the median is robust against other
+    # processes slowing down single repetitions.
+    times = []
+    references = []
+    for _ in range(repeat):
+        references.append(_reference_time())
+        times.append(timeit.timeit(func, number=N_CALLS) / N_CALLS)
+    return _summary(times, unit='s', references=references)
+
+
+class Environment(object):
+    """
+    Set up pyqmix for benchmarking.
+
+    With the ``sim`` backend, use a temporary configuration directory and a
+    fresh simulated system, so no hardware and no existing configuration is
+    touched.
+
+    """
+    def __init__(self, backend='sim', n_pumps=4):
+        self.backend = backend
+        self.n_pumps = n_pumps
+        self.system = None
+        self._tmp_dir = None
+
+    def __enter__(self):
+        if self.backend == 'sim':
+            from pyqmix import sim
+
+            self._tmp_dir = tempfile.mkdtemp(prefix='pyqmix-bench-')
+            # Pumps save their state when Python exits, so only remove the
+            # directory after that.
+            atexit.register(shutil.rmtree, self._tmp_dir, True)
+            config.PYQMIX_CONFIG_DIR = self._tmp_dir
+            config.PYQMIX_CONFIG_FILE = os.path.join(self._tmp_dir,
+                                                     'config.yaml')
+            config.set_backend('sim')
+            config.set_qmix_dll_dir('')
+            self.system = sim.reset(n_pumps=self.n_pumps)
+
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def fast_forward(self, func, *args, **kwargs):
+        # Run setup moves at high simulation speed.
+        if self.system is None:
+            return func(*args, **kwargs)
+
+        speed = self.system.clock.speed
+        self.system.clock.speed = 1000.
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.system.clock.speed = speed
+
+
+def _shutdown_bus(bus):
+    bus.stop()
+    bus.close()
+
+
+def bench_bus(env):
+    from pyqmix import QmixBus
+
+    t0 = clock()
+    bus = QmixBus(auto_open=True, auto_start=True)
+    duration = clock() - t0
+
+    # Pumps store their drive position counters when Python exits, which
+    # requires the bus. Exit handlers run in reverse order of registration,
+    # so shutting down the bus is registered before any pump is created.
+    atexit.register(_shutdown_bus, bus)
+    return bus, {'bus_open_start': _summary([duration], unit='s')}
+
+
+def bench_construct_pumps(env, repeat=15):
+    from pyqmix import QmixPump
+
+    # The first pump also loads the library, so time it separately.
+    t0 = clock()
+    QmixPump(index=0)
+    t_first = clock() - t0
+
+    t_all = []
+    references = []
+    for _ in range(repeat):
+        references.append(_reference_time())
+        t0 = clock()
+        pumps = [QmixPump(index=i) for i in range(env.n_pumps)]
+        t_all.append(clock() - t0)
+
+    return pumps, {'construct_first_pump': _summary([t_first], unit='s'),
+                   'construct_pumps': _summary(t_all, unit='s',
+                                               references=references)}
+
+
+def bench_properties(env, pump):
+    from pyqmix import instrumentation
+
+    results = {'is_pumping': _per_call(lambda: pump.is_pumping),
+               'fill_level': _per_call(lambda: pump.fill_level),
+               'flow_unit': _per_call(lambda: pump.flow_unit)}
+
+    with instrumentation.instrument():
+        results['is_pumping_instrumented'] = _per_call(
+            lambda: pump.is_pumping)
+
+    return results
+
+
+def bench_dispense(env, pump, repeat=20, volume=0.05, flow_rate=1.):
+    issue_times = []
+    start_times = []
+
+    for _ in range(repeat):
+        env.fast_forward(pump.set_fill_level, level=volume * 2,
+                         flow_rate=pump.max_flow_rate, wait_until_done=True)
+
+        t0 = clock()
+        pump.dispense(volume=volume, flow_rate=flow_rate)
+        t_issued = clock()
+        while not pump.is_pumping:
+            pass
+        t_started = clock()
+
+        issue_times.append(t_issued - t0)
+        start_times.append(t_started - t0)
+        pump.stop()
+
+    return {'dispense_issue': _summary(issue_times, unit='s'),
+            'dispense_start': _summary(start_times, unit='s')}
+
+
+def bench_wait_latency(env, pump, repeat=10, volume=0.05, flow_rate=0.5):
+    if env.system is None:
+        return dict()
+
+    sim_pump = env.system.pumps[pump.index]
+    clock_ = env.system.clock
+    latencies = []
+
+    for _ in range(repeat):
+        env.fast_forward(pump.set_fill_level, level=volume * 2,
+                         flow_rate=pump.max_flow_rate, wait_until_done=True)
+
+        pump.dispense(volume=volume, flow_rate=flow_rate)
+        end_time = sim_pump.motion_end_time
+        pump.wait()
+        latencies.append(clock_.now() - end_time)
+
+    return {'wait_latency': _summary(latencies, unit='s')}
+
+
+def run(backend='sim', n_pumps=4):
+    """
+    Run all benchmarks.
+
+    Returns
+    -------
+    dict
+        Metadata and results, ready to be serialized as JSON.
+
+    """
+    results = dict()
+
+    with Environment(backend=backend, n_pumps=n_pumps) as env:
+        bus, r = bench_bus(env)
+        results.update(r)
+
+        pumps, r = bench_construct_pumps(env)
+        results.update(r)
+
+        pump = pumps[0]
+        results.update(bench_properties(env, pump))
+        results.update(bench_dispense(env, pump))
+        results.update(bench_wait_latency(env, pump))
+
+    meta = dict(pyqmix_version=pyqmix.__version__,
+                python_version=platform.python_version(),
+                platform=platform.platform(),
+                backend=backend,
+                n_pumps=n_pumps,
+                timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+    return dict(meta=meta, results=results)
+
+
+def compare(results, baseline, tolerance=0.2, noise_factor=2.):
+    """
+    Compare results against a baseline.
+
+    Metrics timed relative to the reference workload are compared by
+    their relative time. A metric has regressed if it is slower than the
+    baseline by more than `tolerance`, and by more than `noise_factor`
+    times the larger spread of the two runs, so that noisy metrics do not
+    fail spuriously. Metrics measured only once never regress.
+
+    Returns
+    -------
+    list of tuple
+        ``(name, baseline value, value, ratio, regressed)`` for every metric
+        present in both.
+
+    """
+    comparison = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+
+        old, new = baseline[name], results[name]
+        if 'relative' in old and 'relative' in new:
+            key, spread_key = 'relative', 'relative_spread'
+        else:
+            key, spread_key = 'value', 'spread'
+
+        noise = max(old.get(spread_key, 0.), new.get(spread_key, 0.))
+        ratio = new[key] / old[key] if old[key] > 0 else float('inf')
+        regressed = (new['n'] > 1 and ratio > 1 + tolerance and
+                     new[key] - old[key] > noise_factor * noise)
+        comparison.append((name, old['value'], new['value'], ratio,
+                           regressed))
+
+    return comparison
+
+
+def _format(value, unit):
+    if unit != 's':
+        return '%10.3f %s' % (value, unit)
+    elif value >= 1e-3:
+        return '%10.3f ms' % (value * 1e3)
+    else:
+        return '%10.3f us' % (value * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pyqmix benchmark suite.')
+    parser.add_argument('--backend', choices=config.BACKENDS, default='sim',
+                        help='The Qmix SDK implementation to benchmark '
+                             '(default: sim).')
+    parser.add_argument('--n-pumps', type=int, default=4,
+                        help='Number of pumps to construct (default: 4).')
+    parser.add_argument('--output', default=None,
+                        help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', default=None,
+                        help='Compare against results saved via --output.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown considered a regression '
+                             '(default: 0.2).')
+    args = parser.parse_args()
+
+    data = run(backend=args.backend, n_pumps=args.n_pumps)
+    results = data['results']
+
+    print('%-26s %14s' % ('benchmark', 'value'))
+    for name in sorted(results):
+        print('%-26s %14s' % (name, _format(results[name]['value'],
+                                            results[name]['unit'])))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)['results']
+
+    print()
+    print('%-26s %14s %14s %8s' % ('benchmark', 'baseline', 'current',
+                                   'ratio'))
+    regressions = 0
+    for name, old, new, ratio, regressed in compare(results, baseline,
+                                                    args.tolerance):
+        unit = results[name]['unit']
+        flag = '  REGRESSION' if regressed else ''
+        print('%-26s %14s %14s %8.2f%s' % (name, _format(old, unit),
+                                           _format(new, unit), ratio, flag))
+        regressions += regressed
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,13 +8,15 @@ from __future__ import print_function, unicode_literals
 
 from .bus import QmixBus
 from .pump import QmixPump
+from .group import PumpGroup
 from .valve import QmixValve, QmixExternalValve
 from .dio import QmixDigitalIO
 from . import config
+from . import library
 
 
-__all__ = ['QmixBus', 'QmixPump', 'QmixValve', 'QmixExternalValve',
-           'QmixDigitalIO', 'config']
+__all__ = ['QmixBus', 'QmixPump', 'PumpGroup', 'QmixValve',
+           'QmixExternalValve', 'QmixDigitalIO', 'config', 'library']
 
 from ._version import get_versions
 __version__ = get_versions()['version']
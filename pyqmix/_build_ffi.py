@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Build precompiled CFFI modules for the Qmix SDK libraries.
+
+By default, the C declarations are compiled in out-of-line ABI mode: the
+generated modules (``pyqmix/_qmix_<name>_cffi.py``) contain the pre-parsed
+declarations, so no header parsing is required at runtime. The DLLs are
+still opened via ``dlopen``.
+
+With ``--api``, the labbCAN libraries are instead compiled into C extension
+modules that are linked against the Qmix SDK import libraries, which avoids
+the libffi call path entirely. This requires a C compiler and the SDK
+``.lib`` files. The error library is always built in ABI mode, as it is not
+used on any time-critical path.
+
+Usage::
+
+    python -m pyqmix._build_ffi [--api --lib-dir DIR] [library ...]
+
+Precompiled modules are picked up automatically by
+:func:`pyqmix.library.load_library`; if they are missing, pyqmix falls back
+to parsing the declarations at runtime.
+
+"""
+
+import os
+import argparse
+from cffi import FFI
+
+from .library import LIBRARIES, precompiled_module_name
+
+API_MODE_LIBRARIES = ('bus', 'pump', 'valve', 'dio')
+
+
+def _strip_unresolved_defines(header):
+    # `#define X ...` is rejected in out-of-line ABI mode, and in API mode
+    # only works for integer constants, not for declaration macros like
+    # `USL_DECL`, which pyqmix never uses anyway.
+    lines = [line for line in header.splitlines()
+             if not (line.strip().startswith('#define') and '...' in line)]
+    return '\n'.join(lines)
+
+
+def make_builder(name, api_mode=False, lib_dir=None):
+    """
+    Create a CFFI builder for one of the Qmix SDK libraries.
+
+    Parameters
+    ----------
+    name : str
+        The name of the library, i.e. one of the keys of
+        :data:`pyqmix.library.LIBRARIES`.
+
+    api_mode : bool
+        Whether to build a C extension module linked against the SDK import
+        library. If ``False``, build an out-of-line ABI module.
+
+    lib_dir : str or None
+        The directory containing the Qmix SDK import libraries. Only used
+        in API mode.
+
+    Returns
+    -------
+    cffi.FFI
+        The configured builder.
+
+    """
+    dll_filename, header = LIBRARIES[name]
+    module_name = precompiled_module_name(name)
+
+    header = _strip_unresolved_defines(header)
+    ffibuilder = FFI()
+    ffibuilder.cdef(header)
+
+    if api_mode:
+        # The declarations are valid C, so they double as the prototypes
+        # for the generated wrapper code.
+        library_dirs = [lib_dir] if lib_dir else []
+        ffibuilder.set_source(module_name, header,
+                              libraries=[os.path.splitext(dll_filename)[0]],
+                              library_dirs=library_dirs)
+    else:
+        ffibuilder.set_source(module_name, None)
+
+    return ffibuilder
+
+
+def build(names=None, api_mode=False, lib_dir=None, verbose=False):
+    """
+    Build the precompiled modules and place them inside the pyqmix package.
+
+    Parameters
+    ----------
+    names : list of str or None
+        The libraries to build. If ``None``, build all libraries.
+
+    api_mode : bool
+        Whether to build C extension modules for the labbCAN libraries.
+
+    lib_dir : str or None
+        The directory containing the Qmix SDK import libraries.
+
+    verbose : bool
+        Whether to print compiler output.
+
+    """
+    if names is None:
+        names = sorted(LIBRARIES.keys())
+
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    target_dir = os.path.dirname(package_dir)
+
+    for name in names:
+        api = api_mode and name in API_MODE_LIBRARIES
+        ffibuilder = make_builder(name, api_mode=api, lib_dir=lib_dir)
+        ffibuilder.compile(tmpdir=target_dir, verbose=verbose)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build precompiled CFFI modules for the Qmix SDK.')
+    parser.add_argument('libraries', nargs='*',
+                        help='Libraries to build (default: all).')
+    parser.add_argument('--api', action='store_true',
+                        help='Build C extension modules for the labbCAN '
+                             'libraries (requires a C compiler).')
+    parser.add_argument('--lib-dir', default=None,
+                        help='Directory containing the Qmix SDK import '
+                             'libraries (API mode only).')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    build(names=args.libraries or None, api_mode=args.api,
+          lib_dir=args.lib_dir, verbose=args.verbose)
+
+
+if __name__ == '__main__':
+    main()
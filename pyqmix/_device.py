@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from .error import error_from_code
+from .retry import INHERIT, retry_call
+
+
+class _SDKDevice(object):
+    """
+    Base class of all objects issuing Qmix SDK calls.
+
+    Subclasses set ``_functions`` to the function table of their
+    :class:`pyqmix.library.QmixLibrary`.
+
+    """
+    # The policy for retrying failed SDK calls; see `pyqmix.retry`.
+    retry_policy = INHERIT
+
+    def _call(self, func_name, *args):
+        r = self._functions[func_name](*args)
+        if r < 0:
+            return retry_call(self, func_name, args, error_from_code(r))
+        return r
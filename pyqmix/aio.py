@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+asyncio interface for pump operations.
+
+This module requires Python 3.5 or newer.
+
+Example::
+
+    import asyncio
+    from pyqmix import QmixPump
+    from pyqmix.aio import AsyncQmixPump
+
+    async def main():
+        pumps = [AsyncQmixPump(QmixPump(index=i)) for i in range(3)]
+        await asyncio.gather(*[p.dispense(volume=1, flow_rate=0.5)
+                               for p in pumps])
+
+    asyncio.get_event_loop().run_until_complete(main())
+
+"""
+
+import asyncio
+
+from .tools import clock
+from .waiting import WaitTimeout
+
+
+class AsyncQmixPump(object):
+    """
+    Coroutine versions of the pumping methods of a pump.
+
+    Every pumping coroutine issues its command and then completes once
+    pumping has finished, without blocking the event loop while waiting.
+    Cancelling a pumping coroutine (e.g., via :func:`asyncio.Task.cancel`
+    or a timeout in :func:`asyncio.wait_for`) stops the pump.
+
+    All attributes not defined here, e.g. `fill_level` or `stop()`, are
+    passed through to the wrapped pump.
+
+    Parameters
+    ----------
+    pump : :class:`pyqmix.QmixPump`
+        The pump to operate.
+
+    Notes
+    -----
+    Issuing a command and polling the pump state are short, blocking DLL
+    calls that are run on the event loop thread. If the pump is registered
+    with a running :class:`pyqmix.monitor.PumpMonitor`, waiting only reads
+    the cached state.
+
+    """
+    def __init__(self, pump):
+        self.pump = pump
+
+    def __getattr__(self, name):
+        return getattr(self.pump, name)
+
+    async def _poll(self, condition, timeout=None, wait_start=None,
+                    start=None, expected_duration=None):
+        pump = self.pump
+
+        if wait_start is None:
+            wait_start = clock()
+
+        while not condition():
+            now = clock()
+
+            if pump._uses_monitor():
+                interval = 1. / pump.monitor.rate
+            else:
+                elapsed = now - (start or wait_start)
+                interval = pump.poll_strategy.interval(elapsed,
+                                                       expected_duration)
+
+            if timeout is not None:
+                remaining = timeout - (now - wait_start)
+                if remaining <= 0:
+                    raise WaitTimeout('Operation did not complete within '
+                                      '%.3f s.' % timeout)
+                interval = min(interval, remaining)
+
+            await asyncio.sleep(interval)
+
+    async def _wait_until_done(self, timeout=None, wait_for_start=True,
+                               condition=None, operation=None):
+        # Bind the operation that was just issued, so that a later command
+        # on the same pump does not change what is waited for. An untracked
+        # `operation` is resolved here, or handed to the watcher if waiting
+        # fails.
+        pump = self.pump
+        start = pump._operation_start
+        expected_duration = pump._expected_duration
+        started, finished = pump._completion_conditions(
+            start, pump._operation_level, expected_duration)
+        if condition is None:
+            condition = finished
+
+        wait_start = clock()
+
+        try:
+            if wait_for_start:
+                # Ends at the latest shortly after the expected end of the
+                # operation, also for moves that were never seen pumping.
+                await self._poll(started, timeout=timeout,
+                                 wait_start=wait_start, start=start,
+                                 expected_duration=expected_duration)
+            await self._poll(condition, timeout=timeout,
+                             wait_start=wait_start, start=start,
+                             expected_duration=expected_duration)
+        except asyncio.CancelledError:
+            self.pump.stop()
+            if operation is not None:
+                operation._track()
+            raise
+        except BaseException:
+            if operation is not None:
+                operation._track()
+            raise
+
+        if operation is not None:
+            operation._resolve()
+
+    async def wait(self, timeout=None):
+        """
+        Wait until the current pumping operation has finished.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Maximum time to wait in seconds. If ``None``, wait indefinitely.
+
+        Raises
+        ------
+        pyqmix.waiting.WaitTimeout
+            If the operation did not finish within `timeout` seconds. The
+            pump is **not** stopped in this case.
+
+        """
+        await self._wait_until_done(timeout=timeout, wait_for_start=False)
+
+    async def calibrate(self, timeout=None):
+        """
+        Execute a reference move and wait until it has finished.
+
+        See :func:`pyqmix.QmixPump.calibrate`.
+
+        """
+        pump = self.pump
+        pump.calibrate(wait_until_done=False)
+        await self._wait_until_done(
+            timeout=timeout, wait_for_start=False,
+            condition=lambda: pump.is_calibration_finished)
+
+    async def aspirate(self, volume, flow_rate,
+                       switch_valve_when_done=False, timeout=None):
+        """
+        Aspirate a volume and wait until done.
+
+        See :func:`pyqmix.QmixPump.aspirate`.
+
+        """
+        pump = self.pump
+        command = pump._prepare_aspirate(volume, flow_rate)
+        operation = pump._start(command, track=False)
+        await self._wait_until_done(timeout=timeout, operation=operation)
+
+        if switch_valve_when_done:
+            pump.valve.switch_position(pump.valve.dispense_pos)
+
+    async def dispense(self, volume, flow_rate,
+                       switch_valve_when_done=False, timeout=None):
+        """
+        Dispense a volume and wait until done.
+
+        See :func:`pyqmix.QmixPump.dispense`.
+
+        """
+        pump = self.pump
+        command = pump._prepare_dispense(volume, flow_rate)
+        operation = pump._start(command, track=False)
+        await self._wait_until_done(timeout=timeout, operation=operation)
+
+        if switch_valve_when_done:
+            pump.valve.switch_position(pump.valve.aspirate_pos)
+
+    async def set_fill_level(self, level, flow_rate,
+                             switch_valve_when_done=False, timeout=None):
+        """
+        Pump until the requested fill level is reached.
+
+        See :func:`pyqmix.QmixPump.set_fill_level`.
+
+        """
+        pump = self.pump
+        command = pump._prepare_set_fill_level(level, flow_rate)
+        operation = pump._start(command, track=False)
+        await self._wait_until_done(timeout=timeout, operation=operation)
+
+        if switch_valve_when_done:
+            pump.valve.switch_position(pump.valve.aspirate_pos)
+
+    async def generate_flow(self, flow_rate, switch_valve_when_done=False,
+                            timeout=None):
+        """
+        Generate a flow until the syringe is empty or full.
+
+        See :func:`pyqmix.QmixPump.generate_flow`.
+
+        """
+        pump = self.pump
+        command = pump._prepare_generate_flow(flow_rate)
+        operation = pump._start(command, track=False)
+        await self._wait_until_done(timeout=timeout, operation=operation)
+
+        if switch_valve_when_done:
+            pump.valve.switch_position(pump.valve.aspirate_pos)
+
+    async def fill(self, flow_rate, switch_valve_when_done=False,
+                   timeout=None):
+        """
+        Fill the syringe.
+
+        See :func:`pyqmix.QmixPump.fill`.
+
+        """
+        if flow_rate <= 0:
+            raise ValueError('Flow rate must be positive.')
+
+        await self.generate_flow(
+            -flow_rate, switch_valve_when_done=switch_valve_when_done,
+            timeout=timeout)
+
+    async def empty(self, flow_rate, switch_valve_when_done=False,
+                    timeout=None):
+        """
+        Empty the syringe.
+
+        See :func:`pyqmix.QmixPump.empty`.
+
+        """
+        if flow_rate <= 0:
+            raise ValueError('Flow rate must be positive.')
+
+        await self.generate_flow(
+            flow_rate, switch_valve_when_done=switch_valve_when_done,
+            timeout=timeout)
@@ -4,18 +4,24 @@
 import os
 import sys
 import time
-from cffi import FFI
+import warnings
 
 if sys.version_info[0] < 3:
     # Python 2 compatibility; requires `future` package.
     from builtins import bytes
 
 from . import config
-from .tools import CHK, find_dll
-from .headers import BUS_HEADER
+from ._device import _SDKDevice
+from .library import load_library
+from .error import QmixError
+from .waiting import AdaptiveBackoff, WaitTimeout, wait_until
+from .inventory import DeviceInventory
 
+# The delay after opening and after starting the bus in ``sleep`` mode.
+STARTUP_DELAY = 1.
 
-class QmixBus(object):
+
+class QmixBus(_SDKDevice):
     """
     Qmix bus interface.
 
@@ -35,24 +41,42 @@ class QmixBus(object):
         can commence, setting `auto_start=True` will always open the bus,
         regardless of the `auto_open` parameter specified.
 
+    ready_mode : str
+        How to wait for the bus to become usable after opening and after
+        starting it. ``probe`` polls the pump and valve libraries until
+        devices have been detected and every detected pump and valve
+        responds, and returns as soon as they do. ``sleep`` waits a fixed
+        second each time.
+
+    ready_timeout : float
+        The maximum time to wait in ``probe`` mode, in seconds. If the
+        devices still do not respond by then, e.g. because no pumps or
+        valves are connected, waiting ends with a :class:`RuntimeWarning`.
+
+    Attributes
+    ----------
+    is_ready : bool or None
+        Whether the devices were found to be ready when the bus was last
+        opened or started, i.e. ``False`` if waiting timed out. ``None`` in
+        ``sleep`` mode, or if the bus has not been opened yet.
+
     """
 
-    def __init__(self, auto_open=True, auto_start=True):
-        dll_dir = config.read_config().get('qmix_dll_dir', None)
-        dll_filename = 'labbCAN_Bus_API.dll'
+    def __init__(self, auto_open=True, auto_start=True, ready_mode='probe',
+                 ready_timeout=5.):
+        if ready_mode not in ('probe', 'sleep'):
+            raise ValueError("ready_mode must be 'probe' or 'sleep'.")
 
-        dll_path = find_dll(dll_dir=dll_dir, dll_filename=dll_filename)
-        if dll_path is None:
-            msg = 'Could not find the Qmix SDK DLL %s.' % dll_filename
-            raise RuntimeError(msg)
-        else:
-            self.dll_path = dll_path
+        self.ready_mode = ready_mode
+        self.ready_timeout = ready_timeout
 
-        self._ffi = FFI()
-        self._ffi.cdef(BUS_HEADER)
-        self._dll = self._ffi.dlopen(self.dll_path)
+        self._library = load_library('bus')
+        self.dll_path = self._library.dll_path
+        self._ffi = self._library.ffi
+        self._dll = self._library.lib
+        self._functions = self._library.functions
 
-        config_dir = config.read_config().get('qmix_config_dir')
+        config_dir = config._get('qmix_config_dir')
         if config_dir is not None:
             self.config_dir = config_dir
         else:
@@ -71,6 +95,8 @@ class QmixBus(object):
 
         self.is_open = False
         self.is_started = False
+        self.is_ready = None
+        self._inventory = None
 
         if self.auto_open:
             self.open()
@@ -81,27 +107,132 @@ class QmixBus(object):
             self.start()
 
     def __del__(self):
-        self.stop()
-        self.close()
+        # Only release what this instance still holds; the bus may have
+        # been stopped and reopened by another instance since.
+        if getattr(self, 'is_started', False):
+            self.stop()
+        if getattr(self, 'is_open', False):
+            self.close()
+
+    @staticmethod
+    def _probe_libraries():
+        # The libraries used to probe for devices, with the functions
+        # returning the number of devices and a handle, and a query that
+        # only succeeds once a device is operational.
+        probes = []
+        for name, count, get_handle, query in (
+                ('pump', 'LCP_GetNoOfPumps', 'LCP_GetPumpHandle',
+                 'LCP_IsEnabled'),
+                ('valve', 'LCV_GetNoOfValves', 'LCV_GetValveHandle',
+                 'LCV_ActualValvePosition')):
+            try:
+                library = load_library(name)
+            except Exception:  # DLL not installed.
+                continue
+            probes.append((library, count, get_handle, query))
+        return probes
+
+    def _devices_detected(self):
+        for library, count, _, _ in self._probe_libraries():
+            try:
+                if library.call(count) > 0:
+                    return True
+            except QmixError:
+                pass
+        return False
+
+    def _devices_operational(self):
+        # Every detected device has to respond, and there has to be at least
+        # one.
+        n_devices = 0
+        for library, count, get_handle, query in self._probe_libraries():
+            handle = library.ffi.new('dev_hdl *', 0)
+            try:
+                n = library.call(count)
+                for index in range(n):
+                    library.call(get_handle, index, handle)
+                    library.call(query, handle[0])
+            except QmixError:
+                return False
+            n_devices += n
+
+        return n_devices > 0
+
+    def _wait_until_ready(self, probe, action):
+        if self.ready_mode == 'sleep' or not self._probe_libraries():
+            time.sleep(STARTUP_DELAY)
+            return None
+
+        strategy = AdaptiveBackoff(min_interval=0.001, max_interval=0.05)
+        try:
+            wait_until(probe, strategy=strategy, timeout=self.ready_timeout)
+        except WaitTimeout:
+            msg = ('No devices were ready %.1f s after %s the bus.'
+                   % (self.ready_timeout, action))
+            warnings.warn(msg, RuntimeWarning, stacklevel=3)
+            return False
+
+        return True
+
+    @property
+    def inventory(self):
+        """
+        The devices on the bus.
+
+        The devices are enumerated on first access after the bus has been
+        started; call :meth:`scan` to enumerate them again.
+
+        Returns
+        -------
+        pyqmix.inventory.DeviceInventory
+            The inventory.
 
-    def _call(self, func_name, *args):
-        func = getattr(self._dll, func_name)
-        r = func(*args)
-        return CHK(r)
+        """
+        if self._inventory is None:
+            self.scan()
+        return self._inventory
+
+    def scan(self):
+        """
+        Enumerate the devices on the bus.
+
+        Returns
+        -------
+        pyqmix.inventory.DeviceInventory
+            The inventory, also available as :attr:`inventory`.
+
+        """
+        if not self.is_started:
+            msg = ('Bus communication needs to be started before devices '
+                   'can be enumerated. Call `QmixBus.start()` first.')
+            raise RuntimeError(msg)
+
+        self._inventory = DeviceInventory()
+        return self._inventory
 
     def open(self):
         """
         Initialize labbCAN bus.
 
         Initializes resources for a labbCAN bus instance, opens the bus and
-        scans for connected devices.
+        scans for connected devices. Returns once devices have been
+        detected; see the `ready_mode` parameter.
+
+        Returns
+        -------
+        bool or None
+            Whether devices were detected, i.e. ``False`` if waiting timed
+            out, or ``None`` in ``sleep`` mode. Also available as
+            :attr:`is_ready`.
 
         """
         self._call('LCB_Open',
                    self._p_config_dir,
                    self._p_plugin_search_path)
-        time.sleep(1)
+        self.is_ready = self._wait_until_ready(self._devices_detected,
+                                               'opening')
         self.is_open = True
+        return self.is_ready
 
     def close(self):
         """
@@ -110,6 +241,7 @@ class QmixBus(object):
         """
         self._call('LCB_Close')
         self.is_open = False
+        self._inventory = None
 
     def start(self):
         """
@@ -117,7 +249,15 @@ class QmixBus(object):
 
         Sets all connected devices operational and enables them.
         Connected devices can be accessed only after this method has been
-        invoked.
+        invoked. Returns once all devices respond; see the `ready_mode`
+        parameter.
+
+        Returns
+        -------
+        bool or None
+            Whether all devices responded, i.e. ``False`` if waiting timed
+            out, or ``None`` in ``sleep`` mode. Also available as
+            :attr:`is_ready`.
 
         """
         if not self.is_open:
@@ -126,8 +266,10 @@ class QmixBus(object):
             raise RuntimeError(msg)
 
         self._call('LCB_Start')
-        time.sleep(1)
+        self.is_ready = self._wait_until_ready(self._devices_operational,
+                                               'starting')
         self.is_started = True
+        return self.is_ready
 
     def stop(self):
         """
@@ -140,3 +282,4 @@ class QmixBus(object):
         """
         self._call('LCB_Stop')
         self.is_started = False
+        self._inventory = None
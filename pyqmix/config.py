@@ -6,10 +6,17 @@ pyqmix configuration.
 """
 
 import os
+import copy
+import time
+import atexit
+import threading
 from collections import OrderedDict
+from contextlib import contextmanager
 from ruamel.yaml import YAML
 from appdirs import user_config_dir
 
+from .tools import atomic_write
+
 yaml = YAML()
 yaml.default_flow_style = False
 
@@ -21,38 +28,196 @@ DEFAULT_CONFIGS_DIR = os.path.normpath('C:/Users/Public/Documents/'
                                        'QmixElements/Projects/default_project/'
                                        'Configurations')
 
+BACKENDS = ('dll', 'sim')
+
+# Changes are written to disk at most this many seconds after they were
+# made; all changes made in the meantime are written at once.
+FLUSH_DELAY = 0.5
+
 # Python 2 compatibility
 try:
     FileNotFoundError
 except NameError:
     FileNotFoundError = IOError
 
+# The parsed configuration, shared by all readers and writers.
+_cache = dict(path=None, cfg=None, signature=None, dirty=False,
+              batch_depth=0, timer=None)
+_lock = threading.RLock()
+
+
+def _default_config():
+    return OrderedDict([('qmix_dll_dir', ''),
+                        ('qmix_config_dir', ''),
+                        ('pumps', OrderedDict())])
+
+
+def _file_signature(path):
+    # Modification time and size identify a version of the file on disk.
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size
+
+
+def _modified_time():
+    # When the configuration was last changed, in seconds since the epoch;
+    # None if there is no configuration file.
+    with _lock:
+        if _cache['dirty']:
+            return time.time()
+        try:
+            return os.path.getmtime(PYQMIX_CONFIG_FILE)
+        except OSError:
+            return None
+
+
+def _load():
+    """
+    Return the cached configuration, (re-)reading it from disk only if the
+    configuration file has been changed by someone else.
+
+    The returned object is shared; use :func:`_save` after modifying it.
+
+    """
+    with _lock:
+        path = PYQMIX_CONFIG_FILE
+
+        if _cache['dirty']:
+            if _cache['path'] == path:
+                # Unsaved changes take precedence.
+                return _cache['cfg']
+            # Don't lose changes to a previously used configuration file.
+            flush()
+
+        signature = _file_signature(path)
+        if (_cache['cfg'] is not None and _cache['path'] == path and
+                _cache['signature'] == signature):
+            return _cache['cfg']
+
+        try:
+            with open(path, 'r') as f:
+                cfg = yaml.load(f)
+        except FileNotFoundError:
+            try:
+                os.makedirs(PYQMIX_CONFIG_DIR)
+            except OSError:
+                if not os.path.isdir(PYQMIX_CONFIG_DIR):
+                    raise
+
+            cfg = _default_config()
+
+        _cache.update(path=path, cfg=cfg, signature=signature, dirty=False)
+        return cfg
+
+
+def _save(cfg):
+    """
+    Store a modified configuration. Writing to disk is deferred by
+    `FLUSH_DELAY`, or until the outermost :func:`batch` block exits.
+
+    """
+    with _lock:
+        _cache.update(path=PYQMIX_CONFIG_FILE, cfg=cfg, dirty=True)
+        if _cache['batch_depth'] == 0 and _cache['timer'] is None:
+            timer = threading.Timer(FLUSH_DELAY, flush)
+            timer.daemon = True
+            _cache['timer'] = timer
+            timer.start()
+
+
+@contextmanager
+def _modify():
+    """
+    Load the configuration, modify it inside the block, and store it, all
+    while holding the lock. Nothing is stored if the block raises.
+
+    """
+    with _lock:
+        cfg = _load()
+        yield cfg
+        _save(cfg)
+
+
+def _get(key, default=None):
+    """
+    Return a top-level entry of the cached configuration without copying
+    it. The returned object is shared and must not be modified.
+
+    """
+    with _lock:
+        return _load().get(key, default)
+
+
+def flush():
+    """
+    Write pending configuration changes to disk.
+
+    Changes are written automatically `FLUSH_DELAY` seconds after they were
+    made, when a :func:`batch` block exits, and when Python exits.
+
+    """
+    with _lock:
+        if _cache['timer'] is not None:
+            _cache['timer'].cancel()
+            _cache['timer'] = None
+
+        if not _cache['dirty']:
+            return
+
+        path = _cache['path']
+        with atomic_write(path) as f:
+            yaml.dump(_cache['cfg'], f)
+
+        _cache.update(signature=_file_signature(path), dirty=False)
+
+
+atexit.register(flush)
+
+
+@contextmanager
+def batch():
+    """
+    Coalesce all configuration changes made inside the block into a single
+    write to disk.
+
+    Blocks can be nested; changes are written once the outermost block
+    exits, even if an exception was raised.
+
+    Examples
+    --------
+    >>> with config.batch():
+    ...     pumps = [QmixPump(index=i) for i in range(20)]
+
+    """
+    with _lock:
+        _cache['batch_depth'] += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _cache['batch_depth'] -= 1
+            if _cache['batch_depth'] == 0:
+                flush()
+
 
 def read_config():
     """
-    Read the currently stored pyqmix configuration from disk.
+    Read the currently stored pyqmix configuration.
+
+    The configuration file is only parsed again if it has been modified
+    since it was last read or written by pyqmix. Changes that have not been
+    written to disk yet are included.
 
     Returns
     -------
     cfg : dict
-        The loaded configuration.
+        A copy of the loaded configuration.
 
     """
-    try:
-        with open(PYQMIX_CONFIG_FILE, 'r') as f:
-            cfg = yaml.load(f)
-    except FileNotFoundError:
-        try:
-            os.makedirs(PYQMIX_CONFIG_DIR)
-        except OSError:
-            if not os.path.isdir(PYQMIX_CONFIG_DIR):
-                raise
-
-        cfg = OrderedDict([('qmix_dll_dir', ''),
-                           ('qmix_config_dir', ''),
-                           ('pumps', OrderedDict())])
-
-    return cfg
+    with _lock:
+        return copy.deepcopy(_load())
 
 
 def delete_config():
@@ -62,6 +227,12 @@ def delete_config():
     """
     # Try to remove config file. Avoid error if the file has already
     # been deleted.
+    with _lock:
+        if _cache['timer'] is not None:
+            _cache['timer'].cancel()
+        _cache.update(path=None, cfg=None, signature=None, dirty=False,
+                      timer=None)
+
     try:
         os.remove(PYQMIX_CONFIG_FILE)
     except OSError:
@@ -145,11 +316,8 @@ def set_qmix_config(config_name, configs_dir=None):
         msg = 'The specified configuration does not exist: %s' % config_dir
         raise ValueError(msg)
 
-    cfg = read_config()
-    cfg['qmix_config_dir'] = config_dir
-
-    with open(PYQMIX_CONFIG_FILE, 'w') as f:
-        yaml.dump(cfg, f)
+    with _modify() as cfg:
+        cfg['qmix_config_dir'] = config_dir
 
 
 def set_qmix_dll_dir(d):
@@ -162,11 +330,59 @@ def set_qmix_dll_dir(d):
         The Qmix SDK DLL directory. Must be an absolute path.
 
     """
-    cfg = read_config()
-    cfg['qmix_dll_dir'] = d
+    with _modify() as cfg:
+        cfg['qmix_dll_dir'] = d
+
+
+def set_backend(backend):
+    """
+    Select the implementation of the Qmix SDK to use.
 
-    with open(PYQMIX_CONFIG_FILE, 'w') as f:
-        yaml.dump(cfg, f)
+    Takes effect for all Qmix SDK libraries that have not been loaded yet.
+    The environment variable ``PYQMIX_BACKEND`` takes precedence over this
+    setting.
+
+    Parameters
+    ----------
+    backend : str
+        ``dll`` to use the Qmix SDK DLLs, or ``sim`` to use the simulated
+        devices provided by :mod:`pyqmix.sim`.
+
+    Raises
+    ------
+    ValueError
+        If an unknown backend was specified.
+
+    """
+    if backend not in BACKENDS:
+        msg = ('Unknown backend: %s. Must be one of: %s.'
+               % (backend, ', '.join(BACKENDS)))
+        raise ValueError(msg)
+
+    with _modify() as cfg:
+        cfg['backend'] = backend
+
+
+def get_backend():
+    """
+    Return the name of the selected Qmix SDK implementation.
+
+    Returns
+    -------
+    str
+        ``dll`` or ``sim``; see :func:`set_backend`.
+
+    """
+    backend = os.environ.get('PYQMIX_BACKEND')
+    if not backend:
+        backend = _get('backend') or 'dll'
+
+    if backend not in BACKENDS:
+        msg = ('Unknown backend: %s. Must be one of: %s.'
+               % (backend, ', '.join(BACKENDS)))
+        raise ValueError(msg)
+
+    return backend
 
 
 def add_pump(index):
@@ -184,16 +400,13 @@ def add_pump(index):
     if not isinstance(index, int):
         raise TypeError('Pump index must be an integer!')
 
-    cfg = read_config()
-    cfg['pumps'][index] = OrderedDict(
-        [('name', None),
-         ('volume_unit', None),
-         ('flow_unit', None),
-         ('syringe_params', None),
-         ('drive_pos_counter', None)])
-
-    with open(PYQMIX_CONFIG_FILE, 'w') as f:
-        yaml.dump(cfg, f)
+    with _modify() as cfg:
+        cfg['pumps'][index] = OrderedDict(
+            [('name', None),
+             ('volume_unit', None),
+             ('flow_unit', None),
+             ('syringe_params', None),
+             ('drive_pos_counter', None)])
 
 
 def set_pump_name(index, name):
@@ -209,12 +422,9 @@ def set_pump_name(index, name):
         The desired name of the pump.
 
     """
-    cfg = read_config()
-    pump = cfg['pumps'][index]
-    pump['name'] = name
-
-    with open(PYQMIX_CONFIG_FILE, 'w') as f:
-        yaml.dump(cfg, f)
+    with _modify() as cfg:
+        pump = cfg['pumps'][index]
+        pump['name'] = name
 
 
 def set_pump_drive_pos_counter(index, value):
@@ -230,12 +440,9 @@ def set_pump_drive_pos_counter(index, value):
         The value to set the drive position counter to.
 
     """
-    cfg = read_config()
-    pump = cfg['pumps'][index]
-    pump['drive_pos_counter'] = value
-
-    with open(PYQMIX_CONFIG_FILE, 'w') as f:
-        yaml.dump(cfg, f)
+    with _modify() as cfg:
+        pump = cfg['pumps'][index]
+        pump['drive_pos_counter'] = value
 
 
 def set_pump_volume_unit(index, prefix, unit):
@@ -255,13 +462,10 @@ def set_pump_volume_unit(index, prefix, unit):
         The volume unit identifier: ``litres``.
 
     """
-    cfg = read_config()
-    pump = cfg['pumps'][index]
-    pump['volume_unit'] = OrderedDict([('prefix', prefix),
-                                       ('unit', unit)])
-
-    with open(PYQMIX_CONFIG_FILE, 'w') as f:
-        yaml.dump(cfg, f)
+    with _modify() as cfg:
+        pump = cfg['pumps'][index]
+        pump['volume_unit'] = OrderedDict([('prefix', prefix),
+                                           ('unit', unit)])
 
 
 def set_pump_flow_unit(index, prefix, volume_unit, time_unit):
@@ -285,14 +489,11 @@ def set_pump_flow_unit(index, prefix, volume_unit, time_unit):
         ``per_hour``, ``per_minute``, ``per_second``.
 
     """
-    cfg = read_config()
-    pump = cfg['pumps'][index]
-    pump['flow_unit'] = OrderedDict([('prefix', prefix),
-                                     ('volume_unit', volume_unit),
-                                     ('time_unit', time_unit)])
-
-    with open(PYQMIX_CONFIG_FILE, 'w') as f:
-        yaml.dump(cfg, f)
+    with _modify() as cfg:
+        pump = cfg['pumps'][index]
+        pump['flow_unit'] = OrderedDict([('prefix', prefix),
+                                         ('volume_unit', volume_unit),
+                                         ('time_unit', time_unit)])
 
 
 def set_pump_syringe_params(index, inner_diameter_mm, max_piston_stroke_mm):
@@ -315,14 +516,11 @@ def set_pump_syringe_params(index, inner_diameter_mm, max_piston_stroke_mm):
         syringe pump pusher.
 
     """
-    cfg = read_config()
-    pump = cfg['pumps'][index]
-    pump['syringe_params'] = OrderedDict(
-        [('inner_diameter_mm', inner_diameter_mm),
-         ('max_piston_stroke_mm', max_piston_stroke_mm)])
-
-    with open(PYQMIX_CONFIG_FILE, 'w') as f:
-        yaml.dump(cfg, f)
+    with _modify() as cfg:
+        pump = cfg['pumps'][index]
+        pump['syringe_params'] = OrderedDict(
+            [('inner_diameter_mm', inner_diameter_mm),
+             ('max_piston_stroke_mm', max_piston_stroke_mm)])
 
 
 def remove_pump(index):
@@ -341,13 +539,10 @@ def remove_pump(index):
         file.
 
     """
-    cfg = read_config()
-
-    try:
-        del cfg['pumps'][index]
-        with open(PYQMIX_CONFIG_FILE, 'w') as f:
-            yaml.dump(cfg, f)
-    except KeyError:
-        msg = ('Specified pump index could not be found in the configuration '
-               'file.')
-        raise KeyError(msg)
+    with _modify() as cfg:
+        try:
+            del cfg['pumps'][index]
+        except KeyError:
+            msg = ('Specified pump index could not be found in the '
+                   'configuration file.')
+            raise KeyError(msg)
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Continuous flow from two syringe pumps.
+
+A :class:`ContinuousFlowPair` combines two pumps into one constant-flow
+output: while one syringe dispenses, the other one refills at a higher
+rate. The handover from one pump to the other is scheduled from the
+predicted end of stroke of the dispensing syringe, rather than by polling
+its fill level::
+
+    pair = ContinuousFlowPair(pump_1, pump_2)
+    pair.start(flow_rate=0.1)
+    ...
+    pair.stop()
+    print(pair.report())
+
+At every handover, the incoming pump is started a short `overlap` before
+the outgoing one is stopped, to bridge its start-up. The volume delivered
+in a window around every handover is measured; if its deviation from the
+requested flow (the pulsation) exceeds `max_pulsation`, the overlap of the
+next handover is corrected accordingly.
+
+If neither syringe holds enough liquid to dispense until the other one has
+been refilled, e.g. when both are empty, the fuller one is filled before
+the flow starts.
+"""
+
+import time
+import threading
+from collections import namedtuple
+
+from .tools import clock
+from .profile import (_default_spin_time, _high_timer_resolution,
+                      _raise_thread_priority, _sleep_until)
+
+#: A handover of a continuous flow from one pump to the next, at `time`
+#: seconds after the flow was started. `gap` and `overlap` are the measured
+#: times in seconds during which neither and both pumps were pumping, or
+#: ``None`` if the pumps were not observed starting and stopping in time.
+#: The remaining fields are only measured by :class:`ContinuousFlowPair`,
+#: and ``None`` otherwise: `timing_error` is how late the handover was
+#: issued, `pulsation` is the relative deviation of the volume delivered
+#: during the measurement window from the requested volume, and
+#: `overlap_setting` is the overlap that was scheduled.
+Handover = namedtuple('Handover', ['time', 'from_pump', 'to_pump',
+                                   'timing_error', 'gap', 'overlap',
+                                   'pulsation', 'overlap_setting'])
+
+# How long a refill may take longer than predicted before an idle pump is
+# considered refilled, in seconds.
+_REFILL_MARGIN = 1.
+
+
+def _gap_and_overlap(started, stopped):
+    # The times during which neither and both pumps were pumping, given
+    # when the incoming pump was seen to start and the outgoing one to stop.
+    if started is None or stopped is None:
+        return None, None
+    return max(started - stopped, 0.), max(stopped - started, 0.)
+
+
+class ContinuousFlowPair(object):
+    """
+    Deliver a constant flow with two alternating pumps.
+
+    Parameters
+    ----------
+    pump_1, pump_2 : :class:`pyqmix.QmixPump`
+        The pumps. They must use the same flow and volume units, and their
+        outlets must be joined.
+
+    refill_rate : float or None
+        The flow rate to refill with. If ``None``, use the maximum flow
+        rate of the slower pump.
+
+    overlap : float
+        The initial time in seconds between starting the incoming and
+        stopping the outgoing pump.
+
+    max_pulsation : float
+        The maximum tolerated relative deviation of the volume delivered
+        around a handover. If exceeded, the overlap is corrected.
+
+    window : float
+        The length of the window around every handover in which the
+        delivered volume is measured, in seconds.
+
+    reserve : float
+        The fraction of the maximum volume left in a syringe at the
+        handover, so the plunger does not hit its end stop.
+
+    valve_lead : float
+        How long before a handover to switch the valve of the refilled pump
+        to its dispense position, in seconds.
+
+    spin_time : float or None
+        How long before a deadline to stop sleeping and spin instead, in
+        seconds. If ``None``, 2 ms, or 20 ms on Windows if the resolution
+        of the system timer cannot be raised.
+
+    high_priority : bool
+        Whether to try to raise the priority of the handover thread.
+
+    """
+    def __init__(self, pump_1, pump_2, refill_rate=None, overlap=0.05,
+                 max_pulsation=0.05, window=1., reserve=0.02, valve_lead=0.5,
+                 spin_time=None, high_priority=True):
+        if pump_1 is pump_2:
+            raise ValueError('Please specify two different pumps.')
+        if (pump_1.volume_unit != pump_2.volume_unit or
+                pump_1.flow_unit != pump_2.flow_unit):
+            raise ValueError('The pumps must use the same flow and volume '
+                             'units.')
+        if not 0 <= overlap < window / 2.:
+            raise ValueError('The overlap must be shorter than half the '
+                             'measurement window.')
+
+        self.pumps = (pump_1, pump_2)
+        if refill_rate is None:
+            refill_rate = min(pump.max_flow_rate for pump in self.pumps)
+        self.refill_rate = refill_rate
+        self.overlap = overlap
+        self.max_pulsation = max_pulsation
+        self.window = window
+        self.reserve = reserve
+        self.valve_lead = valve_lead
+        if spin_time is None:
+            spin_time = _default_spin_time()
+        self.spin_time = spin_time
+        self.high_priority = high_priority
+
+        self.flow_rate = None
+        self.active_pump = None
+        self.start_time = None
+        self.handovers = []
+        self.has_high_priority = False
+        self.error = None
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def is_running(self):
+        """
+        Whether the flow is being delivered.
+
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def predict(self, flow_rate):
+        """
+        Predict the cycle of the pair for a flow rate.
+
+        Parameters
+        ----------
+        flow_rate : float
+            The flow rate to deliver.
+
+        Returns
+        -------
+        dict
+            The time a full syringe dispenses (``dispense_time``) and needs
+            to refill (``refill_time``), and the time left between the end
+            of a refill and the next handover (``slack``), in seconds.
+
+        """
+        pump = self.pumps[0]
+        volume = (1 - self.reserve) * pump.volume_max
+        dispense_time = pump._estimate_duration(volume, flow_rate)
+        refill_time = pump._estimate_duration(volume, self.refill_rate)
+        return dict(dispense_time=dispense_time, refill_time=refill_time,
+                    slack=dispense_time - refill_time - self.valve_lead -
+                    self.window / 2. - self.overlap)
+
+    def start(self, flow_rate):
+        """
+        Start delivering a constant flow.
+
+        The pump holding more liquid dispenses first, while the other one
+        refills. If it cannot dispense until the other one has been
+        refilled, it is filled first, which delays the start of the flow.
+
+        Parameters
+        ----------
+        flow_rate : float > 0
+            The flow rate.
+
+        Raises
+        ------
+        ValueError
+            If the flow rate exceeds the maximum flow rate of a pump, or if
+            the refill rate is too low to refill a syringe before the other
+            one runs empty.
+
+        """
+        if self.is_running:
+            raise RuntimeError('The flow has already been started.')
+        if flow_rate <= 0:
+            raise ValueError('Flow rate must be positive.')
+        for pump in self.pumps:
+            if flow_rate > pump.max_flow_rate:
+                msg = ('The flow rate exceeds the maximum flow rate of a '
+                       'pump, %f.' % pump.max_flow_rate)
+                raise ValueError(msg)
+        if self.predict(flow_rate)['slack'] <= 0:
+            raise ValueError('The refill rate is too low to sustain this '
+                             'flow rate.')
+
+        self.flow_rate = flow_rate
+        self.handovers = []
+        self.error = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='ContinuousFlowPair')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the flow and both pumps.
+
+        """
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+
+    def report(self):
+        """
+        Summarize the handovers.
+
+        Returns
+        -------
+        dict
+            The number of handovers, the largest measured ``max_gap`` and
+            ``max_overlap`` in seconds, the largest absolute
+            ``max_pulsation``, the number of handovers that exceeded the
+            tolerated pulsation (``n_exceeded``), and the current
+            ``overlap`` setting.
+
+        """
+        handovers = self.handovers
+        report = dict(n_handovers=len(handovers), max_gap=None,
+                      max_overlap=None, max_pulsation=None,
+                      n_exceeded=0, overlap=self.overlap)
+        if handovers:
+            pulsations = [abs(h.pulsation) for h in handovers]
+            # The gap and overlap of a handover are None if the pumps could
+            # not be observed starting or stopping within the window.
+            gaps = [h.gap for h in handovers if h.gap is not None]
+            overlaps = [h.overlap for h in handovers if h.overlap is not None]
+            report.update(
+                max_gap=max(gaps) if gaps else None,
+                max_overlap=max(overlaps) if overlaps else None,
+                max_pulsation=max(pulsations),
+                n_exceeded=sum(p > self.max_pulsation for p in pulsations))
+        return report
+
+    def _cancelled(self):
+        return self._stop_event.is_set()
+
+    def _sleep_until(self, deadline):
+        return _sleep_until(deadline, self._stop_event, self.spin_time,
+                            self._cancelled)
+
+    def _refill(self, pump):
+        volume = pump.volume_max
+        return pump.set_fill_level(volume, self.refill_rate)
+
+    def _refill_time(self, pump):
+        volume = pump.volume_max - pump.fill_level
+        return max(pump._estimate_duration(volume, self.refill_rate), 0)
+
+    def _wait_for_refill(self, pump, refill, deadline):
+        # Wait for a refill until the deadline. If it has not resolved by
+        # then, accept the pump if it is idle and holds more than the
+        # reserve, and consider the refill done. Returns False if stopped.
+        while not refill.done():
+            if clock() >= deadline:
+                if (pump.is_pumping or
+                        pump.fill_level <= self.reserve * pump.volume_max):
+                    raise RuntimeError('The refill of a pump did not '
+                                       'finish in time.')
+                refill._resolve()
+                return True
+            if self._stop_event.wait(0.01):
+                return False
+
+        refill.result()  # Raise if the refill failed.
+        return True
+
+    def _end_of_stroke(self, pump):
+        # Predict when the dispensing pump reaches its reserve.
+        volume = pump.fill_level - self.reserve * pump.volume_max
+        return clock() + max(pump._estimate_duration(volume, self.flow_rate),
+                             0)
+
+    def _observe(self, condition, deadline):
+        # Poll a condition until it is met, and return when that happened,
+        # or None if the deadline passed first.
+        while clock() < deadline and not self._stop_event.is_set():
+            if condition():
+                return clock()
+            time.sleep(0.0005)
+        return None
+
+    def _hand_over(self, outgoing, incoming, planned, refill):
+        window_start = planned - self.window / 2.
+        window_end = planned + self.window / 2.
+
+        # Wait for the refill, and switch the valve ahead of time.
+        if self._sleep_until(planned - self.valve_lead - self.window / 2.):
+            return False
+        if not self._wait_for_refill(incoming, refill, planned):
+            return False
+        incoming.valve.switch_position(incoming.valve.dispense_pos)
+
+        if self._sleep_until(window_start):
+            return False
+        levels = (outgoing.fill_level, incoming.fill_level)
+        measured_start = clock()
+
+        if self._sleep_until(planned):
+            return False
+        issued = clock()
+        incoming.generate_flow(self.flow_rate)
+        overlap_setting = self.overlap
+        started = self._observe(lambda: incoming.is_pumping,
+                                issued + overlap_setting)
+        if self._sleep_until(issued + overlap_setting):
+            return False
+        outgoing.stop()
+
+        stopped = self._observe(lambda: not outgoing.is_pumping, window_end)
+        if started is None:
+            started = self._observe(lambda: incoming.is_pumping, window_end)
+        if self._sleep_until(window_end):
+            return False
+        delivered = ((levels[0] - outgoing.fill_level) +
+                     (levels[1] - incoming.fill_level))
+        expected = (self.flow_rate * (clock() - measured_start) *
+                    outgoing.flow_scale)
+        pulsation = delivered / expected - 1
+
+        gap, overlap = _gap_and_overlap(started, stopped)
+        self.handovers.append(Handover(
+            time=issued - self.start_time, from_pump=outgoing,
+            to_pump=incoming, timing_error=issued - planned, gap=gap,
+            overlap=overlap, pulsation=pulsation,
+            overlap_setting=overlap_setting))
+
+        if abs(pulsation) > self.max_pulsation:
+            # Bridge the missing or excess volume by a longer or shorter
+            # overlap next time.
+            correction = -(delivered - expected) / (self.flow_rate *
+                                                    outgoing.flow_scale)
+            self.overlap = min(max(self.overlap + correction, 0.),
+                               self.window / 2. - self.spin_time)
+        return True
+
+    def _run(self):
+        try:
+            if self.high_priority:
+                self.has_high_priority = _raise_thread_priority()
+            with _high_timer_resolution():
+                self._cycle()
+        except Exception as e:
+            self.error = e
+        finally:
+            for pump in self.pumps:
+                try:
+                    pump.stop()
+                except Exception as e:
+                    self.error = self.error or e
+            self.active_pump = None
+
+    def _cycle(self):
+        active, idle = sorted(self.pumps, key=lambda p: p.fill_level,
+                              reverse=True)
+
+        # Fill the first syringe if it would run empty before the other one
+        # has been refilled.
+        required = (self._refill_time(idle) + self.valve_lead +
+                    self.window / 2. + self.overlap)
+        volume = active.fill_level - self.reserve * active.volume_max
+        if (volume <= 0 or
+                active._estimate_duration(volume, self.flow_rate) < required):
+            deadline = clock() + self._refill_time(active) + _REFILL_MARGIN
+            if not self._wait_for_refill(active, self._refill(active),
+                                         deadline):
+                return
+
+        active.valve.switch_position(active.valve.dispense_pos)
+        self.start_time = clock()
+        active.generate_flow(self.flow_rate)
+        self.active_pump = active
+        refill = self._refill(idle)
+
+        while not self._stop_event.is_set():
+            planned = self._end_of_stroke(active) - self.overlap
+            if not self._hand_over(active, idle, planned, refill):
+                return
+
+            active, idle = idle, active
+            self.active_pump = active
+            refill = self._refill(idle)
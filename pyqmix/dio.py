@@ -3,23 +3,21 @@
 
 import os
 import sys
-from cffi import FFI
 
 if sys.version_info[0] < 3:
     # Python 2 compatibility; requires `future` package.
     from builtins import bytes
 
-from . import config
-from .tools import CHK, find_dll
-from .headers import DIGITAL_IO_HEADER
+from ._device import _SDKDevice
+from .library import load_library
 
 
-class QmixDigitalIO(object):
+class QmixDigitalIO(_SDKDevice):
     """
     Qmix IO-B digital I/O channel.
 
     """
-    def __init__(self, index=None, name=''):
+    def __init__(self, index=None, name='', handle=None):
         """
         Parameters
         ----------
@@ -31,41 +29,35 @@ class QmixDigitalIO(object):
         name : str
             The name of the DIO channel to initialize. Will be ignored if `index` is
             not `None`.
+
+        handle : int or None
+            The device handle of the output channel, e.g. from
+            :class:`pyqmix.inventory.DeviceInventory`. If specified, it is
+            used directly, and `index` and `name` are only recorded.
         """
-        if index is None and name == '':
+        if index is None and name == '' and handle is None:
             raise ValueError('Please specify a valid DIO index or name.')
         else:
             self.index = index
             self.name = name
 
-        dll_dir = config.read_config().get('qmix_dll_dir', None)
-        dll_filename = 'labbCAN_DigIO_API.dll'
-
-        dll_path = find_dll(dll_dir=dll_dir, dll_filename=dll_filename)
-        if dll_path is None:
-            msg = 'Could not find the Qmix SDK DLL %s.' % dll_filename
-            raise RuntimeError(msg)
-        else:
-            self.dll_path = dll_path
-
-        self._ffi = FFI()
-        self._ffi.cdef(DIGITAL_IO_HEADER)
-        self._dll = self._ffi.dlopen(self.dll_path)
+        self._library = load_library('dio')
+        self.dll_path = self._library.dll_path
+        self._ffi = self._library.ffi
+        self._dll = self._library.lib
+        self._functions = self._library.functions
 
         self._handle = self._ffi.new('dev_hdl *', 0)
 
-        if self.index is not None:
+        if handle is not None:
+            self._handle[0] = handle
+        elif self.index is not None:
             self._call('LCDIO_GetOutChanHandle', self.index, self._handle)
         else:
             self._call('LCDIO_LookupOutChanByName',
                        bytes(self.name, 'utf8'),
                        self._handle)
 
-    def _call(self, func_name, *args):
-        func = getattr(self._dll, func_name)
-        r = func(*args)
-        return CHK(r)
-
     @property
     def is_output_on(self):
         """
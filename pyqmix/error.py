@@ -1,44 +1,278 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import os
-from cffi import FFI
+"""
+Qmix SDK errors.
 
-from . import config
-from .tools import find_dll
-from .headers import ERROR_HEADER
+All errors returned by Qmix SDK functions are raised as :class:`QmixError`,
+or one of its subclasses if the error code belongs to a known category::
 
+    QmixError (RuntimeError)
+     +-- QmixBusyError
+     +-- QmixTimeoutError
+     +-- QmixNoDeviceError
+     +-- QmixInvalidArgumentError
+     +-- QmixDeviceStateError
+     +-- QmixCommunicationError
 
-class QmixError(object):
+Error messages are looked up only once per error code, and cached.
+"""
+
+import threading
+from collections import OrderedDict
+
+from .library import load_library
+from .headers import ERROR_HEADER, parse_defines
+
+# Error code -> (symbol, description), from the ``ERR_*`` defines of the
+# Qmix SDK. Where several symbols share a code, the first one is kept.
+ERROR_CODES = OrderedDict()
+for _symbol, (_code, _description) in parse_defines(ERROR_HEADER).items():
+    ERROR_CODES.setdefault(_code, (_symbol, _description))
+del _symbol, _code, _description
+
+_SYMBOLS = dict((symbol, code) for code, (symbol, _)
+                in ERROR_CODES.items())
+
+_messages = dict()
+_messages_lock = threading.Lock()
+
+
+def _load_messages():
+    # Query the DLL for the messages of all known error codes at once. The
+    # descriptions in the C declarations serve as fallback if the DLL is
+    # unavailable.
+    messages = dict((code, description) for code, (_, description)
+                    in ERROR_CODES.items())
+    try:
+        library = load_library('error')
+    except Exception:
+        return messages, None
+
+    for code in ERROR_CODES:
+        message = _dll_message(library, code)
+        if message:
+            messages[code] = message
+
+    return messages, library
+
+
+def _dll_message(library, code):
+    s = library.lib.ErrorToString(code)
+    if s == library.ffi.NULL:
+        return None
+    return library.ffi.string(s).decode('utf8')
+
+
+_library = None
+
+
+def error_message(error_number):
     """
-    Qmix SDK error messages.
+    Return the message describing an error code.
+
+    Parameters
+    ----------
+    error_number : int
+        The error code, as returned by an SDK function (i.e., negative) or
+        as positive number.
+
+    Returns
+    -------
+    str
+        The error message.
 
     """
-    def __init__(self, error_number):
-        dll_dir = config.read_config().get('qmix_dll_dir', None)
-        dll_filename = 'usl.dll'
+    global _library
+
+    code = abs(int(error_number))
+    try:
+        return _messages[code]
+    except KeyError:
+        pass
+
+    with _messages_lock:
+        if not _messages:
+            messages, _library = _load_messages()
+            _messages.update(messages)
 
-        dll_path = find_dll(dll_dir=dll_dir, dll_filename=dll_filename)
-        if dll_path is None:
-            msg = 'Could not find the Qmix SDK DLL %s.' % dll_filename
-            raise RuntimeError(msg)
-        else:
-            self.dll_path = dll_path
+        if code not in _messages:
+            message = None
+            if _library is not None:
+                message = _dll_message(_library, code)
+            _messages[code] = message or 'Unknown error'
 
-        self._ffi = FFI()
-        self._ffi.cdef(ERROR_HEADER)
-        self._dll = self._ffi.dlopen(self.dll_path)
+    return _messages[code]
 
-        self.error_number = error_number
-        self._error_code = self._ffi.new('TErrCode *')
+
+class QmixError(RuntimeError):
+    """
+    An error returned by a Qmix SDK function.
+
+    Parameters
+    ----------
+    error_number : int
+        The error code, as returned by the SDK function.
+
+    Attributes
+    ----------
+    error_number : int
+        The error code, as returned by the SDK function (i.e., negative).
+
+    code : int
+        The absolute value of the error code.
+
+    symbol : str or None
+        The name of the error code in the SDK, e.g. ``ERR_BUSY``, or
+        ``None`` if the code is unknown.
+
+    error_string : str
+        The error message.
+
+    """
+    #: The ``ERR_*`` symbols raised as this class.
+    symbols = ()
+
+    def __init__(self, error_number):
+        self.error_number = int(error_number)
+        self.code = abs(self.error_number)
+        self.symbol = ERROR_CODES.get(self.code, (None, None))[0]
+        self.error_string = error_message(self.code)
+
+        msg = (self.error_string + ", Error number: " +
+               str(self.error_number) + ", Error code: " + self.error_code)
+        super(QmixError, self).__init__(msg)
+
+    def __reduce__(self):
+        return self.__class__, (self.error_number,)
 
     @property
     def error_code(self):
-        self._error_code = hex(abs(self.error_number))
-        return self._error_code
+        """
+        The error code as hexadecimal string.
 
-    @property
-    def error_string(self):
-        e = self.error_code
-        s = self._dll.ErrorToString(int(e, 16))
-        return self._ffi.string(s).decode('utf8')
+        """
+        return hex(self.code)
+
+
+class QmixBusyError(QmixError):
+    """
+    The device or a resource is busy; the operation may succeed later.
+
+    """
+    symbols = ('ERR_AGAIN', 'ERR_BUSY', 'ERR_INPROGRESS', 'ERR_ALREADY',
+               'ERR_CANO_DLL_TXFULL', 'ERR_CANO_SDO_ABORT_NO_RESOURCE')
+
+
+class QmixTimeoutError(QmixError):
+    """
+    The operation or the communication with a device timed out.
+
+    """
+    symbols = ('ERR_NET_TIMEDOUT', 'ERR_COMM_DLL_TIMEOUT',
+               'ERR_CANO_DLL_TIMEOUT', 'ERR_CANO_SDO_ABORT_TIMEOUT',
+               'ERR_CANO_LSS_TIMEOUT', 'ERR_DS402_TIMEOUT_OPMODE_ACTIVATION',
+               'ERR_DS402_TIMEOUT_STATUSWORD',
+               'ERR_DS402_TIMEOUT_STATUSWORD_PDO',
+               'ERR_DS402_DRV_ENABLE_TIMEOUT')
+
+
+class QmixNoDeviceError(QmixError):
+    """
+    The requested device does not exist or could not be found.
+
+    """
+    symbols = ('ERR_NOENT', 'ERR_NODEV', 'ERR_NET_NXIO',
+               'ERR_CANO_DLL_HW_NOT_FOUND', 'ERR_CANO_DLL_HW_NOT_AVAILABLE',
+               'ERR_CANO_CAL_NO_DEVICES')
+
+
+class QmixInvalidArgumentError(QmixError):
+    """
+    An argument was invalid or out of range.
+
+    """
+    symbols = ('ERR_INVAL', 'ERR_RANGE', 'ERR_PARAM_RANGE',
+               'ERR_CANO_DLL_PARA', 'ERR_CANO_SDO_ABORT_VALUE_INVALID',
+               'ERR_CANO_SDO_ABORT_VALUE_HIGH', 'ERR_CANO_SDO_ABORT_VALUE_LOW',
+               'ERR_CANO_SDO_ABORT_MAX_LESS_MIN')
+
+
+class QmixDeviceStateError(QmixError):
+    """
+    The device or the bus is not in a state that permits the operation,
+    e.g. the bus has not been started or the drive is in fault state.
+
+    """
+    symbols = ('ERR_DEVSTATE', 'ERR_CANO_DLL_NOT_INITIALIZED',
+               'ERR_CANO_SDO_ABORT_DATA_DEV_STATE',
+               'ERR_DS402_DRV_ENABLE_FAULT_STATE',
+               'ERR_DS402_DRV_DISABLE_FAULT_STATE',
+               'ERR_DS402_DRV_STATE_FAULT_REACTION')
+
+
+class QmixCommunicationError(QmixError):
+    """
+    An error on the CAN bus or serial link, or in the CANopen protocol.
+
+    All ``ERR_COMM_*`` and ``ERR_CANO_*`` codes not covered by a more
+    specific class are raised as this class.
+
+    """
+    prefixes = ('ERR_COMM_', 'ERR_CANO_')
+
+
+def _build_error_classes():
+    classes = dict()
+    for cls in (QmixBusyError, QmixTimeoutError, QmixNoDeviceError,
+                QmixInvalidArgumentError, QmixDeviceStateError):
+        for symbol in cls.symbols:
+            classes[_SYMBOLS[symbol]] = cls
+
+    for code, (symbol, _) in ERROR_CODES.items():
+        if (code not in classes and
+                symbol.startswith(QmixCommunicationError.prefixes)):
+            classes[code] = QmixCommunicationError
+
+    return classes
+
+
+# Error code -> exception class.
+_ERROR_CLASSES = _build_error_classes()
+
+
+def error_class(error_number):
+    """
+    Return the exception class raised for an error code.
+
+    Parameters
+    ----------
+    error_number : int
+        The error code, as returned by an SDK function (i.e., negative) or
+        as positive number.
+
+    Returns
+    -------
+    type
+        :class:`QmixError` or one of its subclasses.
+
+    """
+    return _ERROR_CLASSES.get(abs(int(error_number)), QmixError)
+
+
+def error_from_code(error_number):
+    """
+    Create the exception for an error code returned by an SDK function.
+
+    Parameters
+    ----------
+    error_number : int
+        The error code, as returned by the SDK function.
+
+    Returns
+    -------
+    QmixError
+        An instance of :class:`QmixError` or one of its subclasses.
+
+    """
+    return error_class(error_number)(error_number)
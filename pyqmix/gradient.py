@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Mixing gradients with multiple pumps.
+
+A :class:`GradientSchedule` splits a total flow between several pumps
+according to a composition that changes over time, e.g. a linear gradient
+from pure water to pure salt solution::
+
+    schedule = GradientSchedule.linear(start=(1, 0), stop=(0, 1),
+                                       total_flow=0.5, duration=60)
+    player = PumpGroup([water_pump, salt_pump]).play_gradient(schedule)
+
+The per-pump flows of all setpoints are computed at once, and the
+schedule is checked against the maximum flow rate and fill level of every
+pump before any pump is started. A :class:`GradientPlayer` then updates
+all pumps back-to-back at every setpoint, from a single thread; see
+:mod:`pyqmix.profile`.
+
+Requires NumPy.
+"""
+
+import numpy as np
+
+from .profile import _SetpointPlayer
+
+
+class GradientSchedule(object):
+    """
+    Flow setpoints for several pumps.
+
+    Usually created via :meth:`from_composition`, :meth:`from_function`, or
+    :meth:`linear`.
+
+    Parameters
+    ----------
+    times : array_like, shape (n,)
+        The times of the setpoints in seconds, relative to the start of
+        playback. Must start at zero and be strictly increasing.
+
+    flows : array_like, shape (n, n_pumps)
+        The flow rate of every pump at every setpoint, in the flow unit of
+        the pump. Must not be negative; zero stops a pump.
+
+    duration : float
+        The duration of the schedule in seconds; the last setpoint is held
+        until then.
+
+    """
+    def __init__(self, times, flows, duration):
+        times = np.asarray(times, dtype=float)
+        flows = np.asarray(flows, dtype=float)
+
+        if times.ndim != 1 or len(times) == 0:
+            raise ValueError('Please specify at least one setpoint.')
+        if flows.ndim != 2 or len(flows) != len(times):
+            raise ValueError('Please specify the flow rates of all pumps at '
+                             'every setpoint.')
+        if times[0] != 0:
+            raise ValueError('The first setpoint must be at time zero.')
+        if np.any(np.diff(times) <= 0):
+            raise ValueError('Times must be strictly increasing.')
+        if duration <= times[-1]:
+            raise ValueError('The duration must be later than the last '
+                             'setpoint.')
+        if np.any(flows < 0):
+            raise ValueError('Flow rates must not be negative.')
+
+        self.times = times
+        self.flows = flows
+        self.duration = float(duration)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        return ('<GradientSchedule: %d pumps, %d setpoints, %.3f s>'
+                % (self.n_pumps, len(self), self.duration))
+
+    @property
+    def n_pumps(self):
+        """
+        The number of pumps.
+
+        """
+        return self.flows.shape[1]
+
+    @property
+    def total_flow(self):
+        """
+        The total flow rate at every setpoint.
+
+        """
+        return self.flows.sum(axis=1)
+
+    def volumes(self):
+        """
+        The cumulative volume dispensed by every pump by the end of every
+        setpoint.
+
+        Returns
+        -------
+        numpy.ndarray, shape (n, n_pumps)
+            The volumes in units of the flow rate times seconds.
+
+        """
+        durations = np.diff(np.append(self.times, self.duration))
+        return np.cumsum(self.flows * durations[:, np.newaxis], axis=0)
+
+    def check(self, max_flow_rates, fill_levels, volume_scales=1.):
+        """
+        Check that the pumps can follow the schedule.
+
+        Parameters
+        ----------
+        max_flow_rates : array_like, shape (n_pumps,)
+            The maximum flow rate of every pump.
+
+        fill_levels : array_like, shape (n_pumps,)
+            The current fill level of every pump.
+
+        volume_scales : array_like, shape (n_pumps,), or float
+            Factors converting flow rate times seconds to the volume unit of
+            every pump.
+
+        Raises
+        ------
+        ValueError
+            If a pump would exceed its maximum flow rate, or run empty.
+
+        """
+        peak_flows = self.flows.max(axis=0)
+        too_fast = np.flatnonzero(peak_flows > np.asarray(max_flow_rates))
+        if len(too_fast):
+            i = too_fast[0]
+            msg = ('Pump %d would exceed its maximum flow rate: %f > %f.'
+                   % (i, peak_flows[i], np.asarray(max_flow_rates)[i]))
+            raise ValueError(msg)
+
+        volumes = self.volumes()[-1] * volume_scales
+        too_little = np.flatnonzero(volumes > np.asarray(fill_levels))
+        if len(too_little):
+            i = too_little[0]
+            msg = ('Pump %d would run empty: it needs %f, but only holds %f.'
+                   % (i, volumes[i], np.asarray(fill_levels)[i]))
+            raise ValueError(msg)
+
+    @classmethod
+    def from_composition(cls, times, composition, total_flow, duration=None,
+                         tolerance=0.):
+        """
+        Split a total flow according to a sampled composition.
+
+        Parameters
+        ----------
+        times : array_like, shape (n,)
+            The sample times in seconds, strictly increasing. Shifted so
+            that playback starts with the first sample.
+
+        composition : array_like, shape (n, n_pumps)
+            The fraction of the total flow delivered by every pump; rows are
+            normalized to sum to one.
+
+        total_flow : float or array_like, shape (n,)
+            The total flow rate.
+
+        duration : float or None
+            The duration of the schedule. If ``None``, the last sample is
+            held for as long as the one before it.
+
+        tolerance : float
+            Samples are only turned into setpoints if the flow of at least
+            one pump changes by about `tolerance` or more. The flows of
+            every setpoint still sum to the total flow exactly.
+
+        Returns
+        -------
+        GradientSchedule
+            The schedule.
+
+        """
+        times = np.asarray(times, dtype=float)
+        composition = np.asarray(composition, dtype=float)
+        if composition.ndim != 2 or len(composition) != len(times):
+            raise ValueError('Please specify the composition at every '
+                             'sample time.')
+        if np.any(composition < 0):
+            raise ValueError('Fractions must not be negative.')
+
+        sums = composition.sum(axis=1, keepdims=True)
+        if np.any(sums == 0):
+            raise ValueError('Every composition needs a non-zero fraction.')
+
+        flows = (composition / sums *
+                 np.asarray(total_flow, dtype=float).reshape(-1, 1))
+
+        times = times - times[0]
+        if duration is None:
+            if len(times) > 1:
+                duration = 2 * times[-1] - times[-2]
+            else:
+                raise ValueError('Please specify the duration of a single '
+                                 'sample.')
+
+        # Keep the samples at which the flow of any pump moves into a
+        # different bin of width `tolerance`.
+        if tolerance > 0:
+            levels = np.floor(flows / tolerance)
+        else:
+            levels = flows
+        keep = np.ones(len(times), dtype=bool)
+        keep[1:] = np.any(levels[1:] != levels[:-1], axis=1)
+
+        return cls(times[keep], flows[keep], duration)
+
+    @classmethod
+    def from_function(cls, function, total_flow, duration, interval=0.1,
+                      tolerance=0.):
+        """
+        Split a total flow according to a composition given as a function of
+        time.
+
+        Parameters
+        ----------
+        function : callable
+            Called with an array of times in seconds; returns the
+            composition at these times as an array of shape
+            ``(len(times), n_pumps)``.
+
+        total_flow : float or callable
+            The total flow rate, or a function returning it at an array of
+            times.
+
+        duration : float
+            The duration of the schedule in seconds.
+
+        interval : float
+            The interval between setpoints in seconds.
+
+        tolerance : float
+            See :meth:`from_composition`.
+
+        Returns
+        -------
+        GradientSchedule
+            The schedule.
+
+        """
+        n = max(int(np.ceil(duration / interval)), 1)
+        times = np.arange(n) * (duration / n)
+        # Evaluate every interval at its center.
+        centers = times + duration / n / 2.
+        if callable(total_flow):
+            total_flow = total_flow(centers)
+
+        return cls.from_composition(times, function(centers), total_flow,
+                                    duration=duration, tolerance=tolerance)
+
+    @classmethod
+    def linear(cls, start, stop, total_flow, duration, **kwargs):
+        """
+        A linear change of composition.
+
+        Parameters
+        ----------
+        start, stop : array_like, shape (n_pumps,)
+            The compositions at the beginning and end of the gradient.
+
+        total_flow : float or callable
+            The total flow rate, or a function returning it at an array of
+            times.
+
+        duration : float
+            The duration of the gradient in seconds.
+
+        kwargs
+            Further keyword arguments passed to :meth:`from_function`.
+
+        """
+        start = np.asarray(start, dtype=float)
+        stop = np.asarray(stop, dtype=float)
+
+        def function(t):
+            return start + np.outer(t / duration, stop - start)
+
+        return cls.from_function(function, total_flow, duration, **kwargs)
+
+
+class GradientPlayer(_SetpointPlayer):
+    """
+    Play back a gradient schedule on several pumps.
+
+    Usually created via :func:`pyqmix.PumpGroup.play_gradient`. At every
+    setpoint, the pumps whose flow changes are updated back-to-back; the
+    `latencies` of the player are the time needed to update all of them.
+
+    Parameters
+    ----------
+    pumps : sequence of :class:`pyqmix.QmixPump` instances
+        The pumps, in the order of the columns of the schedule.
+
+    schedule : GradientSchedule
+        The schedule to play.
+
+    auto_start : bool
+        Whether to start playback on object instantiation.
+
+    kwargs
+        Further keyword arguments as for
+        :class:`pyqmix.profile.ProfilePlayer`.
+
+    Raises
+    ------
+    ValueError
+        If the number of pumps does not match the schedule, or if a pump
+        would exceed its maximum flow rate or run empty.
+
+    """
+    thread_name = 'GradientPlayer'
+
+    def __init__(self, pumps, schedule, auto_start=False, **kwargs):
+        self.schedule = schedule
+        # Python floats, so the playback loop does not handle NumPy scalars.
+        self._rows = schedule.flows.tolist()
+        super(GradientPlayer, self).__init__(pumps, schedule.times.tolist(),
+                                             schedule.duration, **kwargs)
+        if auto_start:
+            self.start()
+
+    def _validate(self):
+        pumps = self.pumps
+        if len(pumps) != self.schedule.n_pumps:
+            msg = ('The schedule is for %d pumps, but %d were specified.'
+                   % (self.schedule.n_pumps, len(pumps)))
+            raise ValueError(msg)
+
+        self.schedule.check(
+            max_flow_rates=[pump.max_flow_rate for pump in pumps],
+            fill_levels=[pump.fill_level for pump in pumps],
+            volume_scales=np.array([pump.flow_scale for pump in pumps]))
+
+    def _prepare(self):
+        for pump in self.pumps:
+            self._switch_valve(pump, 1.)
+        self._current = [None] * len(self.pumps)
+
+    def _issue(self, i):
+        current = self._current
+        for j, flow in enumerate(self._rows[i]):
+            if flow != current[j]:
+                self._issue_flow(self.pumps[j], flow)
+                current[j] = flow
@@ -0,0 +1,511 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Synchronized operation of multiple pumps.
+"""
+
+from .tools import clock
+from .waiting import wait_until, WaitCancelled
+from .operation import PumpOperation
+
+
+class PumpGroup(object):
+    """
+    A group of pumps that are operated together.
+
+    All parameters are validated for every pump before any valve is
+    switched or any pump is started. The pumping commands are then issued
+    back-to-back, and waiting for completion uses one shared poll for the
+    entire group.
+
+    Parameters
+    ----------
+    pumps : sequence of :class:`pyqmix.QmixPump` instances
+        The pumps to operate.
+
+    Attributes
+    ----------
+    issue_times : list of float or None
+        The times at which the last pumping command was sent to every pump,
+        as returned by :func:`pyqmix.tools.clock`.
+
+    start_times : list of float or None
+        The times at which every pump was first seen to have started after
+        the last pumping command, i.e. was observed pumping, or idle with a
+        changed fill level. Only available after waiting for completion via
+        `wait_until_done=True`.
+
+    """
+    def __init__(self, pumps):
+        self.pumps = list(pumps)
+        if not self.pumps:
+            raise ValueError('Please specify at least one pump.')
+
+        self.issue_times = None
+        self.start_times = None
+
+    def __len__(self):
+        return len(self.pumps)
+
+    def __iter__(self):
+        return iter(self.pumps)
+
+    def __getitem__(self, index):
+        return self.pumps[index]
+
+    @property
+    def issue_skew(self):
+        """
+        Time in seconds between sending the last pumping command to the first
+        and to the last pump of the group.
+
+        """
+        if self.issue_times is None:
+            return None
+        return max(self.issue_times) - min(self.issue_times)
+
+    @property
+    def start_skew(self):
+        """
+        Time in seconds between the first and the last pump of the group
+        being observed pumping. The resolution is limited by the poll
+        interval.
+
+        """
+        if self.start_times is None:
+            return None
+        return max(self.start_times) - min(self.start_times)
+
+    @property
+    def is_pumping(self):
+        """
+        Whether any pump of the group is currently pumping.
+
+        """
+        return any(p.is_pumping for p in self.pumps)
+
+    @property
+    def fill_levels(self):
+        """
+        The current fill levels of all pumps.
+
+        """
+        return [p.fill_level for p in self.pumps]
+
+    def _broadcast(self, values, name):
+        # Expand a scalar to one value per pump; check sequences and
+        # arrays for the correct length.
+        try:
+            values = list(values)
+        except TypeError:
+            values = [values] * len(self)
+
+        if len(values) != len(self):
+            msg = ('Expected %i values for `%s`, but got %i.'
+                   % (len(self), name, len(values)))
+            raise ValueError(msg)
+
+        return [float(v) for v in values]
+
+    def _shared_monitor(self):
+        monitor = self.pumps[0].monitor
+        if (monitor is not None and monitor.is_running and
+                all(p.monitor is monitor for p in self.pumps)):
+            return monitor
+        return None
+
+    def _run(self, commands, wait_until_done, timeout,
+             switch_valve_when_done, final_valve_pos):
+        if switch_valve_when_done:
+            wait_until_done = True
+
+        for pump, command in zip(self.pumps, commands):
+            pump.valve.switch_position(command[0])
+
+        for pump, command in zip(self.pumps, commands):
+            pump._begin_operation(command[3])
+
+        issue_times = []
+        try:
+            for pump, (_, func_name, args, _) in zip(self.pumps, commands):
+                issue_times.append(clock())
+                pump._call(func_name, pump._handle[0], *args)
+        except Exception:
+            # Don't leave part of the group running.
+            for pump in self.pumps[:len(issue_times)]:
+                try:
+                    pump.stop()
+                except Exception:
+                    pass
+            raise
+
+        for pump, issue_time in zip(self.pumps, issue_times):
+            pump._operation_start = issue_time
+
+        self.issue_times = issue_times
+        self.start_times = None
+
+        operations = []
+        for pump in self.pumps:
+            operation = PumpOperation(pump)
+            pump._operation = operation
+            operations.append(operation)
+
+        if not wait_until_done:
+            for operation in operations:
+                operation._track()
+            return operations
+
+        try:
+            self._wait(timeout=timeout, wait_for_start=True)
+        except BaseException:
+            # Let the watcher resolve the operations instead.
+            for operation in operations:
+                operation._track()
+            raise
+
+        for pump in self.pumps:
+            pump.save_drive_pos_counter()
+
+        if switch_valve_when_done:
+            for pump in self.pumps:
+                pump.valve.switch_position(final_valve_pos(pump))
+
+        for operation in operations:
+            operation._resolve()
+
+        return operations
+
+    def _wait(self, timeout=None, wait_for_start=False):
+        pumps = self.pumps
+        monitor = self._shared_monitor()
+        # The same per-pump conditions as for waiting on a single pump, so a
+        # pump whose move ended between two polls does not block the group.
+        conditions = [pump._completion_conditions() for pump in pumps]
+        cancel_events = [pump._cancel_event for pump in pumps]
+
+        def check_cancelled():
+            # Abort once any of the pumps is cancelled.
+            if any(event.is_set() for event in cancel_events):
+                raise WaitCancelled('Waiting was cancelled.')
+
+        if monitor is not None:
+            def wait(condition, timeout, **kwargs):
+                monitor.wait_until(condition, timeout=timeout)
+        else:
+            def wait(condition, timeout, **kwargs):
+                wait_until(condition, strategy=pumps[0].poll_strategy,
+                           timeout=timeout, **kwargs)
+
+        wait_start = clock()
+
+        try:
+            if wait_for_start:
+                start_times = [None] * len(pumps)
+
+                def started():
+                    check_cancelled()
+                    now = clock()
+                    for i, (has_started, _) in enumerate(conditions):
+                        if start_times[i] is None and has_started():
+                            start_times[i] = now
+                    return None not in start_times
+
+                wait(started, timeout)
+                self.start_times = start_times
+
+                if timeout is not None:
+                    timeout = max(timeout - (clock() - wait_start), 0)
+
+            def finished():
+                check_cancelled()
+                return all(has_finished() for _, has_finished in conditions)
+
+            # Time the wait by the longest expected operation.
+            durations = [p._expected_duration for p in pumps]
+            expected_duration = None if None in durations else max(durations)
+            start = min(p._operation_start or wait_start for p in pumps)
+
+            wait(finished, timeout, expected_duration=expected_duration,
+                 start=start)
+        finally:
+            for event in cancel_events:
+                event.clear()
+
+    def wait(self, timeout=None):
+        """
+        Block until all pumps of the group have stopped pumping.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Maximum time to wait in seconds. If ``None``, wait indefinitely.
+
+        Raises
+        ------
+        pyqmix.waiting.WaitTimeout
+            If the pumps did not finish within `timeout` seconds. The pumps
+            are **not** stopped in this case.
+
+        pyqmix.waiting.WaitCancelled
+            If waiting was aborted via :func:`~pyqmix.PumpGroup.cancel`,
+            or :func:`~pyqmix.QmixPump.cancel` of any of the pumps.
+
+        """
+        self._wait(timeout=timeout)
+
+        for pump in self.pumps:
+            pump.save_drive_pos_counter()
+
+    def aspirate(self, volume, flow_rate, wait_until_done=False,
+                 switch_valve_when_done=False, timeout=None):
+        """
+        Aspirate with all pumps.
+
+        Parameters
+        ----------
+        volume : float > 0, or sequence of floats > 0
+            The volume to aspirate, either the same for all pumps or one
+            value per pump.
+
+        flow_rate : float > 0, or sequence of floats > 0
+            The flow rate, either the same for all pumps or one value per
+            pump.
+
+        wait_until_done : bool
+            Whether to block until all pumps are done.
+
+        switch_valve_when_done : bool
+            If set to ``True``, switch all valves to dispense position after
+            the aspiration is finished. Implies `wait_until_done=True`.
+
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        Returns
+        -------
+        list of pyqmix.operation.PumpOperation
+            One future-like handle per pump.
+
+        Raises
+        ------
+        ValueError
+            If the parameters are invalid for any of the pumps. No pump
+            is started in this case.
+
+        """
+        volumes = self._broadcast(volume, 'volume')
+        flow_rates = self._broadcast(flow_rate, 'flow_rate')
+
+        commands = [p._prepare_aspirate(v, f)
+                    for p, v, f in zip(self.pumps, volumes, flow_rates)]
+        return self._run(commands, wait_until_done=wait_until_done,
+                         timeout=timeout,
+                         switch_valve_when_done=switch_valve_when_done,
+                         final_valve_pos=lambda p: p.valve.dispense_pos)
+
+    def dispense(self, volume, flow_rate, wait_until_done=False,
+                 switch_valve_when_done=False, timeout=None):
+        """
+        Dispense with all pumps.
+
+        Parameters
+        ----------
+        volume : float > 0, or sequence of floats > 0
+            The volume to dispense, either the same for all pumps or one
+            value per pump.
+
+        flow_rate : float > 0, or sequence of floats > 0
+            The flow rate, either the same for all pumps or one value per
+            pump.
+
+        wait_until_done : bool
+            Whether to block until all pumps are done.
+
+        switch_valve_when_done : bool
+            If set to ``True``, switch all valves to aspirate position after
+            the dispense is finished. Implies `wait_until_done=True`.
+
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        Returns
+        -------
+        list of pyqmix.operation.PumpOperation
+            One future-like handle per pump.
+
+        Raises
+        ------
+        ValueError
+            If the parameters are invalid for any of the pumps. No pump
+            is started in this case.
+
+        """
+        volumes = self._broadcast(volume, 'volume')
+        flow_rates = self._broadcast(flow_rate, 'flow_rate')
+
+        commands = [p._prepare_dispense(v, f)
+                    for p, v, f in zip(self.pumps, volumes, flow_rates)]
+        return self._run(commands, wait_until_done=wait_until_done,
+                         timeout=timeout,
+                         switch_valve_when_done=switch_valve_when_done,
+                         final_valve_pos=lambda p: p.valve.aspirate_pos)
+
+    def set_fill_level(self, level, flow_rate, wait_until_done=False,
+                       switch_valve_when_done=False, timeout=None):
+        """
+        Pump until all pumps have reached the requested fill levels.
+
+        Parameters
+        ----------
+        level : float >= 0, or sequence of floats >= 0
+            The target fill level, either the same for all pumps or one
+            value per pump.
+
+        flow_rate : float > 0, or sequence of floats > 0
+            The flow rate, either the same for all pumps or one value per
+            pump.
+
+        wait_until_done : bool
+            Whether to block until all pumps are done.
+
+        switch_valve_when_done : bool
+            If set to ``True``, switch all valves to aspirate position after
+            pumping is finished. Implies `wait_until_done=True`.
+
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        Returns
+        -------
+        list of pyqmix.operation.PumpOperation
+            One future-like handle per pump.
+
+        Raises
+        ------
+        ValueError
+            If the parameters are invalid for any of the pumps. No pump
+            is started in this case.
+
+        """
+        levels = self._broadcast(level, 'level')
+        flow_rates = self._broadcast(flow_rate, 'flow_rate')
+
+        commands = [p._prepare_set_fill_level(l, f)
+                    for p, l, f in zip(self.pumps, levels, flow_rates)]
+        return self._run(commands, wait_until_done=wait_until_done,
+                         timeout=timeout,
+                         switch_valve_when_done=switch_valve_when_done,
+                         final_valve_pos=lambda p: p.valve.aspirate_pos)
+
+    def generate_flow(self, flow_rate, wait_until_done=False,
+                      switch_valve_when_done=False, timeout=None):
+        """
+        Generate a continuous flow with all pumps.
+
+        Parameters
+        ----------
+        flow_rate : float != 0, or sequence of floats != 0
+            The flow rate, either the same for all pumps or one value per
+            pump. Positive flow rates dispense, negative flow rates aspirate.
+
+        wait_until_done : bool
+            Whether to block until all pumps are done.
+
+        switch_valve_when_done : bool
+            If set to ``True``, switch all valves to aspirate position after
+            pumping is finished. Implies `wait_until_done=True`.
+
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        Returns
+        -------
+        list of pyqmix.operation.PumpOperation
+            One future-like handle per pump.
+
+        Raises
+        ------
+        ValueError
+            If a flow rate of zero is specified for any of the pumps. No
+            pump is started in this case.
+
+        """
+        flow_rates = self._broadcast(flow_rate, 'flow_rate')
+
+        commands = [p._prepare_generate_flow(f)
+                    for p, f in zip(self.pumps, flow_rates)]
+        return self._run(commands, wait_until_done=wait_until_done,
+                         timeout=timeout,
+                         switch_valve_when_done=switch_valve_when_done,
+                         final_valve_pos=lambda p: p.valve.aspirate_pos)
+
+    def play_gradient(self, schedule, wait_until_done=False, timeout=None,
+                      **kwargs):
+        """
+        Dispense with all pumps, splitting a total flow between them
+        according to a gradient schedule.
+
+        Requires NumPy.
+
+        Parameters
+        ----------
+        schedule : pyqmix.gradient.GradientSchedule
+            The setpoints to play, with one column per pump of the group.
+
+        wait_until_done : bool
+            Whether to block until playback has finished.
+
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        kwargs
+            Further keyword arguments passed to
+            :class:`pyqmix.gradient.GradientPlayer`.
+
+        Returns
+        -------
+        pyqmix.gradient.GradientPlayer
+            The player, reporting the achieved setpoint timing.
+
+        Raises
+        ------
+        ValueError
+            If any pump would exceed its maximum flow rate or run empty. No
+            pump is started in this case.
+
+        """
+        from .gradient import GradientPlayer  # Requires NumPy.
+
+        player = GradientPlayer(self.pumps, schedule, auto_start=True,
+                                **kwargs)
+        if wait_until_done:
+            player.wait(timeout=timeout)
+        return player
+
+    def stop(self):
+        """
+        Immediately stop all pumps of the group.
+
+        """
+        for pump in self.pumps:
+            pump.stop()
+
+    def cancel(self):
+        """
+        Stop all pumps of the group and abort any ongoing wait for
+        completion.
+
+        Threads blocked in a pumping method with `wait_until_done=True`
+        or in :func:`~pyqmix.PumpGroup.wait` will raise
+        :class:`pyqmix.waiting.WaitCancelled`.
+
+        """
+        for pump in self.pumps:
+            pump.cancel()
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import re
+from collections import OrderedDict
+
 BUS_HEADER = """
     typedef long long labb_hdl;    
     typedef long long dev_hdl;
@@ -86,6 +89,7 @@ DIGITAL_IO_HEADER = """
     typedef long long dev_hdl;
     long LCDIO_LookupOutChanByName(const char* pChannelName, dev_hdl * pOutChanHdl);
     long LCDIO_LookupInChanByName(const char* pChannelName, dev_hdl* pInChanHdl);
+    long LCDIO_GetOutChanHandle(unsigned char Index, dev_hdl* pOutChanHdl);
     long LCDIO_WriteOn(dev_hdl OutChanHdl, int On);
     long LCDIO_IsOutputOn(dev_hdl OutChanHdl);
     long LCDIO_IsInputOn(dev_hdl InChanHdl);
@@ -313,3 +317,49 @@ ERROR_HEADER = """
     #define ERR_C_ERRNO                         0x4000  ///< Standard C specific errno error codes ored with 0x4000
     #define ERR_APP                             0x8000  ///< application specific errors start here
 """
+
+
+_DEFINE = re.compile(r'^\s*#define\s+(\w+)\s+(-?0[xX][0-9A-Fa-f]+|-?\d+)'
+                     r'\s*(?:(?:///<|//!<|//)\s*(.*?))?\s*$', re.MULTILINE)
+_FUNCTION = re.compile(r'^\s*[\w\s\*]*?\b(\w+)\s*\(', re.MULTILINE)
+
+
+def parse_defines(header):
+    """
+    Extract the integer constants from C declarations.
+
+    Parameters
+    ----------
+    header : str
+        The C declarations, e.g. :data:`PUMP_HEADER`.
+
+    Returns
+    -------
+    OrderedDict
+        A dictionary mapping constant names to tuples of the integer value
+        and the accompanying comment (or an empty string).
+
+    """
+    defines = OrderedDict()
+    for name, value, comment in _DEFINE.findall(header):
+        defines[name] = (int(value, 0), comment.strip())
+    return defines
+
+
+def parse_functions(header):
+    """
+    Extract the names of all functions declared in C declarations.
+
+    Parameters
+    ----------
+    header : str
+        The C declarations, e.g. :data:`PUMP_HEADER`.
+
+    Returns
+    -------
+    list of str
+        The function names, in order of declaration.
+
+    """
+    return [name for name in _FUNCTION.findall(header)
+            if not name.startswith('define')]
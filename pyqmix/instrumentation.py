@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Instrumentation of Qmix SDK function calls.
+
+All device classes dispatch SDK calls through the ``_call`` method of their
+common base class. When instrumentation is enabled via :func:`enable` (or
+the :func:`instrument` context manager), this method is replaced by a
+version that counts calls, failures, and latencies per SDK function, and
+optionally invokes user-supplied hooks before and after every call.
+:func:`disable` restores the original method, so instrumentation costs
+nothing while disabled.
+
+Example::
+
+    from pyqmix import instrumentation
+
+    with instrumentation.instrument() as stats:
+        pump.dispense(volume=1, flow_rate=0.5, wait_until_done=True)
+
+    print(stats.report())
+
+"""
+
+import bisect
+import threading
+from contextlib import contextmanager
+
+from .tools import clock
+
+# Upper edges of the latency histogram buckets in seconds: four buckets per
+# decade from 1 us to 1 s. The last bucket collects all slower calls.
+HISTOGRAM_EDGES = tuple(10 ** (i / 4.) * 1e-6 for i in range(25))
+
+
+class FunctionStats(object):
+    """
+    Call statistics of a single Qmix SDK function.
+
+    Attributes
+    ----------
+    name : str
+        The name of the SDK function.
+
+    calls : int
+        The number of calls, including failed ones.
+
+    errors : int
+        The number of calls that raised an exception.
+
+    total_time : float
+        The cumulative latency of all calls in seconds.
+
+    min_time, max_time : float or None
+        The smallest and largest latency of a single call in seconds.
+
+    histogram : list of int
+        The number of calls per latency bucket. Bucket ``i`` counts calls
+        faster than ``HISTOGRAM_EDGES[i]``, but not faster than the
+        preceding edge; the last bucket counts all slower calls.
+
+    """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.
+        self.min_time = None
+        self.max_time = None
+        self.histogram = [0] * (len(HISTOGRAM_EDGES) + 1)
+
+    def __repr__(self):
+        return ('<FunctionStats %s: %d calls, %d errors, mean %.1f us>'
+                % (self.name, self.calls, self.errors, self.mean_time * 1e6))
+
+    def _record(self, duration, failed):
+        self.calls += 1
+        self.errors += failed
+        self.total_time += duration
+        if self.min_time is None or duration < self.min_time:
+            self.min_time = duration
+        if self.max_time is None or duration > self.max_time:
+            self.max_time = duration
+        self.histogram[bisect.bisect_left(HISTOGRAM_EDGES, duration)] += 1
+
+    @property
+    def mean_time(self):
+        """
+        The mean latency of a call in seconds.
+
+        """
+        return self.total_time / self.calls if self.calls else 0.
+
+    def percentile(self, q):
+        """
+        Estimate a latency percentile from the histogram.
+
+        Parameters
+        ----------
+        q : float
+            The percentile, between 0 and 100.
+
+        Returns
+        -------
+        float
+            The upper edge of the histogram bucket containing the
+            percentile, limited to the largest observed latency.
+
+        """
+        if not 0 <= q <= 100:
+            raise ValueError('Percentile must be between 0 and 100.')
+        if not self.calls:
+            return 0.
+
+        threshold = q / 100. * self.calls
+        cumulative = 0
+        for i, count in enumerate(self.histogram):
+            cumulative += count
+            if count and cumulative >= threshold:
+                break
+
+        if i < len(HISTOGRAM_EDGES):
+            return min(HISTOGRAM_EDGES[i], self.max_time)
+        return self.max_time
+
+    def as_dict(self):
+        """
+        Return the statistics as a dictionary.
+
+        """
+        return dict(name=self.name, calls=self.calls, errors=self.errors,
+                    total_time=self.total_time, mean_time=self.mean_time,
+                    min_time=self.min_time, max_time=self.max_time,
+                    histogram=list(self.histogram))
+
+
+class CallStats(object):
+    """
+    Call statistics of all instrumented Qmix SDK functions.
+
+    Individual functions can be looked up by name, e.g.
+    ``stats['LCP_IsPumping']``.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._functions = dict()
+
+    def __len__(self):
+        return len(self._functions)
+
+    def __iter__(self):
+        return iter(self.functions)
+
+    def __contains__(self, func_name):
+        return func_name in self._functions
+
+    def __getitem__(self, func_name):
+        return self._functions[func_name]
+
+    def record(self, func_name, duration, failed=False):
+        """
+        Record a call of an SDK function.
+
+        Parameters
+        ----------
+        func_name : str
+            The name of the SDK function.
+
+        duration : float
+            The latency of the call in seconds.
+
+        failed : bool
+            Whether the call raised an exception.
+
+        """
+        with self._lock:
+            stats = self._functions.get(func_name)
+            if stats is None:
+                stats = self._functions[func_name] = FunctionStats(func_name)
+            stats._record(duration, failed)
+
+    def reset(self):
+        """
+        Discard all statistics.
+
+        """
+        with self._lock:
+            self._functions.clear()
+
+    @property
+    def functions(self):
+        """
+        The statistics of all functions called so far, most time-consuming
+        first.
+
+        """
+        with self._lock:
+            functions = list(self._functions.values())
+        return sorted(functions, key=lambda s: s.total_time, reverse=True)
+
+    @property
+    def total_calls(self):
+        """
+        The number of calls of all functions.
+
+        """
+        return sum(s.calls for s in self.functions)
+
+    @property
+    def total_errors(self):
+        """
+        The number of failed calls of all functions.
+
+        """
+        return sum(s.errors for s in self.functions)
+
+    @property
+    def total_time(self):
+        """
+        The cumulative latency of all calls in seconds.
+
+        """
+        return sum(s.total_time for s in self.functions)
+
+    def as_dict(self):
+        """
+        Return the statistics as a dictionary mapping function names to
+        the output of :meth:`FunctionStats.as_dict`.
+
+        """
+        return dict((s.name, s.as_dict()) for s in self.functions)
+
+    def report(self, limit=None):
+        """
+        Format the statistics as a table, most time-consuming function
+        first.
+
+        Parameters
+        ----------
+        limit : int or None
+            Only include this many functions.
+
+        Returns
+        -------
+        str
+            The table.
+
+        """
+        lines = ['%-32s %8s %6s %11s %11s %11s %11s'
+                 % ('function', 'calls', 'errors', 'total [ms]',
+                    'mean [us]', 'p99 [us]', 'max [us]')]
+        for s in self.functions[:limit]:
+            lines.append('%-32s %8d %6d %11.3f %11.1f %11.1f %11.1f'
+                         % (s.name, s.calls, s.errors, s.total_time * 1e3,
+                            s.mean_time * 1e6, s.percentile(99) * 1e6,
+                            s.max_time * 1e6))
+        return '\n'.join(lines)
+
+
+_stats = CallStats()
+_pre_hook = None
+_post_hook = None
+_originals = dict()
+_lock = threading.Lock()
+
+
+def _device_classes():
+    # Imported here to avoid circular imports.
+    from ._device import _SDKDevice
+    return _SDKDevice,
+
+
+def _instrumented(call):
+    def _call(self, func_name, *args):
+        if _pre_hook is not None:
+            _pre_hook(self, func_name, args)
+
+        t0 = clock()
+        try:
+            result = call(self, func_name, *args)
+        except Exception as e:
+            duration = clock() - t0
+            _stats.record(func_name, duration, failed=True)
+            if _post_hook is not None:
+                _post_hook(self, func_name, args, None, duration, e)
+            raise
+
+        duration = clock() - t0
+        _stats.record(func_name, duration)
+        if _post_hook is not None:
+            _post_hook(self, func_name, args, result, duration, None)
+        return result
+
+    _call.__wrapped__ = call
+    return _call
+
+
+def enable(pre_hook=None, post_hook=None):
+    """
+    Start instrumenting all Qmix SDK function calls.
+
+    Parameters
+    ----------
+    pre_hook : callable or None
+        Called as ``pre_hook(device, func_name, args)`` before every call.
+
+    post_hook : callable or None
+        Called as ``post_hook(device, func_name, args, result, duration,
+        error)`` after every call, where `error` is the raised exception or
+        ``None``, and `result` is ``None`` if the call failed.
+
+    Returns
+    -------
+    CallStats
+        The collected statistics.
+
+    Notes
+    -----
+    Hooks are invoked from whichever thread issued the call, e.g. the
+    thread of a :class:`pyqmix.monitor.PumpMonitor`. Exceptions raised by
+    hooks propagate to the caller.
+
+    """
+    global _pre_hook, _post_hook
+
+    with _lock:
+        _pre_hook = pre_hook
+        _post_hook = post_hook
+
+        for cls in _device_classes():
+            if cls not in _originals:
+                _originals[cls] = cls.__dict__['_call']
+                cls._call = _instrumented(_originals[cls])
+
+    return _stats
+
+
+def disable():
+    """
+    Stop instrumenting Qmix SDK function calls.
+
+    The statistics collected so far are retained.
+
+    """
+    global _pre_hook, _post_hook
+
+    with _lock:
+        for cls, call in _originals.items():
+            cls._call = call
+        _originals.clear()
+
+        _pre_hook = None
+        _post_hook = None
+
+
+def is_enabled():
+    """
+    Whether Qmix SDK function calls are being instrumented.
+
+    """
+    return bool(_originals)
+
+
+def get_stats():
+    """
+    Return the statistics collected while instrumentation was enabled.
+
+    Returns
+    -------
+    CallStats
+        The statistics.
+
+    """
+    return _stats
+
+
+@contextmanager
+def instrument(pre_hook=None, post_hook=None, reset=True):
+    """
+    Instrument all Qmix SDK function calls within a ``with`` block.
+
+    Parameters
+    ----------
+    pre_hook, post_hook : callable or None
+        See :func:`enable`.
+
+    reset : bool
+        Whether to discard previously collected statistics first.
+
+    Yields
+    ------
+    CallStats
+        The collected statistics.
+
+    """
+    if reset:
+        _stats.reset()
+
+    stats = enable(pre_hook=pre_hook, post_hook=post_hook)
+    try:
+        yield stats
+    finally:
+        disable()
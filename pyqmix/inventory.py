@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Inventory of the devices connected to the bus.
+
+Constructing a device object normally resolves its handle via the SDK.
+A :class:`DeviceInventory` enumerates all pumps, valves, and digital output
+channels once, and keeps their handles, so device objects can be created
+without any further handle lookups::
+
+    bus = QmixBus()
+    pumps = [bus.inventory.pump(i) for i in range(bus.inventory.n_pumps)]
+    valve = bus.inventory.valve(name='Valve 1')
+
+"""
+
+import sys
+import threading
+
+if sys.version_info[0] < 3:
+    # Python 2 compatibility; requires `future` package.
+    from builtins import bytes
+
+from .library import load_library
+from .error import QmixError
+
+# LCDIO_GetOutChanHandle takes an unsigned char index.
+MAX_DIO_CHANNELS = 256
+
+
+def _load(name):
+    try:
+        return load_library(name)
+    except Exception:  # DLL not installed.
+        return None
+
+
+class DeviceInventory(object):
+    """
+    Handles of all devices on a started bus.
+
+    Usually accessed via :attr:`pyqmix.QmixBus.inventory`.
+
+    Parameters
+    ----------
+    scan : bool
+        Whether to enumerate the devices on object instantiation.
+
+    Notes
+    -----
+    Pumps and valves are enumerated by index. Names are resolved via the
+    SDK the first time they are looked up, and cached. Digital output
+    channels are enumerated including their names.
+
+    """
+    def __init__(self, scan=True):
+        self._lock = threading.RLock()
+        self._pump_library = _load('pump')
+        self._valve_library = _load('valve')
+        self._dio_library = _load('dio')
+
+        self._clear()
+        if scan:
+            self.scan()
+
+    def _clear(self):
+        self.pump_handles = []
+        self.pump_valve_handles = []
+        self.valve_handles = []
+        self.dio_handles = []
+        self.dio_names = []
+
+        self._pump_names = dict()
+        self._valve_names = dict()
+
+    def __repr__(self):
+        return ('<DeviceInventory: %d pumps, %d valves, %d DIO channels>'
+                % (self.n_pumps, self.n_valves, self.n_dio_channels))
+
+    @staticmethod
+    def _get_handle(library, func_name, *args):
+        handle = library.ffi.new('dev_hdl *', 0)
+        library.call(func_name, *(args + (handle,)))
+        return handle[0]
+
+    def scan(self):
+        """
+        Enumerate all devices, discarding the previous inventory.
+
+        """
+        with self._lock:
+            self._clear()
+
+            pumps = self._pump_library
+            if pumps is not None:
+                for index in range(pumps.call('LCP_GetNoOfPumps')):
+                    handle = self._get_handle(pumps, 'LCP_GetPumpHandle',
+                                              index)
+                    try:
+                        valve_handle = self._get_handle(
+                            pumps, 'LCP_GetValveHandle', handle)
+                    except QmixError:  # Pump without valve.
+                        valve_handle = None
+
+                    self.pump_handles.append(handle)
+                    self.pump_valve_handles.append(valve_handle)
+
+            valves = self._valve_library
+            if valves is not None:
+                for index in range(valves.call('LCV_GetNoOfValves')):
+                    self.valve_handles.append(
+                        self._get_handle(valves, 'LCV_GetValveHandle', index))
+
+            dio = self._dio_library
+            if dio is not None:
+                buf = dio.ffi.new('char[]', 256)
+                for index in range(MAX_DIO_CHANNELS):
+                    try:
+                        handle = self._get_handle(
+                            dio, 'LCDIO_GetOutChanHandle', index)
+                    except QmixError:  # No more channels.
+                        break
+
+                    dio.call('LCDIO_GetChanName', handle, buf, len(buf))
+                    self.dio_handles.append(handle)
+                    self.dio_names.append(dio.ffi.string(buf).decode('utf8'))
+
+    @property
+    def n_pumps(self):
+        """
+        The number of pumps.
+
+        """
+        return len(self.pump_handles)
+
+    @property
+    def n_valves(self):
+        """
+        The number of valves.
+
+        """
+        return len(self.valve_handles)
+
+    @property
+    def n_dio_channels(self):
+        """
+        The number of digital output channels.
+
+        """
+        return len(self.dio_handles)
+
+    @staticmethod
+    def _check_index(handles, index, kind):
+        if not 0 <= index < len(handles):
+            msg = 'No %s with index %d on the bus.' % (kind, index)
+            raise ValueError(msg)
+
+    def _lookup(self, cache, func_name, library, name, handles, kind):
+        # Resolve a name to an index via the SDK, once.
+        with self._lock:
+            try:
+                return cache[name]
+            except KeyError:
+                pass
+
+            try:
+                handle = self._get_handle(library, func_name,
+                                          bytes(name, 'utf8'))
+                index = handles.index(handle)
+            except (QmixError, ValueError):
+                msg = 'No %s named %s on the bus.' % (kind, name)
+                raise ValueError(msg)
+
+            cache[name] = index
+            return index
+
+    def pump_index(self, name):
+        """
+        Return the index of a pump.
+
+        Parameters
+        ----------
+        name : str
+            The name of the pump in the Qmix configuration.
+
+        Returns
+        -------
+        int
+            The index.
+
+        """
+        return self._lookup(self._pump_names, 'LCP_LookupPumpByName',
+                            self._pump_library, name, self.pump_handles,
+                            'pump')
+
+    def valve_index(self, name):
+        """
+        Return the index of a valve.
+
+        Parameters
+        ----------
+        name : str
+            The name of the valve in the Qmix configuration.
+
+        Returns
+        -------
+        int
+            The index.
+
+        """
+        return self._lookup(self._valve_names, 'LCV_LookupValveByName',
+                            self._valve_library, name, self.valve_handles,
+                            'valve')
+
+    def dio_index(self, name):
+        """
+        Return the index of a digital output channel.
+
+        Parameters
+        ----------
+        name : str
+            The name of the channel in the Qmix configuration.
+
+        Returns
+        -------
+        int
+            The index.
+
+        """
+        try:
+            return self.dio_names.index(name)
+        except ValueError:
+            msg = 'No DIO channel named %s on the bus.' % name
+            raise ValueError(msg)
+
+    def pump_handle(self, index):
+        """
+        Return the handle of a pump.
+
+        Parameters
+        ----------
+        index : int
+            The index of the pump.
+
+        Returns
+        -------
+        int
+            The handle.
+
+        """
+        self._check_index(self.pump_handles, index, 'pump')
+        return self.pump_handles[index]
+
+    def valve_handle(self, index):
+        """
+        Return the handle of a valve.
+
+        Parameters
+        ----------
+        index : int
+            The index of the valve.
+
+        Returns
+        -------
+        int
+            The handle.
+
+        """
+        self._check_index(self.valve_handles, index, 'valve')
+        return self.valve_handles[index]
+
+    def dio_handle(self, index):
+        """
+        Return the handle of a digital output channel.
+
+        Parameters
+        ----------
+        index : int
+            The index of the channel.
+
+        Returns
+        -------
+        int
+            The handle.
+
+        """
+        self._check_index(self.dio_handles, index, 'DIO channel')
+        return self.dio_handles[index]
+
+    def pump(self, index=None, name='', **kwargs):
+        """
+        Create a :class:`pyqmix.QmixPump` using the inventory.
+
+        Parameters
+        ----------
+        index : int or None
+            The index of the pump. Takes precedence over `name`.
+
+        name : str
+            The name of the pump in the Qmix configuration.
+
+        kwargs
+            Further keyword arguments passed to :class:`pyqmix.QmixPump`.
+
+        Returns
+        -------
+        QmixPump
+            The pump.
+
+        """
+        from .pump import QmixPump  # Avoid circular imports.
+
+        if index is None:
+            if name == '':
+                raise ValueError('Please specify a valid pump index or name.')
+            index = self.pump_index(name)
+
+        return QmixPump(index=index, name=name,
+                        handle=self.pump_handle(index),
+                        valve_handle=self.pump_valve_handles[index],
+                        **kwargs)
+
+    def valve(self, index=None, name=''):
+        """
+        Create a :class:`pyqmix.QmixValve` using the inventory.
+
+        Parameters
+        ----------
+        index : int or None
+            The index of the valve. Takes precedence over `name`.
+
+        name : str
+            The name of the valve in the Qmix configuration.
+
+        Returns
+        -------
+        QmixValve
+            The valve.
+
+        """
+        from .valve import QmixValve
+
+        if index is None:
+            if name == '':
+                raise ValueError('Please specify a valid valve index or '
+                                 'name.')
+            index = self.valve_index(name)
+
+        return QmixValve(index=index, name=name,
+                         handle=self.valve_handle(index))
+
+    def dio(self, index=None, name=''):
+        """
+        Create a :class:`pyqmix.QmixDigitalIO` using the inventory.
+
+        Parameters
+        ----------
+        index : int or None
+            The index of the output channel. Takes precedence over `name`.
+
+        name : str
+            The name of the channel in the Qmix configuration.
+
+        Returns
+        -------
+        QmixDigitalIO
+            The channel.
+
+        """
+        from .dio import QmixDigitalIO
+
+        if index is None:
+            if name == '':
+                raise ValueError('Please specify a valid DIO index or name.')
+            index = self.dio_index(name)
+
+        return QmixDigitalIO(index=index, name=name,
+                             handle=self.dio_handle(index))
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Crash-safe persistence of pump drive position counters.
+
+Rewriting the YAML configuration file is too slow to store the drive
+position counters frequently during operation. Instead, the counters are
+appended to a journal file as small, fixed-size binary records. The
+journal is replayed when restoring the counters, and compacted into the
+configuration file when it grows too large and when Python exits.
+
+Every record contains a checksum, so a record that was only partially
+written when the process crashed or the power failed is detected and
+ignored on replay.
+
+Records are written to the operating system immediately, so they survive
+a crash of the Python process; they are forced to disk periodically and
+when the journal is compacted. A drive position counter that was written
+to the configuration file explicitly after the journal was last compacted,
+and after the latest record of its pump, takes precedence over the journal.
+"""
+
+import os
+import time
+import struct
+import atexit
+import threading
+import zlib
+
+from . import config
+from .tools import atomic_write
+
+# Pump index, drive position counter, time of writing (seconds since the
+# epoch), CRC32 of the preceding fields.
+_RECORD = struct.Struct('<Iqd')
+_CRC = struct.Struct('<I')
+RECORD_SIZE = _RECORD.size + _CRC.size
+
+JOURNAL_FILENAME = 'drive_pos_counters.journal'
+
+# Written after the records of a compacted journal, which are the values
+# stored in the configuration file. Never a valid pump index.
+_SYNC_MARK = 0xffffffff
+
+
+def _pack(index, value, timestamp):
+    data = _RECORD.pack(index, value, timestamp)
+    return data + _CRC.pack(zlib.crc32(data) & 0xffffffff)
+
+
+class DrivePosJournal(object):
+    """
+    Append-only journal of pump drive position counters.
+
+    Parameters
+    ----------
+    path : str or None
+        The journal file. If ``None``, use ``drive_pos_counters.journal``
+        in the pyqmix configuration directory.
+
+    max_records : int
+        Compact the journal once it contains more than this many records.
+
+    fsync : bool
+        Whether to force every record to disk. If ``False``, records
+        survive a crash of the Python process, but records appended within
+        the last `sync_interval` seconds may be lost on a power failure;
+        appending a record then takes only microseconds.
+
+    sync_interval : float
+        If `fsync` is ``False``, force records to disk when appending a
+        record at least this many seconds after the last time they were.
+
+    """
+    def __init__(self, path=None, max_records=4096, fsync=False,
+                 sync_interval=1.):
+        if path is None:
+            path = os.path.join(config.PYQMIX_CONFIG_DIR, JOURNAL_FILENAME)
+
+        self.path = path
+        self.max_records = max_records
+        self.fsync = fsync
+        self.sync_interval = sync_interval
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._last_sync = time.time()
+        self._latest, self._synced, self._n_records = self._replay()
+
+    def _replay(self):
+        # Read all intact records; the latest record of every pump wins.
+        # Also return the values stored in the configuration file by the
+        # last compaction, if known.
+        latest = dict()
+        synced = None
+        n_records = 0
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return latest, synced, n_records
+
+        for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+            record = data[offset:offset + _RECORD.size]
+            crc, = _CRC.unpack_from(data, offset + _RECORD.size)
+            if zlib.crc32(record) & 0xffffffff != crc:
+                # A torn write; nothing after it can be trusted.
+                break
+
+            index, value, timestamp = _RECORD.unpack(record)
+            n_records += 1
+            if index == _SYNC_MARK:
+                synced = dict((i, v) for i, (v, _) in latest.items())
+            else:
+                latest[index] = (value, timestamp)
+
+        return latest, synced, n_records
+
+    def _config_value(self, index, record):
+        # Return the drive position counter of a pump from the configuration
+        # file if it was changed there since the last compaction, and later
+        # than the latest record; otherwise None.
+        if self._synced is None or index not in self._synced:
+            return None
+
+        try:
+            value = config._get('pumps', {})[index]['drive_pos_counter']
+        except KeyError:
+            return None
+
+        if value is None or value == self._synced[index]:
+            return None
+        if record is not None:
+            modified = config._modified_time()
+            if modified is None or modified <= record[1]:
+                return None
+
+        return int(value)
+
+    def _open(self):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            self._file = open(self.path, 'ab')
+
+            # Drop a torn record left behind by a crash, so that new
+            # records directly follow the last intact one.
+            valid_size = self._n_records * RECORD_SIZE
+            if os.path.getsize(self.path) > valid_size:
+                self._file.truncate(valid_size)
+
+        return self._file
+
+    def close(self):
+        """
+        Close the journal file.
+
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def append(self, index, value):
+        """
+        Record the drive position counter of a pump.
+
+        Nothing is written if the value has not changed since it was last
+        recorded.
+
+        Parameters
+        ----------
+        index : int
+            The index of the pump.
+
+        value : int
+            The drive position counter.
+
+        """
+        value = int(value)
+        timestamp = time.time()
+
+        with self._lock:
+            previous = self._latest.get(index)
+            if previous is not None and previous[0] == value:
+                return
+
+            f = self._open()
+            f.write(_pack(index, value, timestamp))
+            f.flush()
+            if self.fsync or timestamp - self._last_sync >= self.sync_interval:
+                os.fsync(f.fileno())
+                self._last_sync = timestamp
+
+            self._latest[index] = (value, timestamp)
+            self._n_records += 1
+            compact = self._n_records > self.max_records
+
+        if compact:
+            self.compact()
+
+    def sync(self):
+        """
+        Force all records to disk.
+
+        """
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+                self._last_sync = time.time()
+
+    def latest(self, index):
+        """
+        Return the most recently recorded drive position counter of a pump.
+
+        If the counter was written to the configuration file explicitly
+        after the latest record, the configured value is returned instead.
+
+        Parameters
+        ----------
+        index : int
+            The index of the pump.
+
+        Returns
+        -------
+        int or None
+            The drive position counter, or ``None`` if the journal contains
+            no record for this pump.
+
+        """
+        with self._lock:
+            record = self._latest.get(index)
+            value = self._config_value(index, record)
+            if value is not None:
+                return value
+        return None if record is None else record[0]
+
+    def compact(self):
+        """
+        Store the latest drive position counters in the configuration file,
+        and shrink the journal to one record per pump.
+
+        Counters that were written to the configuration file explicitly
+        after their latest record are kept, and replace the record.
+
+        """
+        with self._lock:
+            latest = dict(self._latest)
+            if not latest:
+                return
+
+            now = time.time()
+            with config.batch():
+                for index, record in latest.items():
+                    value = self._config_value(index, record)
+                    if value is not None:
+                        latest[index] = (value, now)
+                        continue
+                    try:
+                        config.set_pump_drive_pos_counter(index, record[0])
+                    except KeyError:  # Pump was removed from the config.
+                        pass
+
+            # Keep the latest records, so the journal alone is always
+            # sufficient to restore the counters.
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+            with atomic_write(self.path, mode='wb') as f:
+                for index in sorted(latest):
+                    value, timestamp = latest[index]
+                    f.write(_pack(index, value, timestamp))
+                f.write(_pack(_SYNC_MARK, 0, now))
+
+            self._latest = latest
+            self._synced = dict((i, v) for i, (v, _) in latest.items())
+            self._n_records = len(latest) + 1
+            self._last_sync = now
+
+
+_journals = dict()
+_journals_lock = threading.Lock()
+
+
+def get_journal(path=None):
+    """
+    Return the journal shared by all pumps of this process.
+
+    The journal is compacted into the configuration file when Python exits.
+
+    Parameters
+    ----------
+    path : str or None
+        The journal file. If ``None``, use the default location in the
+        pyqmix configuration directory.
+
+    Returns
+    -------
+    DrivePosJournal
+        The journal.
+
+    """
+    if path is None:
+        path = os.path.join(config.PYQMIX_CONFIG_DIR, JOURNAL_FILENAME)
+
+    with _journals_lock:
+        journal = _journals.get(path)
+        if journal is None:
+            journal = DrivePosJournal(path)
+            _journals[path] = journal
+            atexit.register(_compact_at_exit, journal)
+
+    return journal
+
+
+def _compact_at_exit(journal):
+    try:
+        journal.compact()
+    finally:
+        journal.close()
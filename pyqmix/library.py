@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Process-wide registry of the loaded Qmix SDK libraries.
+
+Each Qmix SDK DLL is located, its C declarations are parsed, and the DLL is
+opened exactly once per process. All device objects share the resulting
+``ffi`` / ``lib`` pair.
+
+If precompiled CFFI modules have been built via ``python -m
+pyqmix._build_ffi``, they are used instead of parsing the C declarations at
+runtime. If the ``sim`` backend has been selected via
+:func:`pyqmix.config.set_backend`, simulated libraries are used instead of
+the DLLs.
+"""
+
+import threading
+from importlib import import_module
+
+from . import config
+from .tools import CHK, find_dll
+from .headers import (BUS_HEADER, PUMP_HEADER, VALVE_HEADER,
+                      DIGITAL_IO_HEADER, ERROR_HEADER, parse_functions)
+
+# Library name -> (DLL filename, C declarations).
+LIBRARIES = {'bus': ('labbCAN_Bus_API.dll', BUS_HEADER),
+             'pump': ('labbCAN_Pump_API.dll', PUMP_HEADER),
+             'valve': ('labbCAN_Valve_API.dll', VALVE_HEADER),
+             'dio': ('labbCAN_DigIO_API.dll', DIGITAL_IO_HEADER),
+             'error': ('usl.dll', ERROR_HEADER)}
+
+_libraries = dict()
+_lock = threading.Lock()
+
+
+class QmixLibrary(object):
+    """
+    A loaded Qmix SDK library.
+
+    Parameters
+    ----------
+    name : str
+        The name of the library, i.e. one of the keys of
+        :data:`pyqmix.library.LIBRARIES`.
+
+    dll_path : str
+        The path of the loaded DLL.
+
+    ffi : cffi.FFI
+        The FFI instance holding the parsed C declarations.
+
+    lib
+        The opened DLL, as returned by :func:`cffi.FFI.dlopen`, or the
+        ``lib`` object of a compiled extension module.
+
+    mode : str
+        How the library was loaded: ``abi`` (declarations parsed at
+        runtime), ``abi-precompiled`` (pre-parsed declarations), ``api``
+        (compiled extension module), or ``sim`` (simulated devices, see
+        :mod:`pyqmix.sim`).
+
+    Attributes
+    ----------
+    functions : dict
+        All declared functions exported by the DLL, by name. They are
+        resolved only once, when the library is loaded, and return the raw
+        return code; device objects bind this table on construction and
+        check the return code themselves.
+
+    """
+    def __init__(self, name, dll_path, ffi, lib, mode='abi'):
+        self.name = name
+        self.dll_filename = LIBRARIES[name][0]
+        self.dll_path = dll_path
+        self.ffi = ffi
+        self.lib = lib
+        self.mode = mode
+
+        header = LIBRARIES[name][1]
+        self.functions = _Functions(name)
+        for func_name in parse_functions(header):
+            try:
+                self.functions[func_name] = getattr(lib, func_name)
+            except AttributeError:
+                # Not exported by this version of the DLL; calling it
+                # fails as before.
+                continue
+
+    def __repr__(self):
+        return '<QmixLibrary %s (%s): %s>' % (self.name, self.mode,
+                                              self.dll_path)
+
+    def call(self, func_name, *args):
+        """
+        Call a function and check its return code.
+
+        Parameters
+        ----------
+        func_name : str
+            The name of the function.
+
+        args
+            The arguments of the call.
+
+        Returns
+        -------
+        int
+            The return code, if it does not indicate an error.
+
+        Raises
+        ------
+        pyqmix.error.QmixError
+            If the function returned an error code.
+
+        """
+        return CHK(self.functions[func_name](*args))
+
+
+class _Functions(dict):
+    def __init__(self, library_name):
+        super(_Functions, self).__init__()
+        self.library_name = library_name
+
+    def __missing__(self, func_name):
+        msg = ('The Qmix SDK %s library does not provide the function %s.'
+               % (self.library_name, func_name))
+        raise AttributeError(msg)
+
+
+def precompiled_module_name(name):
+    """
+    Return the fully qualified name of the precompiled module of a library.
+
+    """
+    return '%s._qmix_%s_cffi' % (__package__ or 'pyqmix', name)
+
+
+def _import_precompiled(name):
+    try:
+        return import_module(precompiled_module_name(name))
+    except ImportError:
+        return None
+
+
+def _open_library(name):
+    if config.get_backend() == 'sim':
+        from . import sim
+        return sim.open_library(name)
+
+    dll_filename, header = LIBRARIES[name]
+    dll_dir = config._get('qmix_dll_dir')
+
+    # Even when using a compiled extension module, this sets up the DLL
+    # search path so the DLL can be resolved on import.
+    dll_path = find_dll(dll_dir=dll_dir, dll_filename=dll_filename)
+    if dll_path is None:
+        msg = 'Could not find the Qmix SDK DLL %s.' % dll_filename
+        raise RuntimeError(msg)
+
+    module = _import_precompiled(name)
+
+    if module is not None and hasattr(module, 'lib'):
+        ffi, lib = module.ffi, module.lib
+        mode = 'api'
+    elif module is not None:
+        ffi = module.ffi
+        lib = ffi.dlopen(dll_path)
+        mode = 'abi-precompiled'
+    else:
+        from cffi import FFI
+        ffi = FFI()
+        ffi.cdef(header)
+        lib = ffi.dlopen(dll_path)
+        mode = 'abi'
+
+    return QmixLibrary(name=name, dll_path=dll_path, ffi=ffi, lib=lib,
+                       mode=mode)
+
+
+def load_library(name):
+    """
+    Return the shared instance of a Qmix SDK library, loading it if required.
+
+    Parameters
+    ----------
+    name : str
+        The name of the library: ``bus``, ``pump``, ``valve``, ``dio``, or
+        ``error``.
+
+    Returns
+    -------
+    QmixLibrary
+        The loaded library.
+
+    Raises
+    ------
+    ValueError
+        If an unknown library name was specified.
+
+    RuntimeError
+        If the DLL could not be found.
+
+    """
+    try:
+        return _libraries[name]
+    except KeyError:
+        pass
+
+    if name not in LIBRARIES:
+        raise ValueError('Unknown Qmix SDK library: %s' % name)
+
+    with _lock:
+        # Another thread might have loaded the library while we were waiting
+        # for the lock.
+        if name not in _libraries:
+            _libraries[name] = _open_library(name)
+
+    return _libraries[name]
+
+
+def loaded_libraries():
+    """
+    Return all Qmix SDK libraries that have been loaded so far.
+
+    Returns
+    -------
+    dict
+        A dictionary mapping library names to :class:`QmixLibrary` instances.
+
+    """
+    return dict(_libraries)
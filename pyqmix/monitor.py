@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Background monitoring of pump state.
+
+A single :class:`PumpMonitor` thread samples the state of all registered
+pumps at a fixed rate and publishes the latest snapshots. Waiting code,
+user interfaces, and loggers can then read the cached state instead of
+each querying the DLL on their own.
+"""
+
+import time
+import threading
+from collections import namedtuple
+
+from .tools import clock
+from .waiting import WaitTimeout, WaitCancelled, _MIN_EVENT_WAIT
+
+PumpState = namedtuple('PumpState', ['timestamp', 'is_pumping', 'fill_level',
+                                     'current_flow_rate', 'dosed_volume'])
+PumpState.__doc__ = """
+Snapshot of the state of a pump.
+
+The `timestamp` refers to :func:`pyqmix.tools.clock`.
+"""
+
+
+class PumpMonitor(object):
+    """
+    Sample the state of many pumps from one background thread.
+
+    Parameters
+    ----------
+    pumps : list of :class:`pyqmix.QmixPump` instances, or None
+        The pumps to monitor. More pumps can be added later via
+        :func:`~pyqmix.monitor.PumpMonitor.register`.
+
+    rate : float
+        The sampling rate in Hz, i.e. how many times per second the state of
+        every pump is queried.
+
+    auto_start : bool
+        Whether to start the monitor thread on object instantiation.
+
+    Notes
+    -----
+    Registered pumps use the monitor to wait for the completion of their
+    operations, so they no longer query the DLL themselves while waiting.
+
+    """
+    def __init__(self, pumps=None, rate=100., auto_start=True):
+        if rate <= 0:
+            raise ValueError('Sampling rate must be positive.')
+
+        self.rate = rate
+
+        self._pumps = []
+        self._states = dict()
+        self._callbacks = []
+        self._sweep = 0
+        self.last_error = None
+
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        if pumps is not None:
+            for pump in pumps:
+                self.register(pump)
+
+        if auto_start:
+            self.start()
+
+    def __del__(self):
+        # `__init__` may have raised before the thread was set up.
+        if getattr(self, '_thread', None) is not None:
+            self.stop()
+
+    @property
+    def pumps(self):
+        """
+        The monitored pumps.
+
+        """
+        return list(self._pumps)
+
+    @property
+    def is_running(self):
+        """
+        Whether the monitor thread is running.
+
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def register(self, pump):
+        """
+        Start monitoring a pump.
+
+        Parameters
+        ----------
+        pump : :class:`pyqmix.QmixPump`
+            The pump to monitor.
+
+        """
+        with self._lock:
+            if pump not in self._pumps:
+                self._pumps.append(pump)
+
+        pump.monitor = self
+
+    def unregister(self, pump):
+        """
+        Stop monitoring a pump.
+
+        Parameters
+        ----------
+        pump : :class:`pyqmix.QmixPump`
+            The pump to stop monitoring.
+
+        """
+        with self._lock:
+            self._pumps.remove(pump)
+            self._states.pop(pump, None)
+
+        if pump.monitor is self:
+            pump.monitor = None
+
+    def add_callback(self, callback):
+        """
+        Add a function to be called after every sampling sweep.
+
+        Parameters
+        ----------
+        callback : callable
+            Called from the monitor thread with a dictionary mapping pumps
+            to their latest :class:`PumpState`. Must return quickly.
+
+        """
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        """
+        Remove a function previously added via
+        :func:`~pyqmix.monitor.PumpMonitor.add_callback`.
+
+        """
+        self._callbacks.remove(callback)
+
+    def start(self):
+        """
+        Start the monitor thread.
+
+        """
+        if self.is_running:
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='PumpMonitor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the monitor thread.
+
+        """
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+
+    def state(self, pump):
+        """
+        Return the most recent state of a pump.
+
+        Parameters
+        ----------
+        pump : :class:`pyqmix.QmixPump`
+            A monitored pump.
+
+        Returns
+        -------
+        PumpState or None
+            The latest snapshot, or ``None`` if the pump has not been
+            sampled yet.
+
+        """
+        return self._states.get(pump)
+
+    def states(self):
+        """
+        Return the most recent state of all monitored pumps.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping pumps to their latest :class:`PumpState`.
+
+        """
+        with self._lock:
+            return dict(self._states)
+
+    def wait_for_update(self, timeout=None):
+        """
+        Block until the next sampling sweep has completed.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Maximum time to wait in seconds.
+
+        Returns
+        -------
+        bool
+            ``True`` if a new sweep completed, ``False`` on timeout.
+
+        """
+        with self._updated:
+            sweep = self._sweep
+            self._updated.wait(timeout)
+            return self._sweep != sweep
+
+    def wait_until(self, condition, timeout=None, cancel_event=None):
+        """
+        Block until a condition on the cached state is met.
+
+        Parameters
+        ----------
+        condition : callable
+            Called without arguments after every sampling sweep; waiting
+            ends once it returns ``True``. It should only read the cached
+            state, e.g. via :func:`~pyqmix.monitor.PumpMonitor.state`.
+
+        timeout : float or None
+            Maximum time to wait in seconds. If ``None``, wait indefinitely.
+
+        cancel_event : threading.Event or None
+            If passed, waiting is aborted as soon as the event is set.
+
+        Raises
+        ------
+        pyqmix.waiting.WaitTimeout
+            If the condition was not met within `timeout` seconds.
+
+        pyqmix.waiting.WaitCancelled
+            If `cancel_event` was set.
+
+        RuntimeError
+            If the monitor thread is not running.
+
+        """
+        start = clock()
+
+        while not condition():
+            if not self.is_running:
+                raise RuntimeError('The pump monitor is not running.')
+            if cancel_event is not None and cancel_event.is_set():
+                raise WaitCancelled('Waiting was cancelled.')
+
+            # Wake up at least once per sampling period to check for
+            # cancellation.
+            interval = 2. / self.rate
+            if timeout is not None:
+                remaining = timeout - (clock() - start)
+                if remaining <= 0:
+                    raise WaitTimeout('Operation did not complete within '
+                                      '%.3f s.' % timeout)
+                interval = min(interval, remaining)
+
+            self.wait_for_update(interval)
+
+    def _sample(self, pump):
+        return PumpState(timestamp=clock(),
+                         is_pumping=pump.is_pumping,
+                         fill_level=pump.fill_level,
+                         current_flow_rate=pump.current_flow_rate,
+                         dosed_volume=pump.dosed_volume)
+
+    def _run(self):
+        next_sweep = clock()
+
+        while not self._stop_event.is_set():
+            states = dict()
+            for pump in self.pumps:
+                try:
+                    states[pump] = self._sample(pump)
+                except Exception as e:
+                    self.last_error = e
+
+            with self._updated:
+                self._states.update(states)
+                self._sweep += 1
+                self._updated.notify_all()
+
+            for callback in list(self._callbacks):
+                try:
+                    callback(states)
+                except Exception as e:
+                    self.last_error = e
+
+            # Schedule sweeps on a fixed grid, but don't try to catch up
+            # if sampling took longer than one period.
+            next_sweep = max(next_sweep + 1. / self.rate, clock())
+            delay = next_sweep - clock()
+            if delay < _MIN_EVENT_WAIT:
+                time.sleep(max(delay, 0))
+            else:
+                self._stop_event.wait(delay)
+
+        with self._updated:
+            self._updated.notify_all()
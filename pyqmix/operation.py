@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Future-like handles of running pump operations.
+
+All pumping methods of :class:`pyqmix.QmixPump` return a
+:class:`PumpOperation`. Operations that are not waited for in the calling
+thread are tracked from the moment their command is issued; all tracked
+operations are watched by a single, shared background thread.
+"""
+
+import time
+import threading
+from concurrent.futures import Future
+
+from .tools import clock
+from .waiting import _MIN_EVENT_WAIT
+
+
+class PumpOperation(Future):
+    """
+    Handle of a pump operation that resolves once the operation completes.
+
+    This is a :class:`concurrent.futures.Future`: use `result()` to block
+    until completion, and `add_done_callback()` to be notified. Callbacks
+    are invoked from the watcher thread and should return quickly.
+
+    The result of a completed operation is always ``None``.
+
+    Parameters
+    ----------
+    pump : :class:`pyqmix.QmixPump`
+        The pump executing the operation.
+
+    wait_for_start : bool
+        Whether the operation must be seen to have started before it can be
+        considered finished, i.e. the pump was observed pumping, or is idle
+        with a changed fill level.
+
+    condition : callable or None
+        Called without arguments; returns ``True`` once the operation has
+        finished. If ``None``, the operation has finished once the pump
+        stops pumping.
+
+    Notes
+    -----
+    Instances are created by the pump right after issuing a command; there
+    is no need to construct them directly. The operation is bound to the
+    start time, fill level, and expected duration recorded for that
+    command, so later commands on the same pump do not change what it
+    waits for.
+
+    """
+    def __init__(self, pump, wait_for_start=True, condition=None):
+        super(PumpOperation, self).__init__()
+
+        self.pump = pump
+        self.start_time = pump._operation_start
+        self.expected_duration = pump._expected_duration
+
+        started, finished = pump._completion_conditions(
+            self.start_time, pump._operation_level, self.expected_duration)
+        self._started_condition = started
+        self._finished_condition = (finished if condition is None
+                                    else condition)
+        self._started = not wait_for_start
+
+        self._tracking = False
+        self._tracking_lock = threading.Lock()
+
+    @property
+    def dosed_volume(self):
+        """
+        The volume dosed so far, in the pump's volume unit.
+
+        """
+        if self.pump._uses_monitor():
+            state = self.pump.monitor.state(self.pump)
+            if state is not None:
+                return state.dosed_volume
+
+        return self.pump.dosed_volume
+
+    @property
+    def progress(self):
+        """
+        The estimated fraction of the operation that has been completed,
+        based on the elapsed and the expected duration.
+
+        Returns
+        -------
+        float or None
+            A value between 0 and 1, or ``None`` if the duration of the
+            operation cannot be predicted.
+
+        """
+        if Future.done(self) and not self.cancelled():
+            return 1.
+        if not self.expected_duration:
+            return None
+
+        elapsed = clock() - self.start_time
+        return min(elapsed / self.expected_duration, 1.)
+
+    def cancel(self):
+        """
+        Stop the pump and cancel the operation.
+
+        The pump is only stopped if this is still its current operation.
+
+        Returns
+        -------
+        bool
+            ``False`` if the operation had already completed, ``True``
+            otherwise.
+
+        """
+        if Future.done(self):
+            return False
+
+        # Cancel first, so the watcher cannot resolve the operation once
+        # the pump has stopped.
+        if not super(PumpOperation, self).cancel():
+            return False
+
+        # Leave the pump alone if a newer operation has replaced this one.
+        if self.pump._operation is self:
+            self.pump.cancel()
+        return True
+
+    def _track(self):
+        # Start watching the operation; called once its command was issued.
+        with self._tracking_lock:
+            if self._tracking or Future.done(self):
+                return
+            self._tracking = True
+
+        _watcher.track(self)
+
+    def _check(self):
+        # Return whether the operation has finished.
+        if not self._started:
+            if not self._started_condition():
+                return False
+            self._started = True
+
+        return self._finished_condition()
+
+    def _next_interval(self):
+        pump = self.pump
+        if pump._uses_monitor():
+            return 1. / pump.monitor.rate
+
+        return pump.poll_strategy.interval(clock() - self.start_time,
+                                           self.expected_duration)
+
+    def _resolve(self, exception=None):
+        if Future.done(self):  # Cancelled in the meantime.
+            return
+
+        try:
+            if exception is None:
+                self.set_result(None)
+            else:
+                self.set_exception(exception)
+        except Exception:
+            # The operation was cancelled concurrently.
+            pass
+
+
+class _OperationWatcher(object):
+    """
+    Resolve all tracked operations from one background thread.
+
+    The thread is started on demand and exits once it has been idle for
+    `idle_timeout` seconds.
+
+    """
+    def __init__(self, idle_timeout=1.):
+        self.idle_timeout = idle_timeout
+        self._operations = []
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def track(self, operation):
+        with self._condition:
+            self._operations.append(operation)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='PumpOperationWatcher')
+                self._thread.daemon = True
+                self._thread.start()
+
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._operations:
+                    self._condition.wait(self.idle_timeout)
+                    if not self._operations:
+                        self._thread = None
+                        return
+
+                operations = list(self._operations)
+
+            intervals = []
+            finished = []
+
+            for operation in operations:
+                if Future.done(operation):
+                    finished.append(operation)
+                    continue
+
+                try:
+                    if operation._check():
+                        operation._resolve()
+                        finished.append(operation)
+                    else:
+                        intervals.append(operation._next_interval())
+                except Exception as e:
+                    operation._resolve(exception=e)
+                    finished.append(operation)
+
+            with self._condition:
+                for operation in finished:
+                    self._operations.remove(operation)
+
+                if not intervals:
+                    continue
+
+                interval = min(intervals)
+                if interval >= _MIN_EVENT_WAIT:
+                    # Newly tracked operations wake us up early.
+                    self._condition.wait(interval)
+                    continue
+
+            time.sleep(interval)
+
+
+_watcher = _OperationWatcher()
@@ -0,0 +1,735 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Playing back time-varying flow profiles.
+
+A :class:`FlowProfile` is a sequence of flow setpoints, each held until the
+next one. Profiles are compiled from a sampled waveform, or from an
+analytic specification, into as few setpoints as possible while staying
+within a given tolerance of the waveform::
+
+    profile = FlowProfile.sine(mean=0.5, amplitude=0.2, period=10,
+                               duration=60, tolerance=0.01)
+    player = pump.play_profile(profile)
+    player.wait()
+    print(player.timing_report())
+
+A :class:`ProfilePlayer` issues the setpoints from a dedicated thread.
+Each setpoint has an absolute deadline relative to the start of playback,
+so timing errors do not accumulate; the thread sleeps until shortly before
+a deadline and spins for the remaining time. On Windows, the resolution of
+the system timer is raised to 1 ms during playback. The achieved timing of
+every setpoint is recorded.
+"""
+
+import gc
+import os
+import sys
+import math
+import time
+import threading
+from abc import abstractmethod
+from contextlib import contextmanager
+
+from .tools import AbstractBase, clock
+from .waiting import WaitTimeout, _MIN_EVENT_WAIT
+
+
+def _compile(times, flows, tolerance, min_interval):
+    # Merge consecutive samples into one setpoint for as long as they stay
+    # within +/- tolerance of the setpoint, i.e. within a band of
+    # 2 * tolerance. Setpoints are at least `min_interval` apart.
+    setpoint_times = []
+    setpoint_flows = []
+
+    start = times[0]
+    low = high = flows[0]
+    for t, flow in zip(times[1:], flows[1:]):
+        new_low = min(low, flow)
+        new_high = max(high, flow)
+        if new_high - new_low <= 2 * tolerance or t - start < min_interval:
+            low, high = new_low, new_high
+            continue
+
+        setpoint_times.append(start)
+        setpoint_flows.append((low + high) / 2.)
+        start = t
+        low = high = flow
+
+    setpoint_times.append(start)
+    setpoint_flows.append((low + high) / 2.)
+    return setpoint_times, setpoint_flows
+
+
+class FlowProfile(object):
+    """
+    A sequence of flow setpoints.
+
+    Usually created via :meth:`compile` or one of the analytic constructors
+    :meth:`ramp`, :meth:`sine`, and :meth:`steps`.
+
+    Parameters
+    ----------
+    times : sequence of float
+        The times of the setpoints in seconds, relative to the start of
+        playback. Must start at zero and be strictly increasing.
+
+    flows : sequence of float
+        The flow rates in the flow unit of the pump. Positive flow rates
+        dispense, negative flow rates aspirate; zero stops the pump.
+
+    duration : float
+        The duration of the profile in seconds; the last setpoint is held
+        until then.
+
+    """
+    def __init__(self, times, flows, duration):
+        times = [float(t) for t in times]
+        flows = [float(f) for f in flows]
+
+        if not times or len(times) != len(flows):
+            raise ValueError('Please specify the same, non-zero number of '
+                             'times and flow rates.')
+        if times[0] != 0:
+            raise ValueError('The first setpoint must be at time zero.')
+        if any(t1 >= t2 for t1, t2 in zip(times[:-1], times[1:])):
+            raise ValueError('Times must be strictly increasing.')
+        if duration <= times[-1]:
+            raise ValueError('The duration must be later than the last '
+                             'setpoint.')
+
+        self.times = times
+        self.flows = flows
+        self.duration = float(duration)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return iter(zip(self.times, self.flows))
+
+    def __repr__(self):
+        return ('<FlowProfile: %d setpoints, %.3f s>'
+                % (len(self), self.duration))
+
+    @property
+    def max_flow_rate(self):
+        """
+        The largest absolute flow rate of the profile.
+
+        """
+        return max(abs(f) for f in self.flows)
+
+    def volumes(self):
+        """
+        The cumulative volume dispensed by the end of every setpoint.
+
+        Returns
+        -------
+        list of float
+            The volumes in units of the flow rate times seconds, e.g. in mL
+            if the flow unit is mL/s; aspiration counts negative.
+
+        """
+        ends = self.times[1:] + [self.duration]
+        volume = 0.
+        volumes = []
+        for start, end, flow in zip(self.times, ends, self.flows):
+            volume += flow * (end - start)
+            volumes.append(volume)
+        return volumes
+
+    @classmethod
+    def compile(cls, times, flows, tolerance=0., min_interval=0.,
+                duration=None):
+        """
+        Compile a sampled waveform into setpoints.
+
+        Every sample is taken to hold until the next one. Consecutive
+        samples are merged into a single setpoint as long as all of them
+        are within `tolerance` of it.
+
+        Parameters
+        ----------
+        times : sequence of float
+            The sample times in seconds, strictly increasing. Shifted so
+            that playback starts with the first sample.
+
+        flows : sequence of float
+            The flow rates, e.g. a NumPy array.
+
+        tolerance : float
+            The maximum deviation of the setpoints from the waveform.
+
+        min_interval : float
+            The minimum time between setpoints in seconds. Takes precedence
+            over `tolerance`.
+
+        duration : float or None
+            The duration of the profile. If ``None``, the last sample is
+            held for as long as the one before it.
+
+        Returns
+        -------
+        FlowProfile
+            The compiled profile.
+
+        """
+        times = [float(t) for t in times]
+        flows = [float(f) for f in flows]
+        if not times or len(times) != len(flows):
+            raise ValueError('Please specify the same, non-zero number of '
+                             'times and flow rates.')
+
+        t0 = times[0]
+        times = [t - t0 for t in times]
+        if duration is None:
+            if len(times) > 1:
+                duration = 2 * times[-1] - times[-2]
+            else:
+                raise ValueError('Please specify the duration of a single '
+                                 'sample.')
+
+        setpoint_times, setpoint_flows = _compile(times, flows, tolerance,
+                                                  min_interval)
+        return cls(setpoint_times, setpoint_flows, duration)
+
+    @classmethod
+    def from_function(cls, function, duration, tolerance=None,
+                      min_interval=0.01, resolution=0.001):
+        """
+        Compile a flow rate given as a function of time.
+
+        Parameters
+        ----------
+        function : callable
+            Returns the flow rate at a time in seconds.
+
+        duration : float
+            The duration of the profile in seconds.
+
+        tolerance : float or None
+            The maximum deviation of the setpoints from the waveform. If
+            ``None``, use 1% of the peak absolute flow rate.
+
+        min_interval : float
+            The minimum time between setpoints in seconds.
+
+        resolution : float
+            The interval at which to sample the function in seconds.
+
+        Returns
+        -------
+        FlowProfile
+            The compiled profile.
+
+        """
+        n = max(int(math.ceil(duration / resolution)), 1)
+        times = [i * duration / n for i in range(n)]
+        # Sample every interval at its center.
+        flows = [function(t + duration / n / 2.) for t in times]
+
+        if tolerance is None:
+            tolerance = 0.01 * max(abs(f) for f in flows)
+
+        return cls.compile(times, flows, tolerance=tolerance,
+                           min_interval=min_interval, duration=duration)
+
+    @classmethod
+    def ramp(cls, start, stop, duration, **kwargs):
+        """
+        A linear change of the flow rate.
+
+        Parameters
+        ----------
+        start, stop : float
+            The flow rates at the beginning and end of the ramp.
+
+        duration : float
+            The duration of the ramp in seconds.
+
+        kwargs
+            Further keyword arguments passed to :meth:`from_function`.
+
+        """
+        def function(t):
+            return start + (stop - start) * t / duration
+
+        return cls.from_function(function, duration, **kwargs)
+
+    @classmethod
+    def sine(cls, mean, amplitude, period, duration, phase=0., **kwargs):
+        """
+        A sinusoidal flow rate.
+
+        Parameters
+        ----------
+        mean, amplitude : float
+            The mean and amplitude of the flow rate.
+
+        period : float
+            The period in seconds.
+
+        duration : float
+            The duration of the profile in seconds.
+
+        phase : float
+            The phase at time zero in radians.
+
+        kwargs
+            Further keyword arguments passed to :meth:`from_function`.
+
+        """
+        def function(t):
+            return mean + amplitude * math.sin(2 * math.pi * t / period +
+                                               phase)
+
+        return cls.from_function(function, duration, **kwargs)
+
+    @classmethod
+    def steps(cls, flows, durations):
+        """
+        A sequence of constant flow rates.
+
+        Parameters
+        ----------
+        flows : sequence of float
+            The flow rates.
+
+        durations : sequence of float
+            How long to hold each flow rate in seconds.
+
+        """
+        if len(flows) != len(durations):
+            raise ValueError('Please specify one duration per flow rate.')
+
+        times = []
+        t = 0.
+        for duration in durations:
+            times.append(t)
+            t += duration
+
+        return cls.compile(times, flows, duration=t)
+
+
+def _raise_thread_priority():
+    # Best effort: raise the priority of the calling thread. Returns
+    # whether this succeeded.
+    if sys.platform == 'win32':
+        try:
+            import win32api
+            import win32process
+        except ImportError:
+            return False
+
+        win32process.SetThreadPriority(
+            win32api.GetCurrentThread(),
+            win32process.THREAD_PRIORITY_TIME_CRITICAL)
+        return True
+
+    try:
+        # On Linux, this only affects the calling thread; usually requires
+        # privileges.
+        policy = os.SCHED_FIFO
+        param = os.sched_param(os.sched_get_priority_min(policy))
+        os.sched_setscheduler(0, policy, param)
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+# The resolution of the Windows system timer requested during playback, in
+# milliseconds.
+_TIMER_PERIOD = 1
+
+# The longest a player sleeps without checking whether one of its pumps was
+# cancelled, in seconds.
+_CANCEL_CHECK_INTERVAL = 0.02
+
+_gc_lock = threading.Lock()
+_gc_pause_count = 0
+_gc_was_enabled = False
+
+
+def _winmm():
+    # The Windows multimedia library, or None.
+    if sys.platform != 'win32':
+        return None
+    try:
+        import ctypes
+        return ctypes.windll.winmm
+    except (ImportError, AttributeError, OSError):
+        return None
+
+
+def _default_spin_time():
+    # Sleeping overshoots by up to one timer tick: about 1 ms, but 15.6 ms
+    # on Windows if the timer resolution cannot be raised.
+    if sys.platform == 'win32' and _winmm() is None:
+        return 0.02
+    return 0.002
+
+
+@contextmanager
+def _high_timer_resolution():
+    # Raise the resolution of the Windows system timer, which governs the
+    # accuracy of `Event.wait()` and `time.sleep()`, while in this block.
+    # Windows counts the requests, so overlapping blocks are fine.
+    winmm = _winmm()
+    raised = winmm is not None and winmm.timeBeginPeriod(_TIMER_PERIOD) == 0
+    try:
+        yield raised
+    finally:
+        if raised:
+            winmm.timeEndPeriod(_TIMER_PERIOD)
+
+
+@contextmanager
+def _gc_paused(enabled=True):
+    # Disable the garbage collector while in this block, if `enabled`.
+    # Overlapping blocks, e.g. of several players, re-enable it only when
+    # the last one exits, and only if it was enabled before the first one.
+    global _gc_pause_count, _gc_was_enabled
+
+    if not enabled:
+        yield
+        return
+
+    with _gc_lock:
+        if _gc_pause_count == 0:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _gc_pause_count += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_pause_count -= 1
+            if _gc_pause_count == 0 and _gc_was_enabled:
+                gc.enable()
+
+
+def _sleep_until(deadline, stop_event, spin_time, cancelled):
+    # Sleep until shortly before the deadline, then spin. `stop_event` ends
+    # sleeping early; `cancelled` is called without arguments. Returns
+    # whether waiting was cancelled.
+    remaining = deadline - clock()
+    while remaining > 0:
+        if cancelled():
+            return True
+
+        sleep_time = min(remaining - spin_time, _CANCEL_CHECK_INTERVAL)
+        if sleep_time >= _MIN_EVENT_WAIT:
+            stop_event.wait(sleep_time)
+        elif sleep_time > 0:
+            time.sleep(sleep_time)
+        remaining = deadline - clock()
+
+    return cancelled()
+
+
+class _SetpointPlayer(AbstractBase):
+    # Issues setpoints to one or more pumps from a dedicated thread, at
+    # absolute deadlines relative to the start of playback. Subclasses
+    # implement `_validate()`, `_prepare()`, and `_issue(i)`.
+    thread_name = 'SetpointPlayer'
+
+    def __init__(self, pumps, times, duration, stop_at_end=True,
+                 skip_late=True, spin_time=None, lead_time=0.05,
+                 high_priority=True, disable_gc=False):
+        self.pumps = list(pumps)
+        self.times = times
+        self.duration = duration
+        self.stop_at_end = stop_at_end
+        self.skip_late = skip_late
+        if spin_time is None:
+            spin_time = _default_spin_time()
+        self.spin_time = spin_time
+        self.lead_time = lead_time
+        self.high_priority = high_priority
+        self.disable_gc = disable_gc
+
+        self._validate()
+
+        self.start_time = None
+        self.planned = []
+        self.issued = [None] * len(times)
+        self.latencies = [None] * len(times)
+        self.n_skipped = 0
+        self.has_high_priority = False
+        self.error = None
+
+        self._stop_event = threading.Event()
+        self._done = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        """
+        Whether playback is running.
+
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def done(self):
+        """
+        Whether playback has finished or was stopped.
+
+        """
+        return self._done.is_set()
+
+    def start(self):
+        """
+        Start playback.
+
+        """
+        if self._thread is not None:
+            raise RuntimeError('Playback has already been started.')
+
+        self._thread = threading.Thread(target=self._run,
+                                        name=self.thread_name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Abort playback and stop the pumps.
+
+        """
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def wait(self, timeout=None):
+        """
+        Block until playback has finished.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Maximum time to wait in seconds. If ``None``, wait indefinitely.
+
+        Raises
+        ------
+        pyqmix.waiting.WaitTimeout
+            If playback did not finish within `timeout` seconds.
+
+        """
+        if not self._done.wait(timeout):
+            raise WaitTimeout('Playback did not finish within %.3f s.'
+                              % timeout)
+        if self.error is not None:
+            raise self.error
+
+    def timing_errors(self):
+        """
+        The difference between the issued and planned time of every issued
+        setpoint, in seconds.
+
+        """
+        return [issued - planned
+                for planned, issued in zip(self.planned, self.issued)
+                if issued is not None]
+
+    def timing_report(self):
+        """
+        Summarize the achieved setpoint timing.
+
+        Returns
+        -------
+        dict
+            The number of setpoints ``planned``, ``issued``, and
+            ``skipped``, the ``mean``, ``max``, and 95th percentile
+            (``p95``) of the absolute timing errors, and the ``mean_latency``
+            of issuing a setpoint, all in seconds.
+
+        """
+        errors = sorted(abs(e) for e in self.timing_errors())
+        latencies = [l for l in self.latencies if l is not None]
+        n = len(errors)
+
+        report = dict(planned=len(self.times), issued=n,
+                      skipped=self.n_skipped,
+                      mean=None, max=None, p95=None, mean_latency=None)
+        if n:
+            report.update(mean=sum(errors) / n, max=errors[-1],
+                          p95=errors[min(int(math.ceil(0.95 * n)) - 1, n - 1)],
+                          mean_latency=sum(latencies) / len(latencies))
+        return report
+
+    def _cancelled(self):
+        if self._stop_event.is_set():
+            return True
+        return any(pump._cancel_event.is_set() for pump in self.pumps)
+
+    def _sleep_until(self, deadline):
+        return _sleep_until(deadline, self._stop_event, self.spin_time,
+                            self._cancelled)
+
+    def _switch_valve(self, pump, flow):
+        # Switch the valve if the flow direction changed.
+        valve = pump.valve
+        if flow > 0:
+            position = valve.dispense_pos
+        elif flow < 0:
+            position = valve.aspirate_pos
+        else:
+            position = None
+
+        if position is not None and position != self._valve_positions[pump]:
+            valve.switch_position(position)
+            self._valve_positions[pump] = position
+
+    def _issue_flow(self, pump, flow):
+        self._switch_valve(pump, flow)
+        if flow == 0:
+            pump._call('LCP_StopPumping', pump._handle[0])
+        else:
+            pump._call('LCP_GenerateFlow', pump._handle[0], flow)
+
+    def _run(self):
+        try:
+            if self.high_priority:
+                self.has_high_priority = _raise_thread_priority()
+
+            with _high_timer_resolution(), _gc_paused(self.disable_gc):
+                self._play()
+        except Exception as e:
+            self.error = e
+        finally:
+            if self.stop_at_end or self._stop_event.is_set():
+                for pump in self.pumps:
+                    try:
+                        pump.stop()
+                    except Exception as e:
+                        self.error = self.error or e
+
+            self._done.set()
+
+    def _play(self):
+        self.start_time = start_time = clock() + self.lead_time
+        self.planned = [start_time + t for t in self.times]
+        for pump in self.pumps:
+            pump._begin_operation(self.duration)
+
+        self._valve_positions = dict((pump, pump.valve.position)
+                                     for pump in self.pumps)
+        self._prepare()
+
+        n = len(self.times)
+        for i in range(n):
+            if self._sleep_until(self.planned[i]):
+                return
+
+            if (self.skip_late and i + 1 < n and
+                    clock() >= self.planned[i + 1]):
+                self.n_skipped += 1
+                continue
+
+            issued = clock()
+            self._issue(i)
+            self.issued[i] = issued
+            self.latencies[i] = clock() - issued
+
+        self._sleep_until(start_time + self.duration)
+
+    def _validate(self):
+        pass
+
+    def _prepare(self):
+        pass
+
+    @abstractmethod
+    def _issue(self, i):
+        # Issue the setpoint with index `i` to the pumps.
+        pass
+
+
+class ProfilePlayer(_SetpointPlayer):
+    """
+    Play back a flow profile on a pump.
+
+    Usually created via :func:`pyqmix.QmixPump.play_profile`.
+
+    Parameters
+    ----------
+    pump : :class:`pyqmix.QmixPump`
+        The pump.
+
+    profile : FlowProfile
+        The profile to play.
+
+    stop_at_end : bool
+        Whether to stop the pump at the end of the profile. Otherwise, the
+        last setpoint is held.
+
+    skip_late : bool
+        Whether to skip a setpoint if the next one is already due, e.g.
+        after the thread was delayed.
+
+    spin_time : float or None
+        How long before a deadline to stop sleeping and spin instead, in
+        seconds. If ``None``, 2 ms, or 20 ms on Windows if the resolution
+        of the system timer cannot be raised.
+
+    lead_time : float
+        The time between calling :meth:`start` and the first setpoint, in
+        seconds; used to switch the valve.
+
+    high_priority : bool
+        Whether to try to raise the priority of the playback thread.
+
+    disable_gc : bool
+        Whether to disable the garbage collector during playback. Note that
+        this affects all threads; it is enabled again once no player
+        disables it anymore.
+
+    auto_start : bool
+        Whether to start playback on object instantiation.
+
+    Raises
+    ------
+    ValueError
+        If the profile exceeds the maximum flow rate of the pump, or would
+        empty or overfill the syringe.
+
+    """
+    thread_name = 'ProfilePlayer'
+
+    def __init__(self, pump, profile, auto_start=False, **kwargs):
+        self.pump = pump
+        self.profile = profile
+        super(ProfilePlayer, self).__init__([pump], profile.times,
+                                            profile.duration, **kwargs)
+        if auto_start:
+            self.start()
+
+    def _validate(self):
+        pump = self.pump
+        profile = self.profile
+
+        max_flow_rate = pump.max_flow_rate
+        if profile.max_flow_rate > max_flow_rate:
+            msg = ('The profile exceeds the maximum flow rate of the pump, '
+                   '%f.' % max_flow_rate)
+            raise ValueError(msg)
+
+        scale = pump.flow_scale
+        volumes = [v * scale for v in profile.volumes()]
+        fill_level = pump.fill_level
+        volume_max = pump.volume_max
+        if (fill_level - max(volumes) < 0 or
+                fill_level - min(volumes) > volume_max):
+            msg = 'The profile would empty or overfill the syringe.'
+            raise ValueError(msg)
+
+    def _prepare(self):
+        # Switch the valve before the first setpoint is due.
+        flows = self.profile.flows
+        self._switch_valve(self.pump, next((f for f in flows if f != 0), 0))
+
+    def _issue(self, i):
+        self._issue_flow(self.pump, self.profile.flows[i])
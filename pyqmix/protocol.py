@@ -0,0 +1,642 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Running protocols of pump, valve, and digital I/O steps.
+
+A protocol is a set of steps, each calling a method of a device, with
+dependencies between them. Steps start as soon as all steps they depend on
+have finished, so independent steps run concurrently::
+
+    steps:
+      - id: water
+        device: water_pump
+        action: dispense
+        args: {volume: 1, flow_rate: 0.1}
+      - id: salt
+        device: salt_pump
+        action: dispense
+        args: {volume: 1, flow_rate: 0.2}
+      - id: rest
+        action: sleep
+        args: {duration: 5}
+        after: [water, salt]
+
+::
+
+    protocol = Protocol.from_yaml('stimulation.yaml')
+    run = protocol.run(dict(water_pump=pump_1, salt_pump=pump_2))
+    print(run.report())
+
+A step finishes once its method has returned or, for pumping methods,
+once the returned :class:`pyqmix.operation.PumpOperation` has completed.
+The built-in ``sleep`` action requires no device. A step may specify a
+`delay` in seconds between its dependencies finishing and its start.
+
+A device can only execute one step at a time: steps using the same device
+must depend on each other, directly or indirectly, so they cannot overlap.
+"""
+
+import heapq
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, CancelledError
+
+try:
+    import queue
+except ImportError:  # Python 2 without the `future` package.
+    import Queue as queue
+
+from ruamel.yaml import YAML
+
+from .tools import clock
+from .waiting import WaitTimeout
+
+_STEP_KEYS = ('id', 'device', 'action', 'args', 'after', 'delay')
+
+#: The realized start and end of a step in seconds, relative to the start
+#: of the protocol.
+StepTiming = namedtuple('StepTiming', ['start', 'end'])
+
+
+class ProtocolError(RuntimeError):
+    """
+    Raised if a step of a protocol failed.
+
+    Attributes
+    ----------
+    step : str
+        The ID of the failed step.
+
+    error : Exception
+        The exception raised by the step.
+
+    run : ProtocolRun
+        The timeline of the aborted protocol.
+
+    """
+    def __init__(self, step, error, run):
+        msg = 'Step %s failed: %s' % (step, error)
+        super(ProtocolError, self).__init__(msg)
+        self.step = step
+        self.error = error
+        self.run = run
+
+
+class ProtocolStep(object):
+    """
+    A step of a protocol.
+
+    Parameters
+    ----------
+    id : str
+        The unique name of the step.
+
+    device : str or None
+        The name of the device, as passed to :meth:`Protocol.run`. Must be
+        ``None`` for the ``sleep`` action only.
+
+    action : str
+        The name of the method of the device to call, or ``sleep``.
+
+    args : dict or None
+        Keyword arguments of the method. ``sleep`` takes a `duration` in
+        seconds.
+
+    after : list of str or None
+        The IDs of the steps that must finish before this step starts.
+
+    delay : float
+        The time between the last dependency finishing and this step
+        starting, in seconds.
+
+    """
+    def __init__(self, id, device=None, action=None, args=None, after=None,
+                 delay=0.):
+        if action is None:
+            raise ValueError('Step %s: please specify an action.' % id)
+        if (device is None) != (action == 'sleep'):
+            raise ValueError('Step %s: please specify a device for all '
+                             'actions but sleep.' % id)
+        if action.startswith('_'):
+            raise ValueError('Step %s: invalid action %s.' % (id, action))
+
+        self.id = str(id)
+        self.device = device
+        self.action = action
+        self.args = dict(args or {})
+        self.after = [str(d) for d in (after or [])]
+        self.delay = float(delay)
+
+        if action == 'sleep' and 'duration' not in self.args:
+            raise ValueError('Step %s: please specify the duration of the '
+                             'sleep.' % id)
+
+    def __repr__(self):
+        return '<ProtocolStep %s: %s.%s>' % (self.id, self.device,
+                                             self.action)
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Create a step from a dictionary with the keys ``id``, ``device``,
+        ``action``, ``args``, ``after``, and ``delay``.
+
+        """
+        unknown = set(d) - set(_STEP_KEYS)
+        if unknown:
+            msg = ('Step %s: unknown keys %s.'
+                   % (d.get('id'), ', '.join(sorted(unknown))))
+            raise ValueError(msg)
+        if 'id' not in d:
+            raise ValueError('Please specify the ID of every step.')
+
+        return cls(**d)
+
+
+def _longest_path(order, dependencies, durations):
+    # Return the chain of dependencies with the largest total duration, and
+    # that duration.
+    finish = dict()
+    predecessor = dict()
+    for step_id in order:
+        start = 0.
+        predecessor[step_id] = None
+        for dependency in dependencies[step_id]:
+            if finish[dependency] > start:
+                start = finish[dependency]
+                predecessor[step_id] = dependency
+        finish[step_id] = start + durations.get(step_id, 0.)
+
+    if not finish:
+        return [], 0.
+
+    step_id = max(order, key=lambda s: finish[s])
+    length = finish[step_id]
+    path = []
+    while step_id is not None:
+        path.append(step_id)
+        step_id = predecessor[step_id]
+    return path[::-1], length
+
+
+class Protocol(object):
+    """
+    A set of steps with dependencies.
+
+    The steps are compiled into a dependency graph on instantiation.
+
+    Parameters
+    ----------
+    steps : sequence of ProtocolStep or dict
+        The steps.
+
+    Raises
+    ------
+    ValueError
+        If step IDs are not unique, if a step depends on an unknown step, or
+        if the dependencies form a cycle.
+
+    """
+    def __init__(self, steps):
+        steps = [s if isinstance(s, ProtocolStep) else
+                 ProtocolStep.from_dict(s) for s in steps]
+
+        self.steps = OrderedDict()
+        for step in steps:
+            if step.id in self.steps:
+                raise ValueError('Duplicate step ID %s.' % step.id)
+            self.steps[step.id] = step
+
+        self._compile()
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __repr__(self):
+        return '<Protocol: %d steps>' % len(self)
+
+    def _compile(self):
+        self.dependencies = OrderedDict()
+        self.dependents = OrderedDict((step_id, []) for step_id in self.steps)
+        for step in self.steps.values():
+            after = list(OrderedDict.fromkeys(step.after))
+            for dependency in after:
+                if dependency not in self.steps:
+                    msg = ('Step %s depends on unknown step %s.'
+                           % (step.id, dependency))
+                    raise ValueError(msg)
+                self.dependents[dependency].append(step.id)
+            self.dependencies[step.id] = after
+
+        # Topological order, keeping the order of definition among
+        # independent steps.
+        n_pending = dict((step_id, len(after))
+                         for step_id, after in self.dependencies.items())
+        ready = [step_id for step_id in self.steps if not n_pending[step_id]]
+        order = []
+        while ready:
+            step_id = ready.pop(0)
+            order.append(step_id)
+            for dependent in self.dependents[step_id]:
+                n_pending[dependent] -= 1
+                if n_pending[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(order) != len(self.steps):
+            cycle = [step_id for step_id in self.steps
+                     if step_id not in order]
+            raise ValueError('The dependencies of the steps %s form a cycle.'
+                             % ', '.join(cycle))
+
+        #: The step IDs in an order that satisfies all dependencies.
+        self.order = order
+
+        # The steps every step depends on, directly or indirectly.
+        self._ancestors = dict()
+        for step_id in order:
+            ancestors = set(self.dependencies[step_id])
+            for dependency in self.dependencies[step_id]:
+                ancestors.update(self._ancestors[dependency])
+            self._ancestors[step_id] = ancestors
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Create a protocol from a dictionary with a list of ``steps``, or
+        from a list of steps.
+
+        """
+        if isinstance(d, dict):
+            unknown = set(d) - set(['steps'])
+            if unknown:
+                msg = 'Unknown keys %s.' % ', '.join(sorted(unknown))
+                raise ValueError(msg)
+            d = d.get('steps', [])
+
+        return cls(d)
+
+    @classmethod
+    def from_yaml(cls, source):
+        """
+        Load a protocol from YAML.
+
+        Parameters
+        ----------
+        source : str or file-like
+            The path of a YAML file, or an open file.
+
+        """
+        yaml = YAML(typ='safe')
+        if hasattr(source, 'read'):
+            return cls.from_dict(yaml.load(source))
+
+        with open(source, 'r') as f:
+            return cls.from_dict(yaml.load(f))
+
+    def critical_path(self, durations):
+        """
+        Determine the chain of dependent steps that takes longest.
+
+        Parameters
+        ----------
+        durations : dict
+            The duration of every step in seconds; missing steps take no
+            time.
+
+        Returns
+        -------
+        path : list of str
+            The IDs of the steps on the critical path.
+
+        length : float
+            The total duration of the path in seconds, including delays.
+
+        """
+        durations = dict((step_id, durations.get(step_id, 0.) +
+                          self.steps[step_id].delay)
+                         for step_id in self.steps)
+        return _longest_path(self.order, self.dependencies, durations)
+
+    def estimate_durations(self, devices):
+        """
+        Estimate the duration of every step.
+
+        Pumping steps are estimated from their volume and flow rate, and
+        sleeps from their duration; all other steps are assumed to take no
+        time.
+
+        Parameters
+        ----------
+        devices : dict
+            The devices, see :meth:`run`.
+
+        Returns
+        -------
+        dict
+            The estimated duration of every step in seconds.
+
+        """
+        durations = dict()
+        for step in self.steps.values():
+            args = step.args
+            duration = None
+            if step.action == 'sleep':
+                duration = args['duration']
+            elif step.action in ('aspirate', 'dispense', 'set_fill_level'):
+                pump = devices[step.device]
+                try:
+                    if step.action == 'set_fill_level':
+                        volume = args['level'] - pump.fill_level
+                    else:
+                        volume = args['volume']
+                    duration = pump._estimate_duration(volume,
+                                                       args['flow_rate'])
+                except KeyError:  # Invalid arguments; fail when run.
+                    pass
+            durations[step.id] = duration or 0.
+        return durations
+
+    def _validate_devices(self, devices):
+        for step in self.steps.values():
+            if step.device is None:
+                continue
+            if step.device not in devices:
+                msg = 'Step %s: unknown device %s.' % (step.id, step.device)
+                raise ValueError(msg)
+            if not callable(getattr(devices[step.device], step.action,
+                                    None)):
+                msg = ('Step %s: device %s has no action %s.'
+                       % (step.id, step.device, step.action))
+                raise ValueError(msg)
+
+        # Steps without a dependency path between them may run concurrently,
+        # and must not share a device; a pump aborts its running operation
+        # when it receives the next command.
+        by_device = OrderedDict()
+        for step in self.steps.values():
+            if step.device is not None:
+                device = devices[step.device]
+                by_device.setdefault(id(device), []).append(step)
+
+        for device_steps in by_device.values():
+            for i, a in enumerate(device_steps):
+                for b in device_steps[i + 1:]:
+                    if (a.id not in self._ancestors[b.id] and
+                            b.id not in self._ancestors[a.id]):
+                        msg = ('Steps %s and %s use the same device, but '
+                               'neither depends on the other.'
+                               % (a.id, b.id))
+                        raise ValueError(msg)
+
+    def run(self, devices, timeout=None):
+        """
+        Run the protocol, and block until all steps have finished.
+
+        Parameters
+        ----------
+        devices : dict
+            Maps the device names used by the steps to device objects, e.g.
+            :class:`pyqmix.QmixPump`, :class:`pyqmix.QmixValve`, or
+            :class:`pyqmix.QmixDigitalIO` instances.
+
+        timeout : float or None
+            Maximum run time in seconds. If ``None``, wait indefinitely.
+
+        Returns
+        -------
+        ProtocolRun
+            The realized timeline.
+
+        Raises
+        ------
+        ValueError
+            If a device or action does not exist, or if steps using the same
+            device do not depend on each other. No step is started in this
+            case.
+
+        ProtocolError
+            If a step failed. No further steps are started, and running
+            pumping operations are cancelled.
+
+        pyqmix.waiting.WaitTimeout
+            If the protocol did not finish within `timeout` seconds. Running
+            pumping operations are cancelled.
+
+        """
+        self._validate_devices(devices)
+        run = ProtocolRun(self, self.estimate_durations(devices))
+        run._execute(devices, timeout)
+        return run
+
+
+class ProtocolRun(object):
+    """
+    The execution of a protocol.
+
+    Created by :meth:`Protocol.run`.
+
+    Attributes
+    ----------
+    timeline : OrderedDict
+        Maps the IDs of all started steps to their :class:`StepTiming`, in
+        order of their start.
+
+    estimated_durations : dict
+        The estimated duration of every step in seconds.
+
+    """
+    def __init__(self, protocol, estimated_durations):
+        self.protocol = protocol
+        self.estimated_durations = estimated_durations
+        self.timeline = OrderedDict()
+        self.start_time = None
+
+        self._queue = queue.Queue()
+        self._running = dict()
+
+    @property
+    def duration(self):
+        """
+        The realized duration of the protocol in seconds.
+
+        """
+        ends = [t.end for t in self.timeline.values() if t.end is not None]
+        return max(ends) if ends else 0.
+
+    @property
+    def critical_path(self):
+        """
+        The chain of steps that determined the realized duration: starting
+        from the step that finished last, the dependency that finished last,
+        and so on.
+
+        """
+        protocol = self.protocol
+        order = [s for s in protocol.order
+                 if s in self.timeline and self.timeline[s].end is not None]
+        # Only the latest-finishing dependency of a step determines its
+        # start; measure paths by realized end times.
+        finish = dict()
+        predecessor = dict()
+        for step_id in order:
+            dependencies = [d for d in protocol.dependencies[step_id]
+                            if d in finish]
+            predecessor[step_id] = (max(dependencies, key=lambda d: finish[d])
+                                    if dependencies else None)
+            finish[step_id] = self.timeline[step_id].end
+
+        if not finish:
+            return []
+
+        step_id = max(order, key=lambda s: finish[s])
+        path = []
+        while step_id is not None:
+            path.append(step_id)
+            step_id = predecessor[step_id]
+        return path[::-1]
+
+    @property
+    def estimated_critical_path(self):
+        """
+        The critical path and its duration, as estimated before the run;
+        see :meth:`Protocol.critical_path`.
+
+        """
+        return self.protocol.critical_path(self.estimated_durations)
+
+    def report(self):
+        """
+        Format the timeline as a table, marking steps on the critical path.
+
+        Returns
+        -------
+        str
+            The table.
+
+        """
+        critical = set(self.critical_path)
+        lines = ['%-24s %10s %10s %10s' % ('step', 'start', 'end',
+                                           'duration')]
+        for step_id, timing in self.timeline.items():
+            if timing.end is None:
+                end = duration = '-'
+            else:
+                end = '%.3f' % timing.end
+                duration = '%.3f' % (timing.end - timing.start)
+            marker = '*' if step_id in critical else ' '
+            lines.append('%-24s %10.3f %10s %10s' % (marker + step_id,
+                                                     timing.start, end,
+                                                     duration))
+        lines.append('Total: %.3f s (* critical path)' % self.duration)
+        return '\n'.join(lines)
+
+    def _start(self, step, devices, deadlines):
+        self.timeline[step.id] = StepTiming(clock() - self.start_time, None)
+
+        if step.action == 'sleep':
+            heapq.heappush(deadlines, (clock() + step.args['duration'],
+                                       'end', step.id))
+            return
+
+        result = getattr(devices[step.device], step.action)(**step.args)
+        if isinstance(result, Future):
+            self._running[step.id] = result
+
+            def done(future, step_id=step.id):
+                try:
+                    error = future.exception()
+                except CancelledError as e:
+                    error = e
+                self._queue.put((step_id, error))
+
+            result.add_done_callback(done)
+        else:
+            self._queue.put((step.id, None))
+
+    def _end(self, step_id):
+        self._running.pop(step_id, None)
+        start = self.timeline[step_id].start
+        self.timeline[step_id] = StepTiming(start, clock() - self.start_time)
+
+    def _cancel_running(self):
+        for future in list(self._running.values()):
+            future.cancel()
+
+    def _execute(self, devices, timeout):
+        protocol = self.protocol
+        steps = protocol.steps
+        n_pending = dict((step_id, len(after))
+                         for step_id, after in protocol.dependencies.items())
+        # Steps waiting for their delay, and sleeps, as (time, kind, id).
+        deadlines = []
+        n_finished = 0
+
+        self.start_time = clock()
+        end_time = None if timeout is None else self.start_time + timeout
+
+        def release(step_id):
+            step = steps[step_id]
+            if step.delay > 0:
+                heapq.heappush(deadlines, (clock() + step.delay, 'start',
+                                           step_id))
+            else:
+                self._start(step, devices, deadlines)
+
+        current = None
+        try:
+            for step_id in protocol.order:
+                if n_pending[step_id] == 0:
+                    current = step_id
+                    release(step_id)
+
+            while n_finished < len(steps):
+                now = clock()
+                while deadlines and deadlines[0][0] <= now:
+                    _, kind, step_id = heapq.heappop(deadlines)
+                    current = step_id
+                    if kind == 'start':
+                        self._start(steps[step_id], devices, deadlines)
+                    else:
+                        self._queue.put((step_id, None))
+
+                wait = None
+                if deadlines:
+                    wait = max(deadlines[0][0] - clock(), 0)
+                if end_time is not None:
+                    remaining = end_time - clock()
+                    if remaining <= 0:
+                        raise WaitTimeout('Protocol did not finish within '
+                                          '%.3f s.' % timeout)
+                    wait = remaining if wait is None else min(wait, remaining)
+
+                try:
+                    step_id, error = self._queue.get(timeout=wait)
+                except queue.Empty:
+                    continue
+
+                current = step_id
+                self._end(step_id)
+                if error is not None:
+                    raise ProtocolError(step_id, error, self)
+                n_finished += 1
+
+                for dependent in protocol.dependents[step_id]:
+                    n_pending[dependent] -= 1
+                    if n_pending[dependent] == 0:
+                        current = dependent
+                        release(dependent)
+        except ProtocolError:
+            self._cancel_running()
+            raise
+        except WaitTimeout:
+            self._cancel_running()
+            raise
+        except Exception as e:
+            # Raised while starting a step.
+            self._cancel_running()
+            if current in self.timeline and self.timeline[current].end is None:
+                self._end(current)
+            raise ProtocolError(current, e, self)
+        except BaseException:
+            self._cancel_running()
+            raise
@@ -2,10 +2,9 @@
 # -*- coding: utf-8 -*-
 
 import os
-import time
 import sys
 import atexit
-from cffi import FFI
+import threading
 from collections import OrderedDict
 
 if sys.version_info[0] < 3:
@@ -14,21 +13,60 @@ if sys.version_info[0] < 3:
 
 from . import config
 from .valve import QmixValve
-from .tools import CHK, find_dll
-from .headers import PUMP_HEADER
+from .tools import clock
+from ._device import _SDKDevice
+from .library import load_library
+from .headers import PUMP_HEADER, parse_defines
+from .waiting import AdaptiveBackoff, wait_until
+from .operation import PumpOperation
+from .group import PumpGroup
+from .journal import get_journal
 
 syringes = {'25 mL glass': dict(inner_diameter_mm=23.03294,
                                 max_piston_stroke_mm=60),
             '50 mL glass': dict(inner_diameter_mm=32.57350,
                                 max_piston_stroke_mm=60)}
 
-class QmixPump(object):
+_PUMP_DEFINES = parse_defines(PUMP_HEADER)
+
+# If a pump has not been observed pumping this long after the expected end
+# of an operation, the operation is considered to have started (and ended)
+# between two polls.
+_START_MARGIN = 0.5
+
+
+def _unit_table(*names):
+    # Map unit names to their SDK constants.
+    return OrderedDict((name, _PUMP_DEFINES[name.upper()][0])
+                       for name in names)
+
+
+_PREFIXES = _unit_table('unit', 'deci', 'centi', 'milli', 'micro')
+_VOLUME_UNITS = _unit_table('litres')
+_TIME_UNITS = _unit_table('per_second', 'per_minute', 'per_hour')
+
+_PREFIX_NAMES = dict((v, k) for k, v in _PREFIXES.items())
+_VOLUME_UNIT_NAMES = dict((v, k) for k, v in _VOLUME_UNITS.items())
+_TIME_UNIT_NAMES = dict((v, k) for k, v in _TIME_UNITS.items())
+
+
+def _unit_constant(table, name, kind):
+    try:
+        return table[name]
+    except KeyError:
+        msg = ('Invalid %s: %s. Must be one of: %s.'
+               % (kind, name, ', '.join(table)))
+        raise ValueError(msg)
+
+
+class QmixPump(_SDKDevice):
     """
     Qmix pump interface.
     """
     def __init__(self, index, name='', external_valves=None,
                  restore_drive_pos_counter=False,
-                 auto_enable=True):
+                 auto_enable=True, poll_strategy=None, handle=None,
+                 valve_handle=None):
         """
         Parameters
         ----------
@@ -41,33 +79,58 @@ class QmixPump(object):
             The name of the pump.
 
         restore_drive_pos_counter : bool
-            Whether to restore the pump drive position counter from the pyqmix
-            config file.
+            Whether to restore the pump drive position counter. The most
+            recent value recorded in the drive position journal is used;
+            if there is none, the value is read from the pyqmix config file.
 
         auto_enable : bool
             Whether to enable (i.e., activate) the pump on object instantiation.
 
-        """
-        cfg = config.read_config()
-        dll_dir = cfg.get('qmix_dll_dir', None)
-        dll_filename = 'labbCAN_Pump_API.dll'
+        poll_strategy : object or None
+            How to poll the pump when waiting for an operation to complete,
+            e.g. :class:`pyqmix.waiting.AdaptiveBackoff` or
+            :class:`pyqmix.waiting.FixedInterval`. If ``None``, use
+            :class:`pyqmix.waiting.AdaptiveBackoff` with default parameters.
 
-        dll_path = find_dll(dll_dir=dll_dir, dll_filename=dll_filename)
-        if dll_path is None:
-            msg = 'Could not find the Qmix SDK DLL %s.' % dll_filename
-            raise RuntimeError(msg)
-        else:
-            self.dll_path = dll_path
+        handle, valve_handle : int or None
+            The device handles of the pump and its valve, e.g. from
+            :class:`pyqmix.inventory.DeviceInventory`. If ``None``, they
+            are looked up via the SDK.
 
-        self._ffi = FFI()
-        self._ffi.cdef(PUMP_HEADER)
-        self._dll = self._ffi.dlopen(self.dll_path)
+        """
+        self._library = load_library('pump')
+        self.dll_path = self._library.dll_path
+        self._ffi = self._library.ffi
+        self._dll = self._library.lib
+        self._functions = self._library.functions
 
         self.index = index
         self._name = name
 
-        self._handle = self._ffi.new('dev_hdl *', 0)
-        self._call('LCP_GetPumpHandle', self.index, self._handle)
+        if poll_strategy is None:
+            poll_strategy = AdaptiveBackoff()
+        self.poll_strategy = poll_strategy
+
+        self._cancel_event = threading.Event()
+        self._operation = None
+        self._operation_start = None
+        self._operation_level = None
+        self._expected_duration = None
+
+        # Units, syringe parameters, and the limits derived from them only
+        # change via our own setters, so they are cached; see `refresh()`.
+        self._state = dict()
+
+        # Set by `pyqmix.monitor.PumpMonitor.register()`.
+        self.monitor = None
+
+        self._journal = get_journal()
+
+        if handle is None:
+            self._handle = self._ffi.new('dev_hdl *', 0)
+            self._call('LCP_GetPumpHandle', self.index, self._handle)
+        else:
+            self._handle = self._ffi.new('dev_hdl *', handle)
 
         self._flow_rate_max = self._ffi.new('double *')
         self._p_fill_level = self._ffi.new('double *')
@@ -88,8 +151,12 @@ class QmixPump(object):
 
         self._p_drive_pos_counter = self._ffi.new('long *')
 
-        self._valve_handle = self._ffi.new('dev_hdl *', 0)
-        self._call('LCP_GetValveHandle', self._handle[0], self._valve_handle)
+        if valve_handle is None:
+            self._valve_handle = self._ffi.new('dev_hdl *', 0)
+            self._call('LCP_GetValveHandle', self._handle[0],
+                       self._valve_handle)
+        else:
+            self._valve_handle = self._ffi.new('dev_hdl *', valve_handle)
         self.valve = QmixValve(handle=self._valve_handle)
 
         if self.is_in_fault_state:
@@ -106,44 +173,261 @@ class QmixPump(object):
         if self.auto_enable:
             self.enable()
 
-        try:  # Try to restore settings from configuration file.
-            pump_config = cfg['pumps'][self.index]
+        # Restoring or creating the settings involves several configuration
+        # changes; write them to disk only once.
+        with config.batch():
+            try:  # Try to restore settings from configuration file.
+                pump_config = config._get('pumps', {})[self.index]
+
+                # We get back CommentedOrderedMap's, so convert to dicts.
+                volume_unit = dict(pump_config['volume_unit'])
+                flow_unit = dict(pump_config['flow_unit'])
+                syringe_params = dict(pump_config['syringe_params'])
+
+                name = pump_config['name']
+
+                if restore_drive_pos_counter:
+                    drive_pos_counter = self._journal.latest(self.index)
+                    if drive_pos_counter is None:
+                        drive_pos_counter = pump_config['drive_pos_counter']
+                else:
+                    drive_pos_counter = self.drive_pos_counter
+
+                if self._name == '':
+                    self._name = name
+
+                self.volume_unit = volume_unit
+                self.flow_unit = flow_unit
+                self.syringe_params = syringe_params
+                self.drive_pos_counter = drive_pos_counter
+            except KeyError:  # Write default values to configuration file.
+                config.add_pump(self.index)
+                config.set_pump_name(self.index, self._name)
+                config.set_pump_drive_pos_counter(self.index,
+                                                  self.drive_pos_counter)
+
+                self.set_flow_unit()
+                self.set_volume_unit()
+                self.set_syringe_params_by_type('50 mL glass')
+
+        atexit.register(self.save_drive_pos_counter)
+
+    def _cached(self, key, read):
+        try:
+            return self._state[key]
+        except KeyError:
+            value = self._state[key] = read()
+            return value
+
+    def _read_volume_unit(self):
+        self._call('LCP_GetVolumeUnit', self._handle[0],
+                   self._p_volume_prefix, self._p_volume_unit)
+        return self._p_volume_prefix[0], self._p_volume_unit[0]
+
+    def _read_flow_unit(self):
+        self._call('LCP_GetFlowUnit', self._handle[0], self._p_flow_prefix,
+                   self._p_flow_volume_unit, self._p_flow_time_unit)
+        return (self._p_flow_prefix[0], self._p_flow_volume_unit[0],
+                self._p_flow_time_unit[0])
+
+    def _read_syringe_params(self):
+        self._call('LCP_GetSyringeParam', self._handle[0],
+                   self._p_inner_diameter_mm, self._p_max_piston_stroke_mm)
+        return (self._p_inner_diameter_mm[0],
+                self._p_max_piston_stroke_mm[0])
 
-            # We get back CommentedOrderedMap's, so convert to dicts.
-            volume_unit = dict(pump_config['volume_unit'])
-            flow_unit = dict(pump_config['flow_unit'])
-            syringe_params = dict(pump_config['syringe_params'])
+    def _read_volume_max(self):
+        self._call('LCP_GetVolumeMax', self._handle[0], self._p_volume_max)
+        return self._p_volume_max[0]
 
-            name = pump_config['name']
+    def _read_max_flow_rate(self):
+        self._call('LCP_GetFlowRateMax', self._handle[0], self._flow_rate_max)
+        return self._flow_rate_max[0]
 
-            if restore_drive_pos_counter:
-                drive_pos_counter = pump_config['drive_pos_counter']
-            else:
-                drive_pos_counter = self.drive_pos_counter
+    def _invalidate_limits(self):
+        # The maximum volume and flow rate are reported in the current units
+        # and depend on the syringe.
+        self._state.pop('volume_max', None)
+        self._state.pop('max_flow_rate', None)
 
-            if self._name == '':
-                self._name = name
+    def refresh(self):
+        """
+        Re-read the units, syringe parameters, maximum volume, and maximum
+        flow rate from the device.
 
-            self.volume_unit = volume_unit
-            self.flow_unit = flow_unit
-            self.syringe_params = syringe_params
-            self.drive_pos_counter = drive_pos_counter
-        except KeyError:  # Write default values to configuration file.
-            config.add_pump(self.index)
-            config.set_pump_name(self.index, self._name)
-            config.set_pump_drive_pos_counter(self.index,
-                                              self.drive_pos_counter)
+        These values are cached, since they normally only change via the
+        setters of this object. Call this method if they might have been
+        changed otherwise, e.g. by another application or after a power
+        cycle of the device.
 
-            self.set_flow_unit()
-            self.set_volume_unit()
-            self.set_syringe_params_by_type('50 mL glass')
+        """
+        self._state = dict(volume_unit=self._read_volume_unit(),
+                           flow_unit=self._read_flow_unit(),
+                           syringe_params=self._read_syringe_params(),
+                           volume_max=self._read_volume_max(),
+                           max_flow_rate=self._read_max_flow_rate())
 
-        atexit.register(self.save_drive_pos_counter)
+    def _begin_operation(self, expected_duration=None):
+        # Record the start of a new operation, so that waiting for its
+        # completion can be timed from its predicted end. The fill level
+        # reveals moves that were too short to be observed pumping.
+        self._cancel_event.clear()
+        self._operation_level = self.get_fill_level()
+        self._operation_start = clock()
+        self._expected_duration = expected_duration
+
+    def _estimate_duration(self, volume, flow_rate):
+        """
+        Estimate the time needed to pump a volume at a given flow rate.
+
+        Parameters
+        ----------
+        volume : float
+            The volume in the currently set volume unit.
 
-    def _call(self, func_name, *args):
-        func = getattr(self._dll, func_name)
-        r = func(*args)
-        return CHK(r)
+        flow_rate : float
+            The flow rate in the currently set flow unit.
+
+        Returns
+        -------
+        float or None
+            The expected duration in seconds, or ``None`` if it cannot be
+            predicted.
+
+        """
+        if flow_rate == 0:
+            return None
+
+        volume_prefix, _ = self._cached('volume_unit',
+                                        self._read_volume_unit)
+        flow_prefix, _, time_unit = self._cached('flow_unit',
+                                                 self._read_flow_unit)
+
+        # The SI prefixes are encoded as powers of ten, and the time units
+        # as their duration in seconds.
+        volume = abs(volume) * 10.0 ** volume_prefix
+        flow_rate = abs(flow_rate) * 10.0 ** flow_prefix
+        return volume / flow_rate * time_unit
+
+    def _uses_monitor(self):
+        return self.monitor is not None and self.monitor.is_running
+
+    def _completion_conditions(self, start=None, level=None,
+                               expected_duration=None):
+        # Return two callables, indicating whether an operation has
+        # started and whether it has finished. If a monitor is running,
+        # they read its cached state instead of querying the DLL.
+        #
+        # The operation was started at `start` with the syringe at fill
+        # level `level`; both default to the current operation. It counts
+        # as started once the pump has been seen pumping, or if the pump
+        # is idle and its fill level has changed, i.e. the move ended
+        # between two samples. If neither happens until `_START_MARGIN`
+        # after the expected end, the pump is assumed to never have moved.
+        if start is None:
+            start = self._operation_start
+            level = self._operation_level
+            expected_duration = self._expected_duration
+        if start is None:  # No operation has been started yet.
+            start = clock()
+        start_deadline = start + (expected_duration or 0) + _START_MARGIN
+
+        if self._uses_monitor():
+            def sample():
+                state = self.monitor.state(self)
+                if state is None or state.timestamp < start:
+                    return None, None
+                return state.is_pumping, state.fill_level
+        else:
+            def sample():
+                if self.is_pumping:
+                    return True, None
+                return False, self.get_fill_level()
+
+        def started():
+            is_pumping, fill_level = sample()
+            if is_pumping is None:
+                return False
+            return (is_pumping or fill_level != level or
+                    clock() > start_deadline)
+
+        def finished():
+            return sample()[0] is False
+
+        return started, finished
+
+    def _wait_until_done(self, timeout=None, wait_for_start=True,
+                         condition=None):
+        # Shared implementation of all `wait_until_done` code paths.
+        started, finished = self._completion_conditions()
+        if condition is None:
+            condition = finished
+
+        if self._uses_monitor():
+            monitor = self.monitor
+
+            def wait(condition, timeout, **kwargs):
+                monitor.wait_until(condition, timeout=timeout,
+                                   cancel_event=self._cancel_event)
+        else:
+            def wait(condition, timeout, **kwargs):
+                wait_until(condition, strategy=self.poll_strategy,
+                           timeout=timeout, cancel_event=self._cancel_event,
+                           **kwargs)
+
+        wait_start = clock()
+
+        try:
+            if wait_for_start:
+                # Wait until pumping has actually started. This ends at the
+                # latest `_START_MARGIN` after the expected end of the
+                # operation, even without a timeout.
+                wait(started, timeout)
+
+            if timeout is not None:
+                timeout = max(timeout - (clock() - wait_start), 0)
+
+            # Now wait until the pumping has finished.
+            wait(condition, timeout,
+                 expected_duration=self._expected_duration,
+                 start=self._operation_start)
+        finally:
+            self._cancel_event.clear()
+
+        self.save_drive_pos_counter()
+
+    def wait(self, timeout=None):
+        """
+        Block until the current pumping operation has finished.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Maximum time to wait in seconds. If ``None``, wait indefinitely.
+
+        Raises
+        ------
+        pyqmix.waiting.WaitTimeout
+            If the operation did not finish within `timeout` seconds. The
+            pump is **not** stopped in this case.
+
+        pyqmix.waiting.WaitCancelled
+            If waiting was aborted via :func:`~pyqmix.QmixPump.cancel`.
+
+        """
+        self._wait_until_done(timeout=timeout, wait_for_start=False)
+
+    def cancel(self):
+        """
+        Stop pumping and abort any ongoing wait for completion.
+
+        Threads blocked in a pumping method with `wait_until_done=True`
+        or in :func:`~pyqmix.QmixPump.wait` will raise
+        :class:`pyqmix.waiting.WaitCancelled`.
+
+        """
+        self.stop()
+        self._cancel_event.set()
 
     @property
     def name (self):
@@ -235,7 +519,7 @@ class QmixPump(object):
         else:
             return True
 
-    def calibrate(self, wait_until_done=False):
+    def calibrate(self, wait_until_done=False, timeout=None):
         """
         Executes a reference move for a syringe pump.
 
@@ -248,12 +532,35 @@ class QmixPump(object):
         wait_until_done : bool
             Whether to block further program execution until done.
 
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        Returns
+        -------
+        pyqmix.operation.PumpOperation
+            A future-like handle of the operation. If `wait_until_done=True`,
+            the operation has already completed.
+
         """
+        self._begin_operation()
         self._call('LCP_SyringePumpCalibrate', self._handle[0])
 
+        def finished():
+            return self.is_calibration_finished
+
+        operation = PumpOperation(self, wait_for_start=False,
+                                  condition=finished)
+        self._operation = operation
+
         if wait_until_done:
-            while not self.is_calibration_finished:
-                time.sleep(0.0005)
+            self._wait_for(operation, timeout=timeout, wait_for_start=False,
+                           condition=finished)
+            operation._resolve()
+        else:
+            operation._track()
+
+        return operation
 
     @property
     def n_pumps(self):
@@ -285,9 +592,14 @@ class QmixPump(object):
             The volume unit identifier: ``litres``.
 
         """
-        self._call('LCP_SetVolumeUnit', self._handle[0],
-                   getattr(self._dll, prefix.upper()),
-                   getattr(self._dll, unit.upper()))
+        volume_unit = (
+            _unit_constant(_PREFIXES, prefix, 'volume unit prefix'),
+            _unit_constant(_VOLUME_UNITS, unit, 'volume unit'))
+
+        self._state.pop('volume_unit', None)
+        self._invalidate_limits()
+        self._call('LCP_SetVolumeUnit', self._handle[0], *volume_unit)
+        self._state['volume_unit'] = volume_unit
 
         config.set_pump_volume_unit(self.index, prefix=prefix, unit=unit)
 
@@ -301,23 +613,16 @@ class QmixPump(object):
             A dictionary with the keys `prefix` and `unit`.
 
         """
-        self._call('LCP_GetVolumeUnit', self._handle[0],
-                   self._p_volume_prefix, self._p_volume_unit)
+        prefix, unit = self._cached('volume_unit', self._read_volume_unit)
 
-        if self._p_volume_prefix[0] == self._dll.MICRO:
-            prefix = 'micro'
-        elif self._p_volume_prefix[0] == self._dll.MILLI:
-            prefix = 'milli'
-        elif self._p_volume_prefix[0] == self._dll.CENTI:
-            prefix = 'centi'
-        elif self._p_volume_prefix[0] == self._dll.DECI:
-            prefix = 'deci'
-        else:
+        try:
+            prefix = _PREFIX_NAMES[prefix]
+        except KeyError:
             raise RuntimeError('Invalid volume unit prefix retrieved.')
 
-        if self._p_volume_unit[0] == self._dll.LITRES:
-            unit = 'litres'
-        else:
+        try:
+            unit = _VOLUME_UNIT_NAMES[unit]
+        except KeyError:
             raise RuntimeError('Invalid flow volume unit retrieved.')
 
         return OrderedDict([('prefix', prefix),
@@ -342,8 +647,25 @@ class QmixPump(object):
 
     @property
     def volume_max(self):
-        self._call('LCP_GetVolumeMax', self._handle[0], self._p_volume_max)
-        return self._p_volume_max[0]
+        """
+        The maximum volume of the syringe, in the current volume unit.
+
+        """
+        return self._cached('volume_max', self._read_volume_max)
+
+    @property
+    def flow_scale(self):
+        """
+        The volume pumped in one second at a flow rate of 1, in the current
+        volume unit. Multiply a flow rate and a duration in seconds by this
+        factor to obtain a volume.
+
+        """
+        volume_prefix, _ = self._cached('volume_unit',
+                                        self._read_volume_unit)
+        flow_prefix, _, time_unit = self._cached('flow_unit',
+                                                 self._read_flow_unit)
+        return 10.0 ** (flow_prefix - volume_prefix) / time_unit
 
     def set_flow_unit(self, prefix='milli', volume_unit='litres',
                       time_unit='per_second'):
@@ -367,10 +689,15 @@ class QmixPump(object):
             ``per_hour``, ``per_minute``, ``per_second``.
 
         """
-        self._call('LCP_SetFlowUnit', self._handle[0],
-                   getattr(self._dll, prefix.upper()),
-                   getattr(self._dll, volume_unit.upper()),
-                   getattr(self._dll, time_unit.upper()))
+        flow_unit = (
+            _unit_constant(_PREFIXES, prefix, 'flow unit prefix'),
+            _unit_constant(_VOLUME_UNITS, volume_unit, 'volume unit'),
+            _unit_constant(_TIME_UNITS, time_unit, 'time unit'))
+
+        self._state.pop('flow_unit', None)
+        self._invalidate_limits()
+        self._call('LCP_SetFlowUnit', self._handle[0], *flow_unit)
+        self._state['flow_unit'] = flow_unit
 
         config.set_pump_flow_unit(self.index, prefix=prefix,
                                   volume_unit=volume_unit, time_unit=time_unit)
@@ -386,32 +713,22 @@ class QmixPump(object):
             `time_unit`.
 
         """
-        self._call('LCP_GetFlowUnit', self._handle[0], self._p_flow_prefix,
-                   self._p_flow_volume_unit, self._p_flow_time_unit)
+        prefix, volume_unit, time_unit = self._cached('flow_unit',
+                                                      self._read_flow_unit)
 
-        if self._p_flow_prefix[0] == self._dll.MICRO:
-            prefix = 'micro'
-        elif self._p_flow_prefix[0] == self._dll.MILLI:
-            prefix = 'milli'
-        elif self._p_flow_prefix[0] == self._dll.CENTI:
-            prefix = 'centi'
-        elif self._p_flow_prefix[0] == self._dll.DECI:
-            prefix = 'deci'
-        else:
+        try:
+            prefix = _PREFIX_NAMES[prefix]
+        except KeyError:
             raise RuntimeError('Invalid flow unit prefix retrieved.')
 
-        if self._p_flow_volume_unit[0] == self._dll.LITRES:
-            volume_unit = 'litres'
-        else:
+        try:
+            volume_unit = _VOLUME_UNIT_NAMES[volume_unit]
+        except KeyError:
             raise RuntimeError('Invalid flow volume unit retrieved.')
 
-        if self._p_flow_time_unit[0] == self._dll.PER_SECOND:
-            time_unit = 'per_second'
-        elif self._p_flow_time_unit[0] == self._dll.PER_MINUTE:
-            time_unit = 'per_minute'
-        elif self._p_flow_time_unit[0] == self._dll.PER_HOUR:
-            time_unit = 'per_hour'
-        else:
+        try:
+            time_unit = _TIME_UNIT_NAMES[time_unit]
+        except KeyError:
             raise RuntimeError('Invalid flow time unit retrieved.')
 
         return OrderedDict([('prefix', prefix),
@@ -456,6 +773,10 @@ class QmixPump(object):
             syringe pump pusher.
 
         """
+        # The device may adjust the parameters, so they are read back on
+        # next access.
+        self._state.pop('syringe_params', None)
+        self._invalidate_limits()
         self._call('LCP_SetSyringeParam', self._handle[0], inner_diameter_mm,
                    max_piston_stroke_mm)
 
@@ -497,12 +818,12 @@ class QmixPump(object):
             Returns a dictionary with the keys `inner_diameter_mm` and
             `max_piston_stroke_mm`.
         """
-        self._call('LCP_GetSyringeParam', self._handle[0],
-                   self._p_inner_diameter_mm, self._p_max_piston_stroke_mm)
+        inner_diameter_mm, max_piston_stroke_mm = self._cached(
+            'syringe_params', self._read_syringe_params)
 
         return OrderedDict(
-            [('inner_diameter_mm', self._p_inner_diameter_mm[0]),
-             ('max_piston_stroke_mm', self._p_max_piston_stroke_mm[0])])
+            [('inner_diameter_mm', inner_diameter_mm),
+             ('max_piston_stroke_mm', max_piston_stroke_mm)])
 
     @property
     def syringe_params(self):
@@ -536,11 +857,96 @@ class QmixPump(object):
             The maximum flow rate in configured SI unit
 
         """
-        self._call('LCP_GetFlowRateMax', self._handle[0], self._flow_rate_max)
-        return self._flow_rate_max[0]
+        return self._cached('max_flow_rate', self._read_max_flow_rate)
+
+    def _prepare_aspirate(self, volume, flow_rate):
+        # Validate the parameters of a pumping command. All `_prepare_*`
+        # methods return the valve position to switch to, the name and
+        # arguments (except for the pump handle) of the DLL function to
+        # call, and the expected duration of the operation.
+        if volume <= 0:
+            raise ValueError('Volume must be positive.')
+        if flow_rate <= 0:
+            raise ValueError('Flow rate must be positive.')
+        if self.fill_level + volume > self.volume_max:
+            msg = 'Aspiration would exceed syringe volume.'
+            raise ValueError(msg)
+
+        return (self.valve.aspirate_pos, 'LCP_Aspirate', (volume, flow_rate),
+                self._estimate_duration(volume, flow_rate))
+
+    def _prepare_dispense(self, volume, flow_rate):
+        if volume <= 0:
+            raise ValueError('Volume must be positive.')
+        if flow_rate <= 0:
+            raise ValueError('Flow rate must be positive.')
+        if self.fill_level < volume:
+            msg = 'Current syringe fill level is insufficient.'
+            raise ValueError(msg)
+
+        return (self.valve.dispense_pos, 'LCP_Dispense', (volume, flow_rate),
+                self._estimate_duration(volume, flow_rate))
+
+    def _prepare_set_fill_level(self, level, flow_rate):
+        if level < 0:
+            raise ValueError('Target level must be >= 0.')
+        if flow_rate <= 0:
+            raise ValueError('Flow rate must be positive.')
+
+        # Switch the valves to inlet or outlet position, depending on
+        # whether we are going to aspirate or to dispense.
+        fill_level = self.get_fill_level()
+        if level < fill_level:
+            valve_pos = self.valve.dispense_pos
+        else:
+            valve_pos = self.valve.aspirate_pos
+
+        return (valve_pos, 'LCP_SetFillLevel', (level, flow_rate),
+                self._estimate_duration(level - fill_level, flow_rate))
+
+    def _prepare_generate_flow(self, flow_rate):
+        if flow_rate == 0:
+            raise ValueError('Flow rate must be non-zero.')
+
+        # The flow stops once the syringe is empty or full, respectively.
+        if flow_rate > 0:
+            valve_pos = self.valve.dispense_pos
+            volume = self.fill_level
+        else:
+            valve_pos = self.valve.aspirate_pos
+            volume = self.volume_max - self.fill_level
+
+        return (valve_pos, 'LCP_GenerateFlow', (flow_rate,),
+                self._estimate_duration(volume, flow_rate))
+
+    def _start(self, command, track=True):
+        # Switch the valve and issue a command returned by one of the
+        # `_prepare_*` methods. Operations that are waited for in the
+        # calling thread are not passed to the watcher, so the pump is not
+        # polled twice.
+        valve_pos, func_name, args, expected_duration = command
+
+        self.valve.switch_position(valve_pos)
+        self._begin_operation(expected_duration)
+        self._call(func_name, self._handle[0], *args)
+
+        operation = PumpOperation(self)
+        self._operation = operation
+        if track:
+            operation._track()
+        return operation
+
+    def _wait_for(self, operation, timeout=None, **kwargs):
+        # Wait for an untracked operation in the calling thread. If waiting
+        # fails, e.g. times out, the watcher takes over the operation.
+        try:
+            self._wait_until_done(timeout=timeout, **kwargs)
+        except BaseException:
+            operation._track()
+            raise
 
     def aspirate(self, volume, flow_rate, wait_until_done=False,
-                 switch_valve_when_done=False):
+                 switch_valve_when_done=False, timeout=None):
         """
         Aspirate a certain volume with the specified flow rate.
 
@@ -560,6 +966,16 @@ class QmixPump(object):
             If set to ``True``, it switches valve to dispense position after
             the aspiration is finished. Implies `wait_until_done=True`.
 
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        Returns
+        -------
+        pyqmix.operation.PumpOperation
+            A future-like handle of the operation. If `wait_until_done=True`,
+            the operation has already completed.
+
         Raises
         ------
         ValueError
@@ -573,34 +989,24 @@ class QmixPump(object):
         before the actual aspiration begins.
 
         """
-        if volume <= 0:
-            raise ValueError('Volume must be positive.')
-        if flow_rate <= 0:
-            raise ValueError('Flow rate must be positive.')
-        if self.fill_level + volume > self.volume_max:
-            msg = 'Aspiration would exceed syringe volume.'
-            raise ValueError(msg)
-
         if switch_valve_when_done:
             wait_until_done = True
 
-        self.valve.switch_position(self.valve.aspirate_pos)
-        self._call('LCP_Aspirate', self._handle[0], volume, flow_rate)
+        operation = self._start(self._prepare_aspirate(volume, flow_rate),
+                                track=not wait_until_done)
 
         if wait_until_done:
-            # Wait until pumping has actually started.
-            while not self.is_pumping:
-                time.sleep(0.0005)
-
-            # Now wait until the pumping has finished.
-            while self.is_pumping:
-                time.sleep(0.0005)
+            self._wait_for(operation, timeout=timeout)
 
             if switch_valve_when_done:
                 self.valve.switch_position(self.valve.dispense_pos)
 
+            operation._resolve()
+
+        return operation
+
     def dispense(self, volume, flow_rate, wait_until_done=False,
-                 switch_valve_when_done=False):
+                 switch_valve_when_done=False, timeout=None):
         """
         Dispense a certain volume with a certain flow rate.
 
@@ -622,6 +1028,16 @@ class QmixPump(object):
             If set to ``True``, it switches valve to aspirate position after
             the dispense is finished. Implies `wait_until_done=True`.
 
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        Returns
+        -------
+        pyqmix.operation.PumpOperation
+            A future-like handle of the operation. If `wait_until_done=True`,
+            the operation has already completed.
+
         Raises
         ------
         ValueError
@@ -635,34 +1051,24 @@ class QmixPump(object):
         before the actual aspiration begins.
 
         """
-        if volume <= 0:
-            raise ValueError('Volume must be positive.')
-        if flow_rate <= 0:
-            raise ValueError('Flow rate must be positive.')
-        if self.fill_level < volume:
-            msg = 'Current syringe fill level is insufficient.'
-            raise ValueError(msg)
-
         if switch_valve_when_done:
             wait_until_done = True
 
-        self.valve.switch_position(self.valve.dispense_pos)
-        self._call('LCP_Dispense', self._handle[0], volume, flow_rate)
+        operation = self._start(self._prepare_dispense(volume, flow_rate),
+                                track=not wait_until_done)
 
         if wait_until_done:
-            # Wait until pumping has actually started.
-            while not self.is_pumping:
-                time.sleep(0.0005)
-
-            # Now wait until the pumping has finished.
-            while self.is_pumping:
-                time.sleep(0.0005)
+            self._wait_for(operation, timeout=timeout)
 
             if switch_valve_when_done:
                 self.valve.switch_position(self.valve.aspirate_pos)
 
+            operation._resolve()
+
+        return operation
+
     def set_fill_level(self, level, flow_rate, wait_until_done=False,
-                       switch_valve_when_done=False):
+                       switch_valve_when_done=False, timeout=None):
         """
         Pumps fluid with the given flow rate until the requested fill level is
         reached.
@@ -687,6 +1093,16 @@ class QmixPump(object):
             If set to ``True``, it switches valve to dispense position after
             the aspiration is finished. Implies `wait_until_done=True`.
 
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        Returns
+        -------
+        pyqmix.operation.PumpOperation
+            A future-like handle of the operation. If `wait_until_done=True`,
+            the operation has already completed.
+
         Raises
         ------
         ValueError
@@ -694,37 +1110,25 @@ class QmixPump(object):
             non-positive.
 
         """
-        if level < 0:
-            raise ValueError('Target level must be >= 0.')
-        if flow_rate <= 0:
-            raise ValueError('Flow rate must be positive.')
-
         if switch_valve_when_done:
             wait_until_done = True
 
-        # Switch the valves to inlet or outlet position, depending on
-        # whether we are going to aspirate or to dispense.
-        if level < self.get_fill_level():
-            self.valve.switch_position(self.valve.dispense_pos)
-        else:
-            self.valve.switch_position(self.valve.aspirate_pos)
-
-        self._call('LCP_SetFillLevel', self._handle[0], level, flow_rate)
+        operation = self._start(self._prepare_set_fill_level(level,
+                                                             flow_rate),
+                                track=not wait_until_done)
 
         if wait_until_done:
-            # Wait until pumping has actually started.
-            while not self.is_pumping:
-                time.sleep(0.0005)
-
-            # Now wait until the pumping has finished.
-            while self.is_pumping:
-                time.sleep(0.0005)
+            self._wait_for(operation, timeout=timeout)
 
             if switch_valve_when_done:
                 self.valve.switch_position(self.valve.aspirate_pos)
 
+            operation._resolve()
+
+        return operation
+
     def generate_flow(self, flow_rate, wait_until_done=False,
-                      switch_valve_when_done=False):
+                      switch_valve_when_done=False, timeout=None):
         """
         Generate a continuous flow.
 
@@ -743,39 +1147,40 @@ class QmixPump(object):
             If set to ``True``, it switches valve to dispense position after
             the aspiration is finished. Implies `wait_until_done=True`.
 
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        Returns
+        -------
+        pyqmix.operation.PumpOperation
+            A future-like handle of the operation. If `wait_until_done=True`,
+            the operation has already completed.
+
         Raises
         ------
         ValueError
             If a flow rate of zero is specified.
 
         """
-        if flow_rate == 0:
-            raise ValueError('Flow rate must be non-zero.')
-
         if switch_valve_when_done:
             wait_until_done = True
 
-        if flow_rate > 0:
-            self.valve.switch_position(self.valve.dispense_pos)
-        else:
-            self.valve.switch_position(self.valve.aspirate_pos)
-
-        self._call('LCP_GenerateFlow', self._handle[0], flow_rate)
+        operation = self._start(self._prepare_generate_flow(flow_rate),
+                                track=not wait_until_done)
 
         if wait_until_done:
-            # Wait until pumping has actually started.
-            while not self.is_pumping:
-                time.sleep(0.0005)
-
-            # Now wait until the pumping has finished.
-            while self.is_pumping:
-                time.sleep(0.0005)
+            self._wait_for(operation, timeout=timeout)
 
             if switch_valve_when_done:
                 self.valve.switch_position(self.valve.aspirate_pos)
 
+            operation._resolve()
+
+        return operation
+
     def fill(self, flow_rate, wait_until_done=False,
-             switch_valve_when_done=False):
+             switch_valve_when_done=False, timeout=None):
         """
         Fill the syringe.
 
@@ -791,6 +1196,16 @@ class QmixPump(object):
             If set to ``True``, it switches valve to dispense position after
             the aspiration is finished. Implies `wait_until_done=True`.
 
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        Returns
+        -------
+        pyqmix.operation.PumpOperation
+            A future-like handle of the operation. If `wait_until_done=True`,
+            the operation has already completed.
+
         Raises
         ------
         ValueError
@@ -810,11 +1225,12 @@ class QmixPump(object):
         if switch_valve_when_done:
             wait_until_done = True
 
-        self.generate_flow(-flow_rate, wait_until_done=wait_until_done,
-                           switch_valve_when_done=switch_valve_when_done)
+        return self.generate_flow(
+            -flow_rate, wait_until_done=wait_until_done,
+            switch_valve_when_done=switch_valve_when_done, timeout=timeout)
 
     def empty(self, flow_rate, wait_until_done=False,
-              switch_valve_when_done=False):
+              switch_valve_when_done=False, timeout=None):
         """
         Empty the syringe.
 
@@ -830,6 +1246,16 @@ class QmixPump(object):
             If set to ``True``, it switches valve to dispense position after
             the aspiration is finished. Implies `wait_until_done=True`.
 
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        Returns
+        -------
+        pyqmix.operation.PumpOperation
+            A future-like handle of the operation. If `wait_until_done=True`,
+            the operation has already completed.
+
         Raises
         ------
         ValueError
@@ -847,8 +1273,51 @@ class QmixPump(object):
         if switch_valve_when_done:
             wait_until_done = True
 
-        self.generate_flow(flow_rate, wait_until_done=wait_until_done,
-                           switch_valve_when_done=switch_valve_when_done)
+        return self.generate_flow(
+            flow_rate, wait_until_done=wait_until_done,
+            switch_valve_when_done=switch_valve_when_done, timeout=timeout)
+
+    def play_profile(self, profile, wait_until_done=False, timeout=None,
+                     **kwargs):
+        """
+        Play back a time-varying flow profile.
+
+        Parameters
+        ----------
+        profile : pyqmix.profile.FlowProfile
+            The setpoints to play.
+
+        wait_until_done : bool
+            Whether to block until playback has finished.
+
+        timeout : float or None
+            Maximum time to wait in seconds if `wait_until_done=True`.
+            If ``None``, wait indefinitely.
+
+        kwargs
+            Further keyword arguments passed to
+            :class:`pyqmix.profile.ProfilePlayer`.
+
+        Returns
+        -------
+        pyqmix.profile.ProfilePlayer
+            The player, reporting the achieved setpoint timing. Playback can
+            be aborted via :func:`~pyqmix.profile.ProfilePlayer.stop` or
+            :func:`~pyqmix.QmixPump.cancel`.
+
+        Raises
+        ------
+        ValueError
+            If the profile exceeds the maximum flow rate, or would empty or
+            overfill the syringe.
+
+        """
+        from .profile import ProfilePlayer  # Avoid circular imports.
+
+        player = ProfilePlayer(self, profile, auto_start=True, **kwargs)
+        if wait_until_done:
+            player.wait(timeout=timeout)
+        return player
 
     def stop(self):
         """
@@ -856,6 +1325,7 @@ class QmixPump(object):
 
         """
         self._call('LCP_StopPumping', self._handle[0])
+        self.save_drive_pos_counter()
 
     def stop_all_pumps(self):
         """
@@ -996,10 +1466,18 @@ class QmixPump(object):
 
     def save_drive_pos_counter(self):
         """
-        Save the current drive position counter to the configuration file.
+        Save the current drive position counter.
+
+        The value is appended to the drive position journal (see
+        :mod:`pyqmix.journal`), which is cheap enough to be done frequently
+        during operation. The journal is compacted into the configuration
+        file when Python exits.
+
+        This is done automatically whenever waiting for an operation to
+        finish has completed, and when the pump is stopped.
 
         """
-        config.set_pump_drive_pos_counter(self.index, self.drive_pos_counter)
+        self._journal.append(self.index, self.drive_pos_counter)
 
 
 def init_pump(params):
@@ -1036,16 +1514,18 @@ def fill_syringes(pumps, volume=None, flow_rate=1):
     pumps : list of class:~`pyqmix.QmixPump` instances
 
     """
+    if not pumps:
+        return
+
     flow_rate = abs(flow_rate)
+    group = PumpGroup(pumps)
 
     if volume is None:
-        flow_rate *= -1
-        [p.generate_flow(flow_rate=flow_rate) for p in pumps]
+        group.generate_flow(flow_rate=-flow_rate)
     else:
-        [p.aspirate(volume=volume, flow_rate=flow_rate) for p in pumps]
+        group.aspirate(volume=volume, flow_rate=flow_rate)
 
-    while any([p.is_pumping for p in pumps]):
-        time.sleep(0.0005)
+    group.wait()
 
 
 def empty_syringes(pumps, volume=None, flow_rate=1):
@@ -1057,12 +1537,15 @@ def empty_syringes(pumps, volume=None, flow_rate=1):
     pumps : list of class:~`pyqmix.QmixPump` instances
 
     """
+    if not pumps:
+        return
+
     flow_rate = abs(flow_rate)
+    group = PumpGroup(pumps)
 
     if volume is None:
-        [p.generate_flow(flow_rate=flow_rate) for p in pumps]
+        group.generate_flow(flow_rate=flow_rate)
     else:
-        [p.dispense(volume=volume, flow_rate=flow_rate) for p in pumps]
+        group.dispense(volume=volume, flow_rate=flow_rate)
 
-    while any([p.is_pumping for p in pumps]):
-        time.sleep(0.0005)
+    group.wait()
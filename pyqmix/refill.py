@@ -0,0 +1,577 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Refilling syringes automatically.
+
+If the dispense schedule of a pump is known in advance, as a
+:class:`pyqmix.profile.FlowProfile`, :func:`plan_refills` inserts refills
+into the idle windows of the profile, such that the syringe never runs
+empty::
+
+    plan = plan_refills(pump, profile, refill_rate=2)
+    pump.play_profile(plan.profile)
+
+Otherwise, a :class:`RefillScheduler` watches the fill levels of a set of
+pumps at runtime, and refills every pump that runs low while it is idle.
+It can also deliver a continuous flow by alternating between the pumps:
+while one pump dispenses, the others refill, and the flow is handed over to
+the next full pump shortly before the active one runs empty::
+
+    scheduler = RefillScheduler([pump_1, pump_2], refill_rate=2)
+    scheduler.deliver(flow_rate=0.5)
+    ...
+    scheduler.stop()
+    print(scheduler.continuity())
+"""
+
+import threading
+from collections import namedtuple
+
+from .tools import clock
+from .monitor import PumpMonitor
+from .profile import FlowProfile
+from .continuous import Handover, _REFILL_MARGIN, _gap_and_overlap
+
+#: A refill planned by :func:`plan_refills`: its start and end in seconds
+#: relative to the start of the profile, and the volume aspirated.
+Refill = namedtuple('Refill', ['start', 'end', 'volume'])
+
+
+class RefillPlan(object):
+    """
+    A dispense profile with refills; created by :func:`plan_refills`.
+
+    Attributes
+    ----------
+    profile : :class:`pyqmix.profile.FlowProfile`
+        The dispense profile with the refills inserted.
+
+    refills : list of Refill
+        The planned refills.
+
+    min_level : float
+        The lowest predicted fill level during the profile.
+
+    final_level : float
+        The predicted fill level at the end of the profile.
+
+    """
+    def __init__(self, profile, refills, min_level, final_level):
+        self.profile = profile
+        self.refills = refills
+        self.min_level = min_level
+        self.final_level = final_level
+
+    def __repr__(self):
+        return ('<RefillPlan: %d refills, minimum level %f>'
+                % (len(self.refills), self.min_level))
+
+
+def plan_refills(pump, profile, refill_rate, target_level=None,
+                 min_volume=0., margin=0.1):
+    """
+    Plan refills in the idle windows of a dispense profile.
+
+    In every window in which the profile does not pump, the syringe is
+    refilled as far towards `target_level` as the window allows.
+
+    Parameters
+    ----------
+    pump : :class:`pyqmix.QmixPump`
+        The pump, providing its fill level, maximum volume, and units.
+
+    profile : :class:`pyqmix.profile.FlowProfile`
+        The dispense profile, with positive flow rates while dispensing and
+        zero while idle.
+
+    refill_rate : float > 0
+        The flow rate to refill with.
+
+    target_level : float or None
+        The fill level to refill to. If ``None``, refill completely.
+
+    min_volume : float
+        Windows in which less than this volume could be refilled are
+        skipped.
+
+    margin : float
+        The time left unused at the beginning and end of every window, in
+        seconds, e.g. to switch the valve.
+
+    Returns
+    -------
+    RefillPlan
+        The profile with the refills, and the predicted fill levels.
+
+    Raises
+    ------
+    ValueError
+        If the refill rate exceeds the maximum flow rate of the pump, or if
+        the syringe would run empty despite the refills.
+
+    """
+    if refill_rate <= 0:
+        raise ValueError('Refill rate must be positive.')
+    if refill_rate > pump.max_flow_rate:
+        msg = ('The refill rate exceeds the maximum flow rate of the pump, '
+               '%f.' % pump.max_flow_rate)
+        raise ValueError(msg)
+
+    volume_max = pump.volume_max
+    if target_level is None:
+        target_level = volume_max
+    target_level = min(target_level, volume_max)
+    scale = pump.flow_scale
+
+    level = min_level = pump.fill_level
+    refills = []
+    setpoints = []
+    ends = profile.times[1:] + [profile.duration]
+    for start, end, flow in zip(profile.times, ends, profile.flows):
+        setpoints.append((start, flow))
+        if flow != 0:
+            level -= flow * (end - start) * scale
+            if level < -1e-9 * volume_max:
+                msg = ('The syringe would run empty at %.3f s, even with '
+                       'refills.' % end)
+                raise ValueError(msg)
+            min_level = min(min_level, level)
+            continue
+
+        window = end - start - 2 * margin
+        volume = min(target_level - level, refill_rate * window * scale)
+        if volume <= 0 or volume < min_volume:
+            continue
+
+        refill_start = start + margin
+        refill_end = refill_start + volume / (refill_rate * scale)
+        setpoints.append((refill_start, -refill_rate))
+        setpoints.append((refill_end, 0.))
+        refills.append(Refill(refill_start, refill_end, volume))
+        level += volume
+
+    # Drop setpoints superseded at the same time, and repeated flow rates.
+    times = []
+    flows = []
+    for t, flow in setpoints:
+        if times and t <= times[-1]:
+            times.pop()
+            flows.pop()
+        if flows and flows[-1] == flow:
+            continue
+        times.append(t)
+        flows.append(flow)
+
+    return RefillPlan(FlowProfile(times, flows, profile.duration), refills,
+                      min_level=min_level, final_level=level)
+
+
+class RefillScheduler(object):
+    """
+    Refill pumps automatically while they are idle.
+
+    A pump is refilled once it is not pumping and its fill level has
+    dropped below `low_level`. The state of the pumps is taken from a
+    :class:`pyqmix.monitor.PumpMonitor`.
+
+    Parameters
+    ----------
+    pumps : sequence of :class:`pyqmix.QmixPump` instances
+        The pumps to manage.
+
+    refill_rate : float > 0
+        The flow rate to refill with.
+
+    low_level : float
+        The fraction of the maximum volume below which an idle pump is
+        refilled.
+
+    target_level : float
+        The fraction of the maximum volume to refill to.
+
+    handover_lead : float
+        During :meth:`deliver`, how long before the active pump is
+        predicted to run empty to hand over to the next one, in seconds.
+        Should exceed the sampling interval of the monitor.
+
+    monitor : :class:`pyqmix.monitor.PumpMonitor` or None
+        The monitor providing the pump states. If ``None``, a new monitor
+        is created, and started and stopped together with the scheduler.
+
+    rate : float
+        The sampling rate of a new monitor in Hz.
+
+    max_errors : int
+        The number of consecutive failed scheduling steps after which
+        delivery is stopped and the scheduler thread exits. The error is
+        then available as :attr:`error`.
+
+    auto_start : bool
+        Whether to start the scheduler on object instantiation.
+
+    Attributes
+    ----------
+    error : Exception or None
+        The error that stopped the scheduler, if any.
+
+    last_error : Exception or None
+        The error of the most recent failed scheduling step.
+
+    """
+    def __init__(self, pumps, refill_rate, low_level=0.2, target_level=1.,
+                 handover_lead=0.5, monitor=None, rate=20., max_errors=5,
+                 auto_start=True):
+        if refill_rate <= 0:
+            raise ValueError('Refill rate must be positive.')
+        if not 0 <= low_level < target_level <= 1:
+            raise ValueError('Please specify 0 <= low_level < target_level '
+                             '<= 1.')
+
+        self.pumps = list(pumps)
+        self.refill_rate = refill_rate
+        self.low_level = low_level
+        self.target_level = target_level
+        self.handover_lead = handover_lead
+        self.max_errors = max_errors
+
+        self._owns_monitor = monitor is None
+        if monitor is None:
+            monitor = PumpMonitor(rate=rate, auto_start=False)
+        self.monitor = monitor
+        for pump in self.pumps:
+            if pump not in monitor.pumps:
+                monitor.register(pump)
+
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # Pumps being refilled, mapped to their refill operation and the
+        # time by which it should have finished.
+        self._refilling = dict()
+        # The last handover, while its gap and overlap are being sampled.
+        self._pending_handover = None
+
+        self.flow_rate = None
+        self.active_pump = None
+        self._active_since = clock()
+        self.handovers = []
+        self.n_refills = 0
+        self.error = None
+        self.last_error = None
+        self._reset_continuity()
+
+        if auto_start:
+            self.start()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def is_running(self):
+        """
+        Whether the scheduler thread is running.
+
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def refilling(self):
+        """
+        The pumps currently being refilled.
+
+        """
+        with self._lock:
+            return list(self._refilling)
+
+    def start(self):
+        """
+        Start the scheduler thread.
+
+        """
+        if self.is_running:
+            return
+
+        if self._owns_monitor:
+            self.monitor.start()
+
+        self.error = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='RefillScheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop delivery and the scheduler thread. Running refills are not
+        interrupted.
+
+        """
+        self.stop_delivery()
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+
+        if self._owns_monitor:
+            self.monitor.stop()
+
+    def _is_low(self, pump, level):
+        return level < self.low_level * pump.volume_max
+
+    def _refill(self, pump, level):
+        target = self.target_level * pump.volume_max
+        operation = pump.set_fill_level(target, self.refill_rate)
+        deadline = (clock() + _REFILL_MARGIN +
+                    pump._estimate_duration(target - level, self.refill_rate))
+        self._refilling[pump] = (operation, deadline)
+        self.n_refills += 1
+
+    def _refill_done(self, pump, state):
+        # Fall back to the sampled state if the operation did not resolve
+        # in time.
+        operation, deadline = self._refilling[pump]
+        if operation.done():
+            return True
+        return (state is not None and not state.is_pumping and
+                state.timestamp > deadline)
+
+    def predicted_continuity(self, flow_rate):
+        """
+        Predict whether alternating between the pumps can deliver a flow
+        without gaps.
+
+        Every pump dispenses from the target level until it is almost
+        empty, and is then refilled while the other pumps dispense.
+
+        Parameters
+        ----------
+        flow_rate : float
+            The flow rate to deliver.
+
+        Returns
+        -------
+        dict
+            The time one pump can dispense (``dispense_time``) and needs to
+            refill (``refill_time``), in seconds, whether the flow is
+            ``gap_free``, and the ``margin`` by which the other pumps'
+            dispense time exceeds the refill time.
+
+        """
+        pump = self.pumps[0]
+        volume = self.target_level * pump.volume_max
+        dispense_time = pump._estimate_duration(volume, flow_rate)
+        refill_time = pump._estimate_duration(volume, self.refill_rate)
+        margin = (len(self.pumps) - 1) * dispense_time - refill_time
+        return dict(dispense_time=dispense_time, refill_time=refill_time,
+                    gap_free=margin >= 0, margin=margin)
+
+    def continuity(self):
+        """
+        The achieved continuity of the delivered flow, as sampled by the
+        monitor.
+
+        Returns
+        -------
+        dict
+            The time since delivery started (``elapsed``), the time during
+            which no pump was pumping (``gap_time``), the longest gap
+            (``max_gap``), the fraction of time with flow (``achieved``),
+            and the number of handovers (``n_handovers``) and their minimum
+            sampled ``overlap``, in seconds.
+
+        """
+        with self._lock:
+            elapsed = self._last_sample - self._delivery_start
+            overlaps = [h.overlap for h in self.handovers
+                        if h.overlap is not None]
+            return dict(
+                elapsed=elapsed,
+                gap_time=self._gap_time,
+                max_gap=self._max_gap,
+                achieved=1 - self._gap_time / elapsed if elapsed > 0 else None,
+                n_handovers=len(self.handovers),
+                overlap=min(overlaps) if overlaps else None)
+
+    def _reset_continuity(self):
+        self._delivery_start = self._last_sample = clock()
+        self._gap_start = None
+        self._gap_time = 0.
+        self._max_gap = 0.
+
+    def deliver(self, flow_rate):
+        """
+        Deliver a continuous flow by alternating between the pumps.
+
+        Parameters
+        ----------
+        flow_rate : float > 0
+            The flow rate to deliver.
+
+        Raises
+        ------
+        RuntimeError
+            If the scheduler was stopped by an error; see :attr:`error`.
+
+        """
+        if flow_rate <= 0:
+            raise ValueError('Flow rate must be positive.')
+        if self.error is not None:
+            msg = 'The scheduler was stopped by an error: %s' % self.error
+            raise RuntimeError(msg)
+
+        with self._lock:
+            self.stop_delivery()
+            self.flow_rate = flow_rate
+            self.handovers = []
+            self._pending_handover = None
+            self._reset_continuity()
+            self._hand_over(dict((pump, pump.fill_level)
+                                 for pump in self.pumps))
+
+    def stop_delivery(self):
+        """
+        Stop the continuous flow.
+
+        """
+        with self._lock:
+            self._record_handover()
+            if self.active_pump is not None:
+                self.active_pump.stop()
+            self.active_pump = None
+            self.flow_rate = None
+
+    def _hand_over(self, levels):
+        # Start the next pump holding enough liquid, then stop the active
+        # pump. If there is none, keep the active pump running.
+        current = self.active_pump
+        for pump in self.pumps:
+            if (pump is not current and pump not in self._refilling and
+                    pump in levels and not self._is_low(pump, levels[pump])):
+                break
+        else:
+            return False
+
+        pump.generate_flow(self.flow_rate)
+        started = clock()
+        if current is not None:
+            current.stop()
+            self._record_handover()
+            self._pending_handover = dict(
+                time=started, from_pump=current, to_pump=pump, started=None,
+                stopped=None)
+
+        self.active_pump = pump
+        self._active_since = started
+        return True
+
+    def _observe_handover(self, states):
+        # Record when the incoming pump was first sampled pumping, and the
+        # outgoing pump first sampled idle, after the handover.
+        handover = self._pending_handover
+        if handover is None:
+            return
+
+        for key, pump, pumping in (('started', handover['to_pump'], True),
+                                   ('stopped', handover['from_pump'], False)):
+            state = states.get(pump)
+            if (handover[key] is None and state is not None and
+                    state.timestamp > handover['time'] and
+                    state.is_pumping == pumping):
+                handover[key] = state.timestamp
+
+        if handover['started'] is not None and handover['stopped'] is not None:
+            self._record_handover()
+
+    def _record_handover(self):
+        handover = self._pending_handover
+        if handover is None:
+            return
+
+        gap, overlap = _gap_and_overlap(handover['started'],
+                                        handover['stopped'])
+        self.handovers.append(Handover(
+            time=handover['time'] - self._delivery_start,
+            from_pump=handover['from_pump'], to_pump=handover['to_pump'],
+            timing_error=None, gap=gap, overlap=overlap, pulsation=None,
+            overlap_setting=None))
+        self._pending_handover = None
+
+    def _update_continuity(self, now, flowing):
+        # Account for the time since the last update.
+        if now <= self._last_sample:
+            return
+
+        if flowing:
+            self._gap_start = None
+        else:
+            if self._gap_start is None:
+                self._gap_start = self._last_sample
+            self._gap_time += now - self._last_sample
+            self._max_gap = max(self._max_gap, now - self._gap_start)
+        self._last_sample = now
+
+    def _step(self):
+        states = self.monitor.states()
+        levels = dict((pump, state.fill_level)
+                      for pump, state in states.items())
+
+        with self._lock:
+            for pump in list(self._refilling):
+                if self._refill_done(pump, states.get(pump)):
+                    del self._refilling[pump]
+
+            self._observe_handover(states)
+
+            active = self.active_pump
+            state = states.get(active)
+            if state is not None and state.timestamp > self._active_since:
+                self._update_continuity(state.timestamp, state.is_pumping)
+                remaining = active._estimate_duration(state.fill_level,
+                                                      self.flow_rate)
+                if not state.is_pumping or remaining <= self.handover_lead:
+                    if not self._hand_over(levels) and not state.is_pumping:
+                        # Ran empty without a replacement; refill it, and
+                        # resume once any pump is ready.
+                        self.active_pump = None
+            elif active is None and self.flow_rate is not None:
+                self._update_continuity(clock(), False)
+                self._hand_over(levels)
+
+            for pump in self.pumps:
+                state = states.get(pump)
+                if (state is None or state.is_pumping or
+                        pump in self._refilling or
+                        pump is self.active_pump):
+                    continue
+                if self._is_low(pump, state.fill_level):
+                    self._refill(pump, state.fill_level)
+
+    def _run(self):
+        n_errors = 0
+        while not self._stop_event.is_set():
+            self.monitor.wait_for_update(timeout=0.1)
+            try:
+                self._step()
+            except Exception as e:
+                self.last_error = e
+                n_errors += 1
+                if n_errors >= self.max_errors:
+                    self.error = e
+                    break
+            else:
+                n_errors = 0
+
+        if self.error is not None:
+            try:
+                self.stop_delivery()
+            except Exception:
+                # The pumps may be unreachable; the error is already
+                # recorded.
+                pass
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Retrying Qmix SDK calls that failed with transient errors.
+
+When an SDK function fails, the device classes can consult a
+:class:`RetryPolicy` to decide whether to repeat the call, instead of
+raising the error right away. Errors indicating that a command was
+rejected without being executed (``ERR_AGAIN``, ``ERR_BUSY``, and a full
+CAN transmit queue) are retried for every function. Errors after which it
+is unknown whether the command was executed (e.g. ``ERR_INPROGRESS`` or
+timeouts on the CAN bus) are only retried for idempotent functions, i.e.
+queries and commands with absolute targets: repeating ``LCP_SetFillLevel``
+is harmless, repeating ``LCP_Dispense`` is not.
+
+Failed calls are not retried unless a policy is set. Use
+:func:`set_default_policy` to set a policy for all devices, and the
+``retry_policy`` attribute of a device to override it for that device;
+``None`` means that the device never retries, and :data:`INHERIT` (the
+default) that it uses the default policy::
+
+    from pyqmix import retry
+
+    retry.set_default_policy(retry.RetryPolicy(max_attempts=5))
+    pump.retry_policy = None  # Never retry calls of this pump.
+
+Retrying only affects failed calls; successful calls take the same code
+path as without a policy.
+"""
+
+import re
+import time
+import threading
+
+from .error import (QmixError, QmixBusyError, QmixTimeoutError,
+                    QmixCommunicationError)
+
+# Functions that only query state.
+_QUERY = re.compile(r'^LC[A-Z]*_(Get|Is|Has|Lookup|NumberOf|Actual)')
+
+#: Commands that have the same effect no matter how often they are issued.
+IDEMPOTENT_COMMANDS = frozenset([
+    'LCP_Enable', 'LCP_Disable', 'LCP_ClearFault', 'LCP_SetVolumeUnit',
+    'LCP_SetFlowUnit', 'LCP_SetSyringeParam', 'LCP_SetFillLevel',
+    'LCP_StopPumping', 'LCP_StopAllPumps', 'LCV_SwitchValveToPosition',
+    'LCDIO_WriteOn'])
+
+#: The errors after which no function was executed.
+NOT_EXECUTED_ERRORS = ('ERR_AGAIN', 'ERR_BUSY', 'ERR_CANO_DLL_TXFULL')
+
+
+class _Inherit(object):
+    def __repr__(self):
+        return 'INHERIT'
+
+
+#: Value of a device's ``retry_policy`` attribute that selects the default
+#: policy.
+INHERIT = _Inherit()
+
+
+def is_idempotent(func_name):
+    """
+    Whether an SDK function can safely be called again if it is unknown
+    whether the previous call was executed.
+
+    Parameters
+    ----------
+    func_name : str
+        The name of the SDK function.
+
+    Returns
+    -------
+    bool
+        ``True`` for queries and for the commands listed in
+        :data:`IDEMPOTENT_COMMANDS`.
+
+    """
+    return (func_name in IDEMPOTENT_COMMANDS or
+            _QUERY.match(func_name) is not None)
+
+
+class RetryPolicy(object):
+    """
+    Decide which failed SDK calls to retry, and how often.
+
+    Parameters
+    ----------
+    max_attempts : int
+        The maximum number of attempts per call, including the first one.
+
+    delay : float
+        The delay before the second retry in seconds; the first retry is
+        attempted immediately.
+
+    backoff : float
+        The factor by which the delay grows with every further retry.
+
+    max_delay : float
+        The upper limit of the delay in seconds.
+
+    retryable : sequence of QmixError subclasses, int, or str
+        The errors, given as exception classes, error codes, or ``ERR_*``
+        symbols, that are retried for every function. These must indicate
+        that the command was not executed.
+
+    retryable_idempotent : sequence of QmixError subclasses, int, or str
+        The errors that are only retried for idempotent functions (see
+        :func:`is_idempotent`).
+
+    Attributes
+    ----------
+    n_retries : int
+        The number of retries so far.
+
+    n_recovered : int
+        The number of calls that succeeded after at least one retry.
+
+    n_exhausted : int
+        The number of calls that still failed after `max_attempts`.
+
+    """
+    def __init__(self, max_attempts=3, delay=0.001, backoff=2.,
+                 max_delay=0.05, retryable=NOT_EXECUTED_ERRORS,
+                 retryable_idempotent=(QmixBusyError, QmixTimeoutError,
+                                       QmixCommunicationError)):
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1.')
+        if delay < 0 or max_delay < 0:
+            raise ValueError('Delays must not be negative.')
+        if backoff < 1:
+            raise ValueError('backoff must be at least 1.')
+
+        self.max_attempts = max_attempts
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.retryable = tuple(retryable)
+        self.retryable_idempotent = tuple(retryable_idempotent)
+
+        self._lock = threading.Lock()
+        self.n_retries = 0
+        self.n_recovered = 0
+        self.n_exhausted = 0
+
+    def __repr__(self):
+        return ('<RetryPolicy max_attempts=%d: %d retries, %d recovered, '
+                '%d exhausted>' % (self.max_attempts, self.n_retries,
+                                   self.n_recovered, self.n_exhausted))
+
+    @staticmethod
+    def _matches(error, errors):
+        for e in errors:
+            if isinstance(e, type):
+                if isinstance(error, e):
+                    return True
+            elif isinstance(e, str):
+                if error.symbol == e:
+                    return True
+            elif error.code == abs(e):
+                return True
+        return False
+
+    def is_retryable(self, func_name, error):
+        """
+        Whether a failed call may be retried.
+
+        Parameters
+        ----------
+        func_name : str
+            The name of the SDK function.
+
+        error : QmixError
+            The error raised by the call.
+
+        Returns
+        -------
+        bool
+            Whether the call may be retried.
+
+        """
+        if self._matches(error, self.retryable):
+            return True
+        return (self._matches(error, self.retryable_idempotent) and
+                is_idempotent(func_name))
+
+    def get_delay(self, retry):
+        """
+        Return the delay before a retry.
+
+        Parameters
+        ----------
+        retry : int
+            The number of the retry, starting at 1.
+
+        Returns
+        -------
+        float
+            The delay in seconds.
+
+        """
+        if retry <= 1:
+            return 0.
+        return min(self.delay * self.backoff ** (retry - 2), self.max_delay)
+
+    def call(self, func, func_name, args, error):
+        """
+        Retry a failed call.
+
+        Parameters
+        ----------
+        func : callable
+            Calls the SDK function, and raises
+            :class:`pyqmix.error.QmixError` on failure.
+
+        func_name : str
+            The name of the SDK function.
+
+        args : tuple
+            The arguments of the call.
+
+        error : QmixError
+            The error raised by the first attempt.
+
+        Returns
+        -------
+        int
+            The return value of the first successful attempt.
+
+        Raises
+        ------
+        QmixError
+            The error of the last attempt, if the error is not retryable
+            or all attempts failed.
+
+        """
+        retry = 0
+        while True:
+            if not self.is_retryable(func_name, error):
+                raise error
+            if retry + 1 >= self.max_attempts:
+                with self._lock:
+                    self.n_exhausted += 1
+                raise error
+
+            retry += 1
+            with self._lock:
+                self.n_retries += 1
+
+            delay = self.get_delay(retry)
+            if delay > 0:
+                time.sleep(delay)
+
+            try:
+                result = func(*args)
+            except QmixError as e:
+                error = e
+                continue
+
+            with self._lock:
+                self.n_recovered += 1
+            return result
+
+    def reset_stats(self):
+        """
+        Reset the retry counters.
+
+        """
+        with self._lock:
+            self.n_retries = 0
+            self.n_recovered = 0
+            self.n_exhausted = 0
+
+
+_default_policy = None
+
+
+def get_default_policy():
+    """
+    Return the retry policy used by devices without a policy of their own.
+
+    Returns
+    -------
+    RetryPolicy or None
+        The policy, or ``None`` if failed calls are never retried.
+
+    """
+    return _default_policy
+
+
+def set_default_policy(policy):
+    """
+    Set the retry policy used by devices without a policy of their own.
+
+    Parameters
+    ----------
+    policy : RetryPolicy or None
+        The policy. Pass ``None`` to never retry failed calls, which is the
+        default.
+
+    """
+    global _default_policy
+    _default_policy = policy
+
+
+def retry_call(device, func_name, args, error):
+    """
+    Apply the retry policy of a device to a failed SDK call.
+
+    This is invoked by the ``_call`` method of the device classes when a
+    call fails. The device's ``retry_policy`` is used, or the default policy
+    if it is :data:`INHERIT`.
+
+    Parameters
+    ----------
+    device : object
+        The device object, e.g. a :class:`pyqmix.QmixPump`.
+
+    func_name : str
+        The name of the SDK function.
+
+    args : tuple
+        The arguments of the call.
+
+    error : QmixError
+        The error raised by the call.
+
+    Returns
+    -------
+    int
+        The return value of a successful retry.
+
+    Raises
+    ------
+    QmixError
+        If the call was not retried, or all retries failed.
+
+    """
+    policy = device.retry_policy
+    if policy is INHERIT:
+        policy = _default_policy
+    if policy is None:
+        raise error
+
+    def func(*args):
+        return device._library.call(func_name, *args)
+
+    return policy.call(func, func_name, args, error)
@@ -0,0 +1,1191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Simulated Qmix SDK.
+
+A pure-Python implementation of all functions declared in
+:mod:`pyqmix.headers`, which allows running pyqmix without the Qmix SDK
+DLLs and without any hardware attached, e.g. for testing and benchmarking.
+
+The simulation models the plunger motion of syringe pumps (including
+acceleration ramps), fill levels and drive position counters, valve
+switching latency, digital I/O channels, and the start-up of the labbCAN
+bus. All devices run on a :class:`VirtualClock`, which can run faster than
+real time or be advanced manually. Faults and errors can be injected via
+:func:`SimulatedSystem.inject_fault` and :func:`SimulatedSystem.fail_next`.
+
+To use the simulation, select the ``sim`` backend before creating any
+device object::
+
+    from pyqmix import config, QmixBus, QmixPump
+    config.set_backend('sim')
+
+    bus = QmixBus()
+    pump = QmixPump(index=0)
+
+Alternatively, set the environment variable ``PYQMIX_BACKEND=sim``, which
+takes precedence over the configuration file.
+
+"""
+
+import math
+import threading
+
+from .tools import clock
+from .headers import (BUS_HEADER, PUMP_HEADER, VALVE_HEADER,
+                      DIGITAL_IO_HEADER, ERROR_HEADER, parse_defines,
+                      parse_functions)
+
+_ERROR_DEFINES = parse_defines(ERROR_HEADER)
+_PUMP_DEFINES = parse_defines(PUMP_HEADER)
+
+ERR_NODEV = _ERROR_DEFINES['ERR_NODEV'][0]
+ERR_NOENT = _ERROR_DEFINES['ERR_NOENT'][0]
+ERR_INVAL = _ERROR_DEFINES['ERR_INVAL'][0]
+ERR_NOSPC = _ERROR_DEFINES['ERR_NOSPC'][0]
+ERR_UNKNOWN = _ERROR_DEFINES['ERR_UNKNOWN'][0]
+ERR_PARAM_RANGE = _ERROR_DEFINES['ERR_PARAM_RANGE'][0]
+ERR_DEVSTATE = _ERROR_DEFINES['ERR_DEVSTATE'][0]
+ERR_C_ERRNO = _ERROR_DEFINES['ERR_C_ERRNO'][0]
+ERR_NOT_INITIALIZED = _ERROR_DEFINES['ERR_CANO_DLL_NOT_INITIALIZED'][0]
+ERR_NO_DEVICES = _ERROR_DEFINES['ERR_CANO_CAL_NO_DEVICES'][0]
+ERR_FAULT_STATE = _ERROR_DEFINES['ERR_DS402_DRV_ENABLE_FAULT_STATE'][0]
+ERR_DRIVE = _ERROR_DEFINES['ERR_DS402'][0]
+
+LITRES = _PUMP_DEFINES['LITRES'][0]
+MILLI = _PUMP_DEFINES['MILLI'][0]
+PER_SECOND = _PUMP_DEFINES['PER_SECOND'][0]
+_PREFIXES = tuple(_PUMP_DEFINES[p][0]
+                  for p in ('UNIT', 'DECI', 'CENTI', 'MILLI', 'MICRO'))
+_TIME_UNITS = tuple(_PUMP_DEFINES[t][0]
+                    for t in ('PER_SECOND', 'PER_MINUTE', 'PER_HOUR'))
+
+# Handles are opaque to the caller; give every device class its own range.
+_PUMP_HANDLE = 0x1000
+_VALVE_HANDLE = 0x2000
+_OUTPUT_HANDLE = 0x3000
+_INPUT_HANDLE = 0x3100
+_IO_DEVICE_HANDLE = 0x3200
+
+# Bus states.
+_CLOSED, _OPEN, _STARTED = 0, 1, 2
+
+
+class VirtualClock(object):
+    """
+    The time base of the simulation.
+
+    Parameters
+    ----------
+    speed : float
+        How many simulated seconds pass per second of real time. With
+        ``speed=0``, time only passes via
+        :func:`~pyqmix.sim.VirtualClock.advance`.
+
+    """
+    def __init__(self, speed=1.):
+        self._lock = threading.Lock()
+        self._anchor_real = clock()
+        self._anchor_virtual = 0.
+        self._speed = speed
+
+    @property
+    def speed(self):
+        """
+        The speed of the simulation relative to real time.
+
+        """
+        return self._speed
+
+    @speed.setter
+    def speed(self, speed):
+        if speed < 0:
+            raise ValueError('Speed must not be negative.')
+
+        with self._lock:
+            now = clock()
+            self._anchor_virtual += (now - self._anchor_real) * self._speed
+            self._anchor_real = now
+            self._speed = speed
+
+    def now(self):
+        """
+        The current simulated time in seconds.
+
+        """
+        with self._lock:
+            return (self._anchor_virtual +
+                    (clock() - self._anchor_real) * self._speed)
+
+    def advance(self, seconds):
+        """
+        Let simulated time pass instantly.
+
+        Parameters
+        ----------
+        seconds : float
+            The amount of simulated time to skip.
+
+        """
+        if seconds < 0:
+            raise ValueError('Time cannot go backwards.')
+
+        with self._lock:
+            self._anchor_virtual += seconds
+
+
+class _Motion(object):
+    """
+    A trapezoidal move of the plunger: accelerate, cruise, decelerate.
+
+    Positions are in mm of plunger travel, speeds in mm/s.
+
+    """
+    def __init__(self, start_time, start, target, speed, acceleration):
+        self.start_time = start_time
+        self.start = start
+        self.target = target
+        self.direction = 1 if target >= start else -1
+        self.distance = abs(target - start)
+        self.acceleration = acceleration
+
+        ramp_time = speed / acceleration
+        ramp_distance = 0.5 * acceleration * ramp_time ** 2
+
+        if 2 * ramp_distance > self.distance:
+            # The target speed is never reached.
+            ramp_time = math.sqrt(self.distance / acceleration)
+            ramp_distance = self.distance / 2.
+            speed = acceleration * ramp_time
+
+        self.speed = speed
+        self.ramp_time = ramp_time
+        self.ramp_distance = ramp_distance
+        if speed > 0:
+            self.cruise_time = (self.distance - 2 * ramp_distance) / speed
+        else:
+            self.cruise_time = 0.
+        self.duration = 2 * ramp_time + self.cruise_time
+
+    def state(self, now):
+        """
+        Return the plunger position and velocity at a given time.
+
+        """
+        t = now - self.start_time
+        a = self.acceleration
+
+        if t >= self.duration:
+            return self.target, 0.
+        elif t < self.ramp_time:
+            travelled, velocity = 0.5 * a * t ** 2, a * t
+        elif t < self.ramp_time + self.cruise_time:
+            travelled = self.ramp_distance + self.speed * (t - self.ramp_time)
+            velocity = self.speed
+        else:
+            t_left = self.duration - t
+            travelled = self.distance - 0.5 * a * t_left ** 2
+            velocity = a * t_left
+
+        return (self.start + self.direction * travelled,
+                self.direction * velocity)
+
+
+class SimulatedValve(object):
+    """
+    A simulated valve.
+
+    Parameters
+    ----------
+    system : SimulatedSystem
+        The system the valve belongs to.
+
+    name : str
+        The name of the valve.
+
+    n_positions : int
+        The number of logical valve positions.
+
+    latency : float
+        The time in seconds needed to switch the valve.
+
+    """
+    def __init__(self, system, name, n_positions=2, latency=0.05):
+        self.system = system
+        self.name = name
+        self.n_positions = n_positions
+        self.latency = latency
+
+        self._position = 0
+        self._target = 0
+        self._switched_at = None
+
+    @property
+    def position(self):
+        """
+        The current logical valve position. While switching, this is the
+        previous position.
+
+        """
+        if (self._switched_at is not None and
+                self.system.clock.now() >= self._switched_at):
+            self._position = self._target
+            self._switched_at = None
+        return self._position
+
+    def switch(self, position):
+        self._target = position
+        self._switched_at = self.system.clock.now() + self.latency
+
+
+class SimulatedPump(object):
+    """
+    A simulated syringe pump.
+
+    The fill level is derived from the drive position counter, just like on
+    a real device: if the counter is lost (see
+    :func:`SimulatedSystem.power_cycle`), the reported fill level is wrong
+    until the counter is restored or the pump is calibrated.
+
+    Parameters
+    ----------
+    system : SimulatedSystem
+        The system the pump belongs to.
+
+    name : str
+        The name of the pump.
+
+    valve : SimulatedValve
+        The valve attached to the pump.
+
+    inner_diameter_mm, max_piston_stroke_mm : float
+        The dimensions of the inserted syringe.
+
+    max_speed : float
+        The maximum plunger speed in mm/s.
+
+    acceleration : float
+        The plunger acceleration in mm/s².
+
+    counts_per_mm : int
+        The resolution of the drive position counter.
+
+    """
+    def __init__(self, system, name, valve, inner_diameter_mm=32.5713,
+                 max_piston_stroke_mm=60, max_speed=5., acceleration=50.,
+                 counts_per_mm=1000):
+        self.system = system
+        self.name = name
+        self.valve = valve
+        self.inner_diameter_mm = inner_diameter_mm
+        self.max_piston_stroke_mm = max_piston_stroke_mm
+        self.max_speed = max_speed
+        self.acceleration = acceleration
+        self.counts_per_mm = counts_per_mm
+
+        self.enabled = False
+        self.fault = None
+        self.volume_unit = (MILLI, LITRES)
+        self.flow_unit = (MILLI, LITRES, PER_SECOND)
+
+        self._position = 0.  # Physical plunger position in mm.
+        self._velocity = 0.
+        self._counter_offset = 0.  # Physical position at counter zero.
+        self._dose_start = 0.
+        self._motion = None
+        self._calibrating = False
+        self._calibrated = False
+
+    @property
+    def area(self):
+        # Cross-section of the syringe in mm². 1 mm of plunger travel
+        # displaces `area` µL.
+        return math.pi * (self.inner_diameter_mm / 2.) ** 2
+
+    def update(self):
+        """
+        Advance the plunger to the current simulated time.
+
+        """
+        motion = self._motion
+        if motion is None:
+            return
+
+        now = self.system.clock.now()
+        self._position, self._velocity = motion.state(now)
+
+        if now >= motion.start_time + motion.duration:
+            self._motion = None
+            if self._calibrating:
+                self._calibrating = False
+                self._calibrated = True
+                self._counter_offset = 0.
+            elif not 0 <= self._position <= self.max_piston_stroke_mm:
+                self._position = min(max(self._position, 0),
+                                     self.max_piston_stroke_mm)
+                self.fault = ERR_DRIVE
+
+    @property
+    def is_pumping(self):
+        self.update()
+        return self._motion is not None
+
+    @property
+    def motion_end_time(self):
+        """
+        The simulated time at which the current move will be finished, or
+        ``None`` if the plunger is not moving.
+
+        """
+        self.update()
+        motion = self._motion
+        if motion is None:
+            return None
+        return motion.start_time + motion.duration
+
+    @property
+    def fill_level_mm(self):
+        self.update()
+        return self._position - self._counter_offset
+
+    @property
+    def drive_pos_counter(self):
+        return int(round(self.fill_level_mm * self.counts_per_mm))
+
+    @drive_pos_counter.setter
+    def drive_pos_counter(self, value):
+        self.update()
+        self._counter_offset = (self._position -
+                                value / float(self.counts_per_mm))
+
+    def volume_to_mm(self, volume):
+        prefix, _ = self.volume_unit
+        return volume * 10. ** prefix * 1e6 / self.area
+
+    def mm_to_volume(self, mm):
+        prefix, _ = self.volume_unit
+        return mm * self.area * 1e-6 / 10. ** prefix
+
+    def flow_to_mm(self, flow):
+        prefix, _, time_unit = self.flow_unit
+        return flow * 10. ** prefix * 1e6 / time_unit / self.area
+
+    def mm_to_flow(self, speed):
+        prefix, _, time_unit = self.flow_unit
+        return speed * self.area * 1e-6 * time_unit / 10. ** prefix
+
+    def move(self, fill_level_mm, speed):
+        """
+        Start moving the plunger to a fill level, given in mm of plunger
+        travel. Returns an error code or 0.
+
+        """
+        if self.fault is not None or not self.enabled:
+            return ERR_DEVSTATE
+        if speed <= 0 or speed > self.max_speed * (1 + 1e-9):
+            return ERR_PARAM_RANGE
+
+        stroke = self.max_piston_stroke_mm
+        if not -1e-9 <= fill_level_mm <= stroke * (1 + 1e-9):
+            return ERR_PARAM_RANGE
+
+        self.update()
+        self._dose_start = self._position
+        # With a wrong drive position counter, the plunger may hit an end
+        # stop before reaching the target; see `update()`.
+        target = fill_level_mm + self._counter_offset
+        self._motion = _Motion(self.system.clock.now(), self._position,
+                               target, speed, self.acceleration)
+        return 0
+
+    def calibrate(self):
+        if self.fault is not None or not self.enabled:
+            return ERR_DEVSTATE
+
+        self.update()
+        self._calibrating = True
+        self._motion = _Motion(self.system.clock.now(), self._position, 0.,
+                               self.max_speed, self.acceleration)
+        return 0
+
+    def stop(self):
+        self.update()
+        self._motion = None
+        self._velocity = 0.
+        self._calibrating = False
+
+
+class SimulatedChannel(object):
+    """
+    A simulated digital I/O channel.
+
+    """
+    def __init__(self, name, is_output):
+        self.name = name
+        self.is_output = is_output
+        self.is_on = False
+
+
+class SimulatedSystem(object):
+    """
+    A simulated labbCAN bus with pumps, valves, and digital I/O channels.
+
+    Parameters
+    ----------
+    n_pumps : int
+        The number of syringe pumps. Every pump has a two-way valve.
+
+    n_dio_channels : int
+        The number of digital output and of digital input channels.
+
+    speed : float
+        The speed of the simulated time relative to real time, see
+        :class:`VirtualClock`.
+
+    bus_open_delay, bus_start_delay : float
+        The time in seconds after opening and starting the bus until the
+        devices become accessible.
+
+    valve_latency : float
+        The time in seconds needed to switch a valve.
+
+    pump_options : dict or None
+        Keyword arguments passed to :class:`SimulatedPump`.
+
+    """
+    def __init__(self, n_pumps=4, n_dio_channels=4, speed=1.,
+                 bus_open_delay=0.1, bus_start_delay=0.1,
+                 valve_latency=0.05, pump_options=None):
+        if pump_options is None:
+            pump_options = dict()
+
+        self.clock = VirtualClock(speed=speed)
+        self.lock = threading.RLock()
+        self.bus_open_delay = bus_open_delay
+        self.bus_start_delay = bus_start_delay
+
+        self.valves = [
+            SimulatedValve(self, 'neMESYS_Low_Pressure_%i_Valve' % (i + 1),
+                           latency=valve_latency)
+            for i in range(n_pumps)]
+        self.pumps = [SimulatedPump(self,
+                                    'neMESYS_Low_Pressure_%i_Pump' % (i + 1),
+                                    self.valves[i], **pump_options)
+                      for i in range(n_pumps)]
+        self.outputs = [SimulatedChannel('QmixIO_1_DO%i' % i, is_output=True)
+                        for i in range(n_dio_channels)]
+        self.inputs = [SimulatedChannel('QmixIO_1_DI%i' % i, is_output=False)
+                       for i in range(n_dio_channels)]
+        self.io_devices = ['QmixIO_1']
+
+        self._bus_state = _CLOSED
+        self._bus_ready_at = None
+        self._failures = dict()
+
+    @property
+    def bus_state(self):
+        """
+        ``closed``, ``open``, or ``started``.
+
+        """
+        return ('closed', 'open', 'started')[self._bus_state]
+
+    def inject_fault(self, pump, error=ERR_DRIVE):
+        """
+        Put a pump into fault state, stopping it immediately.
+
+        Parameters
+        ----------
+        pump : int
+            The index of the pump.
+
+        error : int
+            The error code to report.
+
+        """
+        with self.lock:
+            self.pumps[pump].stop()
+            self.pumps[pump].fault = error
+
+    def fail_next(self, function, error=ERR_UNKNOWN, count=1):
+        """
+        Make the next calls of an SDK function fail.
+
+        Parameters
+        ----------
+        function : str
+            The name of the function, e.g. ``LCP_Dispense``.
+
+        error : int
+            The (positive) error code to return.
+
+        count : int
+            The number of calls that should fail.
+
+        """
+        with self.lock:
+            self._failures.setdefault(function, []).extend([error] * count)
+
+    def set_input(self, index, on):
+        """
+        Set the state of a digital input channel.
+
+        Parameters
+        ----------
+        index : int
+            The index of the input channel.
+
+        on : bool
+            The new state.
+
+        """
+        with self.lock:
+            self.inputs[index].is_on = bool(on)
+
+    def power_cycle(self):
+        """
+        Simulate switching the pumps off and on again. All pumps stop, are
+        disabled, and their drive position counters are reset to zero.
+
+        """
+        with self.lock:
+            for pump in self.pumps:
+                pump.stop()
+                pump.enabled = False
+                pump.drive_pos_counter = 0
+
+    def _check(self, function, requires):
+        # Return the error code that a call would fail with, or 0.
+        failures = self._failures.get(function)
+        if failures:
+            return failures.pop(0)
+
+        if requires is None:
+            return 0
+        if self._bus_state < requires:
+            return ERR_NOT_INITIALIZED
+        if self.clock.now() < self._bus_ready_at:
+            return ERR_NO_DEVICES if requires == _OPEN else ERR_DEVSTATE
+        return 0
+
+    def _open_bus(self):
+        self._bus_state = _OPEN
+        self._bus_ready_at = self.clock.now() + self.bus_open_delay
+
+    def _start_bus(self):
+        self._bus_state = _STARTED
+        self._bus_ready_at = self.clock.now() + self.bus_start_delay
+
+    def _stop_bus(self):
+        for pump in self.pumps:
+            pump.stop()
+        self._bus_state = min(self._bus_state, _OPEN)
+
+    def _close_bus(self):
+        self._stop_bus()
+        self._bus_state = _CLOSED
+
+
+def _api(requires=_STARTED):
+    # Run an SDK function under the system lock, after checking the bus
+    # state and injected failures. Errors are returned as negative codes.
+    def decorator(func):
+        name = func.__name__
+
+        def wrapper(self, *args):
+            system = self._system()
+            with system.lock:
+                error = system._check(name, requires)
+                if error:
+                    return -error
+                return func(self, system, *args)
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+
+class _SimulatedLibrary(object):
+    # Base class of the simulated SDK libraries; exposes the integer
+    # constants of the C declarations as attributes, like a `cffi` library.
+    header = None
+
+    def __init__(self, ffi):
+        self._ffi = ffi
+        for name, (value, _) in parse_defines(self.header).items():
+            setattr(self, name, value)
+
+        missing = [f for f in parse_functions(self.header)
+                   if not hasattr(self, f)]
+        if missing:
+            msg = 'Not simulated: %s' % ', '.join(missing)
+            raise NotImplementedError(msg)
+
+    @staticmethod
+    def _system():
+        return get_system()
+
+    def _string(self, value):
+        if isinstance(value, bytes):
+            return value.decode('utf8')
+        if isinstance(value, str):
+            return value
+        return self._ffi.string(value).decode('utf8')
+
+
+class _BusLibrary(_SimulatedLibrary):
+    header = BUS_HEADER
+
+    @_api(requires=None)
+    def LCB_Open(self, system, device_config_path, plugin_search_path):
+        system._open_bus()
+        return 0
+
+    @_api(requires=_OPEN)
+    def LCB_Start(self, system):
+        system._start_bus()
+        return 0
+
+    @_api(requires=None)
+    def LCB_Stop(self, system):
+        system._stop_bus()
+        return 0
+
+    @_api(requires=None)
+    def LCB_Close(self, system):
+        system._close_bus()
+        return 0
+
+
+class _PumpLibrary(_SimulatedLibrary):
+    header = PUMP_HEADER
+
+    @staticmethod
+    def _pump(system, handle):
+        index = handle - _PUMP_HANDLE
+        if 0 <= index < len(system.pumps):
+            return system.pumps[index]
+        return None
+
+    @_api(requires=_OPEN)
+    def LCP_GetNoOfPumps(self, system):
+        return len(system.pumps)
+
+    @_api(requires=_OPEN)
+    def LCP_GetPumpHandle(self, system, index, p_handle):
+        if not 0 <= index < len(system.pumps):
+            return -ERR_NODEV
+        p_handle[0] = _PUMP_HANDLE + index
+        return 0
+
+    @_api(requires=_OPEN)
+    def LCP_LookupPumpByName(self, system, name, p_handle):
+        name = self._string(name)
+        for index, pump in enumerate(system.pumps):
+            if pump.name == name:
+                p_handle[0] = _PUMP_HANDLE + index
+                return 0
+        return -ERR_NOENT
+
+    @_api()
+    def LCP_IsEnabled(self, system, handle):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        return int(pump.enabled)
+
+    @_api()
+    def LCP_Enable(self, system, handle):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        if pump.fault is not None:
+            return -ERR_FAULT_STATE
+        pump.enabled = True
+        return 0
+
+    @_api()
+    def LCP_Disable(self, system, handle):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        pump.stop()
+        pump.enabled = False
+        return 0
+
+    @_api()
+    def LCP_SyringePumpCalibrate(self, system, handle):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        return -pump.calibrate()
+
+    @_api()
+    def LCP_IsCalibrationFinished(self, system, handle):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        pump.update()
+        return int(not pump._calibrating)
+
+    @_api()
+    def LCP_IsInFaultState(self, system, handle):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        pump.update()
+        return int(pump.fault is not None)
+
+    @_api()
+    def LCP_ClearFault(self, system, handle):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        pump.fault = None
+        return 0
+
+    @_api()
+    def LCP_SetVolumeUnit(self, system, handle, prefix, volume_unit):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        if prefix not in _PREFIXES or volume_unit != LITRES:
+            return -ERR_INVAL
+        pump.volume_unit = (prefix, volume_unit)
+        return 0
+
+    @_api()
+    def LCP_SetFlowUnit(self, system, handle, prefix, volume_unit,
+                        time_unit):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        if (prefix not in _PREFIXES or volume_unit != LITRES or
+                time_unit not in _TIME_UNITS):
+            return -ERR_INVAL
+        pump.flow_unit = (prefix, volume_unit, time_unit)
+        return 0
+
+    @_api()
+    def LCP_GetSyringeParam(self, system, handle, p_inner_diameter_mm,
+                            p_max_piston_stroke_mm):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        p_inner_diameter_mm[0] = pump.inner_diameter_mm
+        p_max_piston_stroke_mm[0] = pump.max_piston_stroke_mm
+        return 0
+
+    @_api()
+    def LCP_SetSyringeParam(self, system, handle, inner_diameter_mm,
+                            max_piston_stroke_mm):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        if inner_diameter_mm <= 0 or max_piston_stroke_mm <= 0:
+            return -ERR_PARAM_RANGE
+        pump.inner_diameter_mm = inner_diameter_mm
+        pump.max_piston_stroke_mm = max_piston_stroke_mm
+        return 0
+
+    def _pump_volume(self, system, handle, volume, flow):
+        # Positive volumes dispense, negative volumes aspirate.
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        target = pump.fill_level_mm - pump.volume_to_mm(volume)
+        return -pump.move(target, pump.flow_to_mm(flow))
+
+    @_api()
+    def LCP_Aspirate(self, system, handle, volume, flow):
+        return self._pump_volume(system, handle, -volume, flow)
+
+    @_api()
+    def LCP_Dispense(self, system, handle, volume, flow):
+        return self._pump_volume(system, handle, volume, flow)
+
+    @_api()
+    def LCP_PumpVolume(self, system, handle, volume, flow):
+        return self._pump_volume(system, handle, volume, flow)
+
+    @_api()
+    def LCP_SetFillLevel(self, system, handle, level, flow):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        return -pump.move(pump.volume_to_mm(level), pump.flow_to_mm(flow))
+
+    @_api()
+    def LCP_GenerateFlow(self, system, handle, flow_rate):
+        # Positive flow rates dispense until the syringe is empty, negative
+        # flow rates aspirate until it is full.
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        target = 0. if flow_rate > 0 else pump.max_piston_stroke_mm
+        return -pump.move(target, pump.flow_to_mm(abs(flow_rate)))
+
+    @_api()
+    def LCP_GetDosedVolume(self, system, handle, p_dosed_volume):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        pump.update()
+        p_dosed_volume[0] = pump.mm_to_volume(pump._dose_start -
+                                              pump._position)
+        return 0
+
+    @_api()
+    def LCP_GetFillLevel(self, system, handle, p_fill_level):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        p_fill_level[0] = pump.mm_to_volume(pump.fill_level_mm)
+        return 0
+
+    @_api()
+    def LCP_GetFlowIs(self, system, handle, p_flow_rate):
+        # Positive while dispensing, negative while aspirating.
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        pump.update()
+        p_flow_rate[0] = pump.mm_to_flow(-pump._velocity)
+        return 0
+
+    @_api()
+    def LCP_IsPumping(self, system, handle):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        return int(pump.is_pumping)
+
+    @_api()
+    def LCP_GetFlowRateMax(self, system, handle, p_flow_rate_max):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        p_flow_rate_max[0] = pump.mm_to_flow(pump.max_speed)
+        return 0
+
+    @_api()
+    def LCP_GetFlowUnit(self, system, handle, p_prefix, p_volume_unit,
+                        p_time_unit):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        p_prefix[0], p_volume_unit[0], p_time_unit[0] = pump.flow_unit
+        return 0
+
+    @_api()
+    def LCP_GetVolumeUnit(self, system, handle, p_prefix, p_volume_unit):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        p_prefix[0], p_volume_unit[0] = pump.volume_unit
+        return 0
+
+    @_api()
+    def LCP_GetVolumeMax(self, system, handle, p_volume_max):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        p_volume_max[0] = pump.mm_to_volume(pump.max_piston_stroke_mm)
+        return 0
+
+    @_api()
+    def LCP_StopPumping(self, system, handle):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        pump.stop()
+        return 0
+
+    @_api()
+    def LCP_StopAllPumps(self, system):
+        for pump in system.pumps:
+            pump.stop()
+        return 0
+
+    @_api(requires=_OPEN)
+    def LCP_GetValveHandle(self, system, handle, p_valve_handle):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        p_valve_handle[0] = _VALVE_HANDLE + system.valves.index(pump.valve)
+        return 0
+
+    @_api()
+    def LCP_HasValve(self, system, handle):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        return int(pump.valve is not None)
+
+    @_api()
+    def LCP_GetDrivePosCnt(self, system, handle, p_pos_cnt_value):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        p_pos_cnt_value[0] = pump.drive_pos_counter
+        return 0
+
+    @_api()
+    def LCP_RestoreDrivePosCnt(self, system, handle, pos_cnt_value):
+        pump = self._pump(system, handle)
+        if pump is None:
+            return -ERR_NODEV
+        pump.update()
+        if pump._motion is not None:
+            return -ERR_DEVSTATE
+        pump.drive_pos_counter = pos_cnt_value
+        return 0
+
+
+class _ValveLibrary(_SimulatedLibrary):
+    header = VALVE_HEADER
+
+    @staticmethod
+    def _valve(system, handle):
+        index = handle - _VALVE_HANDLE
+        if 0 <= index < len(system.valves):
+            return system.valves[index]
+        return None
+
+    @_api(requires=_OPEN)
+    def LCV_GetNoOfValves(self, system):
+        return len(system.valves)
+
+    @_api(requires=_OPEN)
+    def LCV_LookupValveByName(self, system, name, p_handle):
+        name = self._string(name)
+        for index, valve in enumerate(system.valves):
+            if valve.name == name:
+                p_handle[0] = _VALVE_HANDLE + index
+                return 0
+        return -ERR_NOENT
+
+    @_api(requires=_OPEN)
+    def LCV_GetValveHandle(self, system, index, p_handle):
+        if not 0 <= index < len(system.valves):
+            return -ERR_NODEV
+        p_handle[0] = _VALVE_HANDLE + index
+        return 0
+
+    @_api()
+    def LCV_NumberOfValvePositions(self, system, handle):
+        valve = self._valve(system, handle)
+        if valve is None:
+            return -ERR_NODEV
+        return valve.n_positions
+
+    @_api()
+    def LCV_ActualValvePosition(self, system, handle):
+        valve = self._valve(system, handle)
+        if valve is None:
+            return -ERR_NODEV
+        return valve.position
+
+    @_api()
+    def LCV_SwitchValveToPosition(self, system, handle, position):
+        valve = self._valve(system, handle)
+        if valve is None:
+            return -ERR_NODEV
+        if not 0 <= position < valve.n_positions:
+            return -ERR_PARAM_RANGE
+        valve.switch(position)
+        return 0
+
+
+class _DigitalIOLibrary(_SimulatedLibrary):
+    header = DIGITAL_IO_HEADER
+
+    @staticmethod
+    def _channel(system, handle):
+        for base, channels in ((_OUTPUT_HANDLE, system.outputs),
+                               (_INPUT_HANDLE, system.inputs)):
+            if 0 <= handle - base < len(channels):
+                return channels[handle - base]
+        return None
+
+    @staticmethod
+    def _lookup(channels, base, name, p_handle):
+        for index, channel in enumerate(channels):
+            if channel.name == name:
+                p_handle[0] = base + index
+                return 0
+        return -ERR_NOENT
+
+    @_api(requires=_OPEN)
+    def LCDIO_LookupOutChanByName(self, system, name, p_handle):
+        return self._lookup(system.outputs, _OUTPUT_HANDLE,
+                            self._string(name), p_handle)
+
+    @_api(requires=_OPEN)
+    def LCDIO_LookupInChanByName(self, system, name, p_handle):
+        return self._lookup(system.inputs, _INPUT_HANDLE,
+                            self._string(name), p_handle)
+
+    @_api(requires=_OPEN)
+    def LCDIO_GetOutChanHandle(self, system, index, p_handle):
+        if not 0 <= index < len(system.outputs):
+            return -ERR_NODEV
+        p_handle[0] = _OUTPUT_HANDLE + index
+        return 0
+
+    @_api()
+    def LCDIO_WriteOn(self, system, handle, on):
+        channel = self._channel(system, handle)
+        if channel is None or not channel.is_output:
+            return -ERR_NODEV
+        channel.is_on = bool(on)
+        return 0
+
+    @_api()
+    def LCDIO_IsOutputOn(self, system, handle):
+        channel = self._channel(system, handle)
+        if channel is None or not channel.is_output:
+            return -ERR_NODEV
+        return int(channel.is_on)
+
+    @_api()
+    def LCDIO_IsInputOn(self, system, handle):
+        channel = self._channel(system, handle)
+        if channel is None or channel.is_output:
+            return -ERR_NODEV
+        return int(channel.is_on)
+
+    @_api()
+    def LCDIO_GetChanName(self, system, handle, buf, buf_size):
+        channel = self._channel(system, handle)
+        if channel is None:
+            return -ERR_NODEV
+
+        name = channel.name.encode('utf8') + b'\0'
+        if len(name) > buf_size:
+            return -ERR_NOSPC
+        self._ffi.memmove(buf, name, len(name))
+        return 0
+
+    @_api(requires=_OPEN)
+    def LCDIO_LookupIoDeviceByName(self, system, name, p_handle):
+        name = self._string(name)
+        if name not in system.io_devices:
+            return -ERR_NOENT
+        p_handle[0] = _IO_DEVICE_HANDLE + system.io_devices.index(name)
+        return 0
+
+
+class _ErrorLibrary(_SimulatedLibrary):
+    header = ERROR_HEADER
+
+    def __init__(self, ffi):
+        super(_ErrorLibrary, self).__init__(ffi)
+
+        # Error code -> message. Some codes have aliases; keep the first.
+        self._messages = dict()
+        for value, comment in parse_defines(ERROR_HEADER).values():
+            self._messages.setdefault(value, comment)
+        self._strings = dict()
+
+    def ErrorToString(self, error_code):
+        # The returned `char *` must stay valid, so keep them all.
+        try:
+            return self._strings[error_code]
+        except KeyError:
+            pass
+
+        message = self._messages.get(error_code,
+                                     self._messages[ERR_UNKNOWN])
+        s = self._ffi.new('char[]', message.encode('utf8'))
+        self._strings[error_code] = s
+        return s
+
+    def errnoToErrCode(self, errnum):
+        # The first error codes are identical to the C errno values.
+        if errnum in self._messages:
+            return errnum
+        return ERR_C_ERRNO | errnum
+
+
+_LIBRARY_CLASSES = {'bus': _BusLibrary,
+                    'pump': _PumpLibrary,
+                    'valve': _ValveLibrary,
+                    'dio': _DigitalIOLibrary,
+                    'error': _ErrorLibrary}
+
+_system = None
+_system_lock = threading.Lock()
+
+
+def get_system():
+    """
+    Return the simulated system, creating it with default parameters if
+    required.
+
+    Returns
+    -------
+    SimulatedSystem
+        The simulated system.
+
+    """
+    global _system
+
+    with _system_lock:
+        if _system is None:
+            _system = SimulatedSystem()
+        return _system
+
+
+def reset(**kwargs):
+    """
+    Replace the simulated system with a new one.
+
+    Device objects created before the reset must not be used afterwards.
+
+    Parameters
+    ----------
+    kwargs
+        Passed to :class:`SimulatedSystem`.
+
+    Returns
+    -------
+    SimulatedSystem
+        The new simulated system.
+
+    """
+    global _system
+
+    with _system_lock:
+        _system = SimulatedSystem(**kwargs)
+        return _system
+
+
+def open_library(name):
+    """
+    Create a simulated Qmix SDK library.
+
+    Parameters
+    ----------
+    name : str
+        The name of the library, i.e. one of the keys of
+        :data:`pyqmix.library.LIBRARIES`.
+
+    Returns
+    -------
+    pyqmix.library.QmixLibrary
+        The simulated library, in mode ``sim``.
+
+    """
+    from cffi import FFI
+    from .library import LIBRARIES, QmixLibrary
+
+    _, header = LIBRARIES[name]
+    ffi = FFI()
+    ffi.cdef(header)
+    lib = _LIBRARY_CLASSES[name](ffi)
+
+    return QmixLibrary(name=name, dll_path='<simulated>', ffi=ffi, lib=lib,
+                       mode='sim')
@@ -0,0 +1,782 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Recording pump telemetry into preallocated ring buffers.
+
+A :class:`TelemetryRecorder` samples the state of pumps from its own
+thread, and stores every sample in one fixed-capacity NumPy ring buffer per
+pump. The buffers are allocated once, so recording can run for any length
+of time at constant memory; once a buffer is full, the oldest samples are
+overwritten. Every value read from a pump is written straight into its
+field of the buffer, without creating a record object per sample. The
+recorder can also record the samples of a :class:`pyqmix.monitor.PumpMonitor`
+instead, e.g. to share them with code waiting for pumping operations.
+Snapshots of the recorded data are views into the buffers, without
+copying::
+
+    recorder = TelemetryRecorder(pumps, capacity=60 * 500, rate=500)
+    ...
+    data = recorder.snapshot(pump)
+    plt.plot(data['timestamp'], data['fill_level'])
+
+For long sessions, a :class:`TelemetrySink` streams the samples into
+memory-mapped files instead, which can be read by other processes while
+recording is still running, via :func:`read_telemetry`.
+
+Requires NumPy.
+"""
+
+import os
+import json
+import time
+import numbers
+import threading
+from abc import abstractmethod
+
+import numpy as np
+
+from .error import QmixError
+from .monitor import PumpState
+from .tools import AbstractBase, atomic_write, clock
+from .waiting import _MIN_EVENT_WAIT
+
+#: The record type of the telemetry buffers; the fields correspond to
+#: :class:`pyqmix.monitor.PumpState`. Timestamps refer to
+#: :func:`pyqmix.tools.clock`.
+TELEMETRY_DTYPE = np.dtype([('timestamp', 'f8'),
+                            ('is_pumping', '?'),
+                            ('fill_level', 'f8'),
+                            ('current_flow_rate', 'f8'),
+                            ('dosed_volume', 'f8')])
+
+assert TELEMETRY_DTYPE.names == PumpState._fields
+
+
+class RingBuffer(object):
+    """
+    A fixed-capacity ring buffer of NumPy records.
+
+    Every record is stored twice, `capacity` elements apart. This way, the
+    most recent records always form a contiguous block of memory, and can
+    be returned as a view instead of a copy.
+
+    Parameters
+    ----------
+    capacity : int
+        The maximum number of records retained.
+
+    dtype : numpy.dtype
+        The record type.
+
+    Notes
+    -----
+    Only one thread may append records. Views returned by :meth:`view` are
+    not copies: records in a view are overwritten once `capacity` further
+    records have been appended.
+
+    """
+    def __init__(self, capacity, dtype=TELEMETRY_DTYPE):
+        if capacity < 1:
+            raise ValueError('Capacity must be at least 1.')
+
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self._data = np.zeros(2 * capacity, dtype=self.dtype)
+        # One view per field, to write records in place, field by field.
+        self._fields = [self._data[name] for name in self.dtype.names]
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    @property
+    def total(self):
+        """
+        The number of records appended since the buffer was created or
+        cleared.
+
+        """
+        return self._count
+
+    @property
+    def dropped(self):
+        """
+        The number of records that have been overwritten.
+
+        """
+        return max(self._count - self.capacity, 0)
+
+    def append(self, record):
+        """
+        Append a record.
+
+        Parameters
+        ----------
+        record : tuple
+            The values of all fields, in order of the record type.
+
+        """
+        i = self._count % self.capacity
+        self._data[i] = record
+        self._data[i + self.capacity] = record
+        self._count += 1
+
+    def view(self, n=None):
+        """
+        Return the most recent records, oldest first, without copying.
+
+        Parameters
+        ----------
+        n : int or None
+            The number of records. If ``None``, return all retained records.
+
+        Returns
+        -------
+        numpy.ndarray
+            A structured array viewing the buffer.
+
+        """
+        count = self._count
+        size = min(count, self.capacity)
+        if n is not None:
+            size = min(max(n, 0), size)
+
+        start = (count - size) % self.capacity
+        return self._data[start:start + size]
+
+    def clear(self):
+        """
+        Discard all records.
+
+        """
+        self._count = 0
+
+
+class _MonitorClient(AbstractBase):
+    # Records pump samples, either those taken by a PumpMonitor, or, if
+    # none was passed, by its own sampling thread.
+    def __init__(self, rate, monitor):
+        if monitor is None and rate <= 0:
+            raise ValueError('Sampling rate must be positive.')
+
+        self.rate = rate
+        self.monitor = monitor
+        self.last_error = None
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.is_recording = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _register(self, pump):
+        if self.monitor is not None and pump not in self.monitor.pumps:
+            self.monitor.register(pump)
+
+    def start(self):
+        """
+        Start recording.
+
+        """
+        if self.is_recording:
+            return
+
+        if self.monitor is not None:
+            self.monitor.add_callback(self._record)
+        else:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name=type(self).__name__)
+            self._thread.daemon = True
+            self._thread.start()
+
+        self.is_recording = True
+
+    def stop(self):
+        """
+        Stop recording.
+
+        """
+        if not self.is_recording:
+            return
+
+        if self.monitor is not None:
+            self.monitor.remove_callback(self._record)
+        else:
+            self._stop_event.set()
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+            self._thread = None
+
+        self.is_recording = False
+
+    def _run(self):
+        period = 1. / self.rate
+        next_sweep = clock()
+
+        while not self._stop_event.is_set():
+            self._sample()
+
+            # Sample on a fixed grid, but don't try to catch up if sampling
+            # took longer than one period.
+            next_sweep = max(next_sweep + period, clock())
+            delay = next_sweep - clock()
+            if delay < _MIN_EVENT_WAIT:
+                time.sleep(max(delay, 0))
+            else:
+                self._stop_event.wait(delay)
+
+    @abstractmethod
+    def _sample(self):
+        # Called from the sampling thread to sample all pumps once.
+        pass
+
+    @abstractmethod
+    def _record(self, states):
+        # Called from the monitor thread with the states of all monitored
+        # pumps after every sampling sweep.
+        pass
+
+
+class TelemetryRecorder(_MonitorClient):
+    """
+    Record the state of pumps into ring buffers.
+
+    Parameters
+    ----------
+    pumps : list of :class:`pyqmix.QmixPump` instances, or None
+        The pumps to record. More pumps can be added later via
+        :meth:`add_pump`.
+
+    capacity : int
+        The number of samples retained per pump.
+
+    rate : float
+        The sampling rate in Hz. Ignored if `monitor` is passed.
+
+    monitor : :class:`pyqmix.monitor.PumpMonitor` or None
+        The monitor whose samples to record; the pumps are registered with
+        it. If ``None``, the recorder samples the pumps from its own thread,
+        writing every value in place into the buffers.
+
+    auto_start : bool
+        Whether to start recording on object instantiation.
+
+    Attributes
+    ----------
+    last_error : Exception or None
+        The last error raised while sampling a pump. Samples that could not
+        be taken completely are skipped.
+
+    """
+    def __init__(self, pumps=None, capacity=100000, rate=100., monitor=None,
+                 auto_start=True):
+        super(TelemetryRecorder, self).__init__(rate=rate, monitor=monitor)
+        self.capacity = capacity
+        self._buffers = dict()
+        # The (pump, buffer) pairs to sample, replaced on every change.
+        self._sampled = []
+
+        if pumps is not None:
+            for pump in pumps:
+                self.add_pump(pump)
+
+        if auto_start:
+            self.start()
+
+    @property
+    def pumps(self):
+        """
+        The recorded pumps.
+
+        """
+        with self._lock:
+            return list(self._buffers)
+
+    @property
+    def buffers(self):
+        """
+        A dictionary mapping the recorded pumps to their
+        :class:`RingBuffer`.
+
+        """
+        with self._lock:
+            return dict(self._buffers)
+
+    def add_pump(self, pump):
+        """
+        Start recording a pump.
+
+        The pump is registered with the monitor if required.
+
+        Parameters
+        ----------
+        pump : :class:`pyqmix.QmixPump`
+            The pump to record.
+
+        """
+        with self._lock:
+            if pump not in self._buffers:
+                self._buffers[pump] = RingBuffer(self.capacity)
+                self._sampled = list(self._buffers.items())
+
+        self._register(pump)
+
+    def remove_pump(self, pump):
+        """
+        Stop recording a pump, and discard its buffer.
+
+        Parameters
+        ----------
+        pump : :class:`pyqmix.QmixPump`
+            The pump to stop recording.
+
+        """
+        with self._lock:
+            del self._buffers[pump]
+            self._sampled = list(self._buffers.items())
+
+    def clear(self):
+        """
+        Discard all recorded samples.
+
+        """
+        for buffer in self.buffers.values():
+            buffer.clear()
+
+    def snapshot(self, pump, n=None):
+        """
+        Return the samples recorded for a pump, oldest first.
+
+        Parameters
+        ----------
+        pump : :class:`pyqmix.QmixPump`
+            The pump.
+
+        n : int or None
+            Only return the `n` most recent samples.
+
+        Returns
+        -------
+        numpy.ndarray
+            A structured array of type :data:`TELEMETRY_DTYPE`. This is a
+            view into the ring buffer, not a copy; call its ``copy()``
+            method to keep the samples beyond the capacity of the buffer.
+
+        """
+        return self._buffers[pump].view(n)
+
+    def _sample(self):
+        # Write every value straight into the fields of the buffers. A
+        # record only becomes visible once all its fields have been
+        # written.
+        for pump, buffer in self._sampled:
+            i = buffer._count % buffer.capacity
+            j = i + buffer.capacity
+            (timestamp, is_pumping, fill_level, flow_rate,
+             dosed_volume) = buffer._fields
+
+            try:
+                timestamp[i] = timestamp[j] = clock()
+                is_pumping[i] = is_pumping[j] = pump.is_pumping
+                fill_level[i] = fill_level[j] = pump.fill_level
+                flow_rate[i] = flow_rate[j] = pump.current_flow_rate
+                dosed_volume[i] = dosed_volume[j] = pump.dosed_volume
+            except Exception as e:
+                self.last_error = e
+                continue
+
+            buffer._count += 1
+
+    def _record(self, states):
+        # Called from the monitor thread after every sampling sweep.
+        buffers = self._buffers
+        for pump, state in states.items():
+            buffer = buffers.get(pump)
+            if buffer is not None:
+                buffer.append(state)
+
+
+#: The columns of telemetry files written by :class:`TelemetrySink`.
+#: ``pump`` is the number of the pump in the sink, see
+#: :func:`read_telemetry_info`; ``valve_position`` is -1 if unknown.
+SINK_COLUMNS = (('timestamp', 'f8'),
+                ('pump', 'u2'),
+                ('fill_level', 'f8'),
+                ('current_flow_rate', 'f8'),
+                ('dosed_volume', 'f8'),
+                ('valve_position', 'i2'))
+
+_INFO_FILE = 'telemetry.json'
+_ROWS_FILE = 'rows.npy'
+_CHUNK_DIR = 'chunk-%06d'
+
+
+class TelemetrySink(_MonitorClient):
+    """
+    Stream the state of pumps into memory-mapped columnar files.
+
+    Samples are written to a directory of chunks. Every chunk holds
+    `chunk_size` rows, stored as one ``.npy`` file per column, plus the
+    number of valid rows. The files are memory-mapped, so samples are
+    visible to other processes as soon as they have been committed, and
+    survive a crash of the recording process. Use :func:`read_telemetry` to
+    load them.
+
+    Parameters
+    ----------
+    path : str
+        The directory to write to. Must not contain telemetry yet.
+
+    pumps : list of :class:`pyqmix.QmixPump` instances, or None
+        The pumps to record. More pumps can be added later via
+        :meth:`add_pump`.
+
+    chunk_size : int
+        The number of rows per chunk.
+
+    buffer_size : int
+        The maximum number of rows written, but not yet committed.
+
+    flush_interval : float
+        The maximum time in seconds rows stay uncommitted.
+
+    rate : float
+        The sampling rate in Hz. Ignored if `monitor` is passed.
+
+    monitor : :class:`pyqmix.monitor.PumpMonitor` or None
+        The monitor whose samples to record; the pumps are registered with
+        it. If ``None``, the sink samples the pumps from its own thread.
+
+    record_valves : bool
+        Whether to query the valve position of every pump with each sample.
+        This costs one SDK call per pump and sample. If ``False``, the valve
+        position is recorded as -1.
+
+    auto_start : bool
+        Whether to start recording on object instantiation.
+
+    """
+    def __init__(self, path, pumps=None, chunk_size=2 ** 18, buffer_size=4096,
+                 flush_interval=1., rate=100., monitor=None,
+                 record_valves=False, auto_start=True):
+        if os.path.exists(os.path.join(path, _INFO_FILE)):
+            msg = 'The directory %s already contains telemetry.' % path
+            raise ValueError(msg)
+        if buffer_size < 1:
+            raise ValueError('buffer_size must be at least 1.')
+
+        super(TelemetrySink, self).__init__(rate=rate, monitor=monitor)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.record_valves = record_valves
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self._pumps = []
+        self._pump_ids = dict()
+        # Relates timestamps to wall-clock time for other processes.
+        self._clock_offset = time.time() - clock()
+
+        self._n_chunks = 0
+        self._columns = None
+        self._rows = None
+        self._n_rows = 0
+        self._n_committed = 0
+        self._last_flush = clock()
+        self.is_closed = False
+
+        self._write_info()
+        if pumps is not None:
+            for pump in pumps:
+                self.add_pump(pump)
+
+        if auto_start:
+            self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def pumps(self):
+        """
+        The recorded pumps, in order of their number in the files.
+
+        """
+        with self._lock:
+            return list(self._pumps)
+
+    @property
+    def n_rows(self):
+        """
+        The number of rows written, including uncommitted rows.
+
+        """
+        if self._n_chunks == 0:
+            return 0
+        return (self._n_chunks - 1) * self.chunk_size + self._n_rows
+
+    def _write_info(self):
+        pumps = [dict(number=i, index=pump.index, name=pump.name)
+                 for i, pump in enumerate(self._pumps)]
+        info = dict(columns=[list(c) for c in SINK_COLUMNS],
+                    chunk_size=self.chunk_size,
+                    clock_offset=self._clock_offset,
+                    pumps=pumps)
+        with atomic_write(os.path.join(self.path, _INFO_FILE)) as f:
+            json.dump(info, f, indent=2)
+
+    def add_pump(self, pump):
+        """
+        Start recording a pump.
+
+        The pump is registered with the monitor if required.
+
+        Parameters
+        ----------
+        pump : :class:`pyqmix.QmixPump`
+            The pump to record.
+
+        """
+        with self._lock:
+            if pump not in self._pump_ids:
+                self._pump_ids[pump] = len(self._pumps)
+                self._pumps.append(pump)
+                self._write_info()
+
+        self._register(pump)
+
+    def _open_chunk(self):
+        chunk_dir = os.path.join(self.path, _CHUNK_DIR % self._n_chunks)
+        os.makedirs(chunk_dir)
+
+        columns = []
+        for name, dtype in SINK_COLUMNS:
+            columns.append(np.lib.format.open_memmap(
+                os.path.join(chunk_dir, name + '.npy'), mode='w+',
+                dtype=dtype, shape=(self.chunk_size,)))
+
+        # Readers only consider chunks with a row count.
+        rows_path = os.path.join(chunk_dir, _ROWS_FILE)
+        with atomic_write(rows_path, 'wb') as f:
+            np.save(f, np.zeros(1, dtype='i8'))
+
+        self._columns = columns
+        self._rows = np.load(rows_path, mmap_mode='r+')
+        self._n_rows = 0
+        self._n_committed = 0
+        self._n_chunks += 1
+
+    def _close_chunk(self):
+        self._commit()
+        for column in self._columns:
+            column.flush()
+        self._rows.flush()
+        self._columns = None
+        self._rows = None
+
+    def _commit(self):
+        # Make the written rows visible to readers.
+        if self._rows is not None and self._n_committed < self._n_rows:
+            self._rows[0] = self._n_rows
+            self._n_committed = self._n_rows
+        self._last_flush = clock()
+
+    def append(self, timestamp, pump, fill_level, current_flow_rate,
+               dosed_volume, valve_position=-1):
+        """
+        Write a row.
+
+        Usually called by the monitor; rows can also be written manually,
+        e.g. when not using a monitor.
+
+        Parameters
+        ----------
+        timestamp : float
+            The time of the sample, see :func:`pyqmix.tools.clock`.
+
+        pump : :class:`pyqmix.QmixPump` or int
+            The pump, or its number in the sink.
+
+        fill_level, current_flow_rate, dosed_volume : float
+            The pump state.
+
+        valve_position : int
+            The valve position, or -1 if unknown.
+
+        """
+        with self._lock:
+            if self.is_closed:
+                raise RuntimeError('The telemetry sink has been closed.')
+
+            if not isinstance(pump, numbers.Integral):
+                pump = self._pump_ids[pump]
+
+            if self._columns is None or self._n_rows == self.chunk_size:
+                if self._columns is not None:
+                    self._close_chunk()
+                self._open_chunk()
+
+            i = self._n_rows
+            for column, value in zip(self._columns,
+                                     (timestamp, pump, fill_level,
+                                      current_flow_rate, dosed_volume,
+                                      valve_position)):
+                column[i] = value
+            self._n_rows += 1
+
+            if (self._n_rows - self._n_committed >= self.buffer_size or
+                    clock() - self._last_flush >= self.flush_interval):
+                self._commit()
+
+    def flush(self):
+        """
+        Commit all rows, and write them to disk.
+
+        """
+        with self._lock:
+            self._commit()
+            if self._columns is not None:
+                for column in self._columns:
+                    column.flush()
+                self._rows.flush()
+
+    def close(self):
+        """
+        Stop recording, and close the files.
+
+        """
+        self.stop()
+        with self._lock:
+            if self._columns is not None:
+                self._close_chunk()
+            self.is_closed = True
+
+    def _valve_position(self, pump):
+        if self.record_valves:
+            try:
+                return pump.valve.position
+            except QmixError:
+                pass
+        return -1
+
+    def _sample(self):
+        # Called from the sampling thread.
+        for pump in self.pumps:
+            try:
+                self.append(clock(), pump, pump.fill_level,
+                            pump.current_flow_rate, pump.dosed_volume,
+                            self._valve_position(pump))
+            except Exception as e:
+                self.last_error = e
+
+    def _record(self, states):
+        # Called from the monitor thread after every sampling sweep.
+        for pump, state in states.items():
+            if pump not in self._pump_ids:
+                continue
+
+            self.append(state.timestamp, pump, state.fill_level,
+                        state.current_flow_rate, state.dosed_volume,
+                        self._valve_position(pump))
+
+
+def read_telemetry_info(path):
+    """
+    Read the description of telemetry written by :class:`TelemetrySink`.
+
+    Parameters
+    ----------
+    path : str
+        The telemetry directory.
+
+    Returns
+    -------
+    dict
+        The ``columns`` with their types, the ``chunk_size``, the
+        ``clock_offset`` to add to timestamps to obtain ``time.time()``
+        values, and the recorded ``pumps`` with their ``number``, ``index``
+        and ``name``.
+
+    """
+    with open(os.path.join(path, _INFO_FILE)) as f:
+        return json.load(f)
+
+
+def iter_telemetry_chunks(path):
+    """
+    Iterate over the chunks of telemetry written by :class:`TelemetrySink`.
+
+    Parameters
+    ----------
+    path : str
+        The telemetry directory.
+
+    Yields
+    ------
+    dict
+        A dictionary mapping column names to read-only memory-mapped arrays
+        of the committed rows of a chunk.
+
+    """
+    info = read_telemetry_info(path)
+    i = 0
+    while True:
+        chunk_dir = os.path.join(path, _CHUNK_DIR % i)
+        rows_path = os.path.join(chunk_dir, _ROWS_FILE)
+        if not os.path.exists(rows_path):
+            break
+
+        n_rows = int(np.load(rows_path, mmap_mode='r')[0])
+        chunk = dict()
+        for name, _ in info['columns']:
+            column = np.load(os.path.join(chunk_dir, name + '.npy'),
+                             mmap_mode='r')
+            chunk[name] = column[:n_rows]
+
+        yield chunk
+        i += 1
+
+
+def read_telemetry(path):
+    """
+    Load telemetry written by :class:`TelemetrySink`.
+
+    The files may be read while they are still being written to; only
+    committed rows are returned.
+
+    Parameters
+    ----------
+    path : str
+        The telemetry directory.
+
+    Returns
+    -------
+    dict
+        A dictionary mapping column names to arrays. If all rows are stored
+        in a single chunk, the arrays are read-only memory-mapped views of
+        the files; otherwise, the chunks are concatenated.
+
+    """
+    chunks = list(iter_telemetry_chunks(path))
+    if len(chunks) == 1:
+        return chunks[0]
+
+    info = read_telemetry_info(path)
+    data = dict()
+    for name, dtype in info['columns']:
+        if chunks:
+            data[name] = np.concatenate([chunk[name] for chunk in chunks])
+        else:
+            data[name] = np.zeros(0, dtype=dtype)
+    return data
@@ -2,6 +2,58 @@
 # -*- coding: utf-8 -*-
 
 import os
+from abc import ABCMeta
+from contextlib import contextmanager
+
+try:
+    # High-resolution monotonic clock; Python >= 3.3
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+
+# Base class of abstract classes; `abc.ABC` is not available on Python 2.
+AbstractBase = ABCMeta('AbstractBase', (object,), {})
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Open a file for writing, such that it is replaced atomically.
+
+    Data is written to a temporary file next to `path`, which only replaces
+    `path` once the block exits without error and the data has been
+    flushed to disk. Readers therefore see either the old or the new
+    contents, even if the process crashes while writing.
+
+    Parameters
+    ----------
+    path : str
+        The file to write.
+
+    mode : str
+        The mode to open the temporary file in, ``w`` or ``wb``.
+
+    """
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
+        try:
+            # Python >= 3.3
+            os.replace(tmp_path, path)
+        except AttributeError:
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
 
 
 def CHK(return_code, *args):
@@ -26,19 +78,17 @@ def CHK(return_code, *args):
 
     Raises
     ------
-    RuntimeError
-        If the DLL function returned an error code.
+    pyqmix.error.QmixError
+        If the DLL function returned an error code. This is a subclass of
+        `RuntimeError`; see :mod:`pyqmix.error` for the more specific
+        subclasses raised for certain error codes.
 
     """
     if return_code >= 0:
         return return_code
     else:
-        from .error import QmixError  # We import here to avoid circularity with error.py
-        e = QmixError(return_code)
-        error_string = e.error_string
-        msg = (error_string + ", Error number: " + str(e.error_number) +
-               ", Error code: " + str(e.error_code))
-        raise RuntimeError(msg)
+        from .error import error_from_code  # We import here to avoid circularity with error.py
+        raise error_from_code(return_code)
 
 
 def find_dll(dll_dir, dll_filename):
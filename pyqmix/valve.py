@@ -3,19 +3,18 @@
 
 import os
 import sys
-from cffi import FFI
+import numbers
 
 if sys.version_info[0] < 3:
     # Python 2 compatibility; requires `future` package.
     from builtins import bytes
 
-from . import config
 from .dio import QmixDigitalIO
-from .tools import CHK, find_dll
-from .headers import VALVE_HEADER
+from ._device import _SDKDevice
+from .library import load_library
 
 
-class QmixValve(object):
+class QmixValve(_SDKDevice):
     """
     Qmix valve interface.
 
@@ -23,15 +22,17 @@ class QmixValve(object):
     ----------
     index : int, or None
         Index of the valve to initialize. Takes precedence over the
-        `name` and `handle` parameters.
+        `name` parameter.
 
     name : str
         The name of the valve to initialize. Will be ignored if `index` is
-        not `None`. Takes precedence over the `handle` parameter.
+        not `None`.
 
-    handle :  Qmix valve handle, or None
+    handle :  Qmix valve handle, int, or None
         A Qmix valve device handle, as returned by
-        :func:~`pyqmix.QmixPump.valve_handle`.
+        :func:~`pyqmix.QmixPump.valve_handle`, or its value, e.g. from
+        :class:`pyqmix.inventory.DeviceInventory`. If specified, the handle
+        is used directly, and `index` and `name` are only recorded.
 
     """
     def __init__(self, index=None, name='', handle=None):
@@ -42,40 +43,30 @@ class QmixValve(object):
             self.name = name
             self.handle = handle
 
-        dll_dir = config.read_config().get('qmix_dll_dir', None)
-        dll_filename = 'labbCAN_Valve_API.dll'
-
-        dll_path = find_dll(dll_dir=dll_dir, dll_filename=dll_filename)
-        if dll_path is None:
-            msg = 'Could not find the Qmix SDK DLL %s.' % dll_filename
-            raise RuntimeError(msg)
-        else:
-            self.dll_path = dll_path
-
-        self._ffi = FFI()
-        self._ffi.cdef(VALVE_HEADER)
-        self._dll = self._ffi.dlopen(self.dll_path)
+        self._library = load_library('valve')
+        self.dll_path = self._library.dll_path
+        self._ffi = self._library.ffi
+        self._dll = self._library.lib
+        self._functions = self._library.functions
 
-        if self.index is not None:
+        if isinstance(handle, numbers.Integral):
+            self._handle = self._ffi.new('dev_hdl *', handle)
+        elif handle is not None:
+            self._handle = handle
+        elif self.index is not None:
             self._handle = self._ffi.new('dev_hdl *', 0)
             self._call('LCV_GetValveHandle', self.index, self._handle)
-        elif self.name != '':
+        else:
+            self._handle = self._ffi.new('dev_hdl *', 0)
             self._call('LCV_LookupValveByName',
                        bytes(self.name, 'utf8'),
                        self._handle)
-        else:
-            self._handle = handle
 
         self.aspirate_pos = 1
         self.dispense_pos = 0
 
         self.name = name
 
-    def _call(self, func_name, *args):
-        func = getattr(self._dll, func_name)
-        r = func(*args)
-        return CHK(r)
-
     @property
     def number_of_positions(self):
         """
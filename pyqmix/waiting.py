@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Waiting for the completion of device operations.
+
+Instead of polling the device at a fixed, very short interval, the
+poll interval is determined by a poll strategy. The default strategy,
+:class:`AdaptiveBackoff`, polls rarely while an operation is expected to
+be far from completion, and tightens the interval as the predicted end of
+the operation approaches.
+"""
+
+import time
+
+from .tools import clock
+
+# Event.wait() may have a coarse resolution on some platforms, so short
+# intervals are slept instead, checking for cancellation afterwards.
+_MIN_EVENT_WAIT = 0.02
+
+
+class WaitTimeout(RuntimeError):
+    """
+    Raised if an operation did not complete within the specified timeout.
+
+    """
+    pass
+
+
+class WaitCancelled(RuntimeError):
+    """
+    Raised if waiting for an operation was cancelled.
+
+    """
+    pass
+
+
+class FixedInterval(object):
+    """
+    Poll at a fixed interval.
+
+    Parameters
+    ----------
+    interval : float
+        The poll interval in seconds.
+
+    """
+    def __init__(self, interval=0.0005):
+        if interval <= 0:
+            raise ValueError('Poll interval must be positive.')
+
+        self.poll_interval = interval
+
+    def interval(self, elapsed, expected_duration=None):
+        """
+        Return the time to wait before the next poll.
+
+        Parameters
+        ----------
+        elapsed : float
+            Time in seconds since the operation was started.
+
+        expected_duration : float or None
+            The expected total duration of the operation in seconds, or
+            ``None`` if unknown.
+
+        Returns
+        -------
+        float
+            The poll interval in seconds.
+
+        """
+        return self.poll_interval
+
+
+class AdaptiveBackoff(object):
+    """
+    Poll at an interval that adapts to the expected end of the operation.
+
+    If the expected duration of the operation is known, the poll interval
+    is a fraction of the remaining time, i.e. it shrinks as the predicted
+    end approaches. Once the predicted end has passed, or if the duration
+    is unknown, the interval grows in proportion to the time waited so
+    far.
+
+    Parameters
+    ----------
+    min_interval : float
+        The shortest poll interval in seconds.
+
+    max_interval : float
+        The longest poll interval in seconds.
+
+    fraction : float
+        Fraction of the remaining (or elapsed) time to wait before the next
+        poll.
+
+    """
+    def __init__(self, min_interval=0.001, max_interval=0.1, fraction=0.25):
+        if min_interval <= 0:
+            raise ValueError('Minimum poll interval must be positive.')
+        if max_interval < min_interval:
+            msg = 'Maximum poll interval must not be below minimum interval.'
+            raise ValueError(msg)
+        if not 0 < fraction < 1:
+            raise ValueError('Fraction must be in the range (0, 1).')
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.fraction = fraction
+
+    def interval(self, elapsed, expected_duration=None):
+        """
+        Return the time to wait before the next poll.
+
+        Parameters
+        ----------
+        elapsed : float
+            Time in seconds since the operation was started.
+
+        expected_duration : float or None
+            The expected total duration of the operation in seconds, or
+            ``None`` if unknown.
+
+        Returns
+        -------
+        float
+            The poll interval in seconds.
+
+        """
+        if expected_duration is None:
+            interval = self.fraction * elapsed
+        elif elapsed < expected_duration:
+            interval = self.fraction * (expected_duration - elapsed)
+        else:
+            interval = self.fraction * (elapsed - expected_duration)
+
+        return min(max(interval, self.min_interval), self.max_interval)
+
+
+def wait_until(condition, strategy=None, expected_duration=None,
+               timeout=None, cancel_event=None, start=None):
+    """
+    Block until a condition is met.
+
+    Parameters
+    ----------
+    condition : callable
+        Called without arguments; waiting ends once it returns ``True``.
+
+    strategy : FixedInterval, AdaptiveBackoff, or None
+        The poll strategy. If ``None``, use :class:`AdaptiveBackoff` with
+        its default parameters.
+
+    expected_duration : float or None
+        The expected duration of the operation in seconds, or ``None`` if
+        unknown.
+
+    timeout : float or None
+        Maximum time to wait in seconds. If ``None``, wait indefinitely.
+
+    cancel_event : threading.Event or None
+        If passed, waiting is aborted as soon as the event is set.
+
+    start : float or None
+        The time the operation was started, as returned by
+        :func:`pyqmix.tools.clock`. If ``None``, assume the operation was
+        started right now.
+
+    Raises
+    ------
+    WaitTimeout
+        If the condition was not met within `timeout` seconds.
+
+    WaitCancelled
+        If `cancel_event` was set.
+
+    """
+    if strategy is None:
+        strategy = AdaptiveBackoff()
+
+    wait_start = clock()
+    if start is None:
+        start = wait_start
+
+    while not condition():
+        now = clock()
+        interval = strategy.interval(now - start, expected_duration)
+
+        if timeout is not None:
+            remaining = timeout - (now - wait_start)
+            if remaining <= 0:
+                raise WaitTimeout('Operation did not complete within %.3f s.'
+                                  % timeout)
+            interval = min(interval, remaining)
+
+        if cancel_event is None:
+            time.sleep(interval)
+        elif interval < _MIN_EVENT_WAIT:
+            time.sleep(interval)
+            if cancel_event.is_set():
+                raise WaitCancelled('Waiting was cancelled.')
+        elif cancel_event.wait(interval):
+            raise WaitCancelled('Waiting was cancelled.')
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Test fixtures. All tests run against the simulated Qmix SDK
+(``PYQMIX_BACKEND=sim``), with a temporary pyqmix configuration directory.
+"""
+
+import os
+import atexit
+
+import pytest
+
+from pyqmix import config, sim, QmixBus, QmixPump
+
+
+@pytest.fixture(autouse=True)
+def sim_system(tmpdir, monkeypatch):
+    config_dir = str(tmpdir.join('config'))
+    monkeypatch.setenv('PYQMIX_BACKEND', 'sim')
+    monkeypatch.setattr(config, 'PYQMIX_CONFIG_DIR', config_dir)
+    monkeypatch.setattr(config, 'PYQMIX_CONFIG_FILE',
+                        os.path.join(config_dir, 'config.yaml'))
+    # Pumps save their drive position counters at exit, when the simulated
+    # system they belong to has been replaced.
+    monkeypatch.setattr(atexit, 'register', lambda *args, **kwargs: None)
+    return sim.reset(n_pumps=2)
+
+
+@pytest.fixture
+def bus(sim_system):
+    bus = QmixBus()
+    yield bus
+    bus.stop()
+    bus.close()
+
+
+@pytest.fixture
+def pumps(bus):
+    pumps = [QmixPump(index=i) for i in range(2)]
+    operations = [pump.set_fill_level(2, pump.max_flow_rate)
+                  for pump in pumps]
+    for operation in operations:
+        operation.result(timeout=5)
+    return pumps
+
+
+@pytest.fixture
+def pump(pumps):
+    return pumps[0]
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+asyncio = pytest.importorskip('asyncio')
+
+from pyqmix.aio import AsyncQmixPump  # noqa: E402
+from pyqmix.waiting import WaitTimeout  # noqa: E402
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+@pytest.fixture
+def async_pumps(pumps):
+    return [AsyncQmixPump(pump) for pump in pumps]
+
+
+def test_attributes_pass_through(async_pumps, pumps):
+    assert async_pumps[0].fill_level == pumps[0].fill_level
+    assert async_pumps[0].index == pumps[0].index
+
+
+def test_concurrent_dispense(loop, async_pumps):
+    levels = [pump.fill_level for pump in async_pumps]
+    loop.run_until_complete(asyncio.gather(
+        *[pump.dispense(0.5, 1) for pump in async_pumps]))
+
+    for pump, level in zip(async_pumps, levels):
+        assert not pump.is_pumping
+        assert level - pump.fill_level == pytest.approx(0.5, abs=1e-3)
+
+
+def test_timeout(loop, async_pumps):
+    pump = async_pumps[0]
+    with pytest.raises(WaitTimeout):
+        loop.run_until_complete(pump.dispense(1, 0.25, timeout=0.2))
+    assert pump.is_pumping
+    pump.stop()
+
+
+def test_cancel_stops_pump(loop, async_pumps):
+    pump = async_pumps[0]
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(
+            asyncio.wait_for(pump.dispense(1, 0.25), 0.2))
+    assert not pump.is_pumping
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import runpy
+
+import pytest
+
+from pyqmix import library
+from pyqmix._build_ffi import make_builder, _strip_unresolved_defines
+
+
+def test_strip_unresolved_defines():
+    header = '#define USL_DECL ...\n#define ERR_BUSY 0x10\nlong f(void);'
+    assert _strip_unresolved_defines(header).splitlines() == [
+        '#define ERR_BUSY 0x10', 'long f(void);']
+
+
+def test_missing_precompiled_module_falls_back():
+    assert library.precompiled_module_name('pump') == 'pyqmix._qmix_pump_cffi'
+    assert library._import_precompiled('pump') is None
+
+
+@pytest.mark.parametrize('name', sorted(library.LIBRARIES))
+def test_abi_module(tmpdir, name):
+    make_builder(name).compile(tmpdir=str(tmpdir))
+    path = tmpdir.join('pyqmix', '_qmix_%s_cffi.py' % name)
+    assert os.path.exists(str(path))
+
+    module = runpy.run_path(str(path))
+    # Out-of-line ABI modules only carry the declarations; the DLL is
+    # opened via `dlopen`.
+    assert 'lib' not in module
+    assert hasattr(module['ffi'], 'dlopen')
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from pyqmix import bus as bus_module, sim, QmixBus
+
+
+def test_invalid_ready_mode():
+    with pytest.raises(ValueError):
+        QmixBus(ready_mode='wait')
+
+
+def test_probe_returns_once_ready(sim_system):
+    t0 = time.time()
+    bus = QmixBus()
+    try:
+        assert bus.is_ready
+        assert time.time() - t0 < 1
+        assert sim_system.bus_state == 'started'
+    finally:
+        bus.stop()
+        bus.close()
+
+
+def test_probe_waits_for_devices():
+    sim.reset(n_pumps=2, bus_start_delay=0.3)
+    t0 = time.time()
+    bus = QmixBus()
+    try:
+        assert bus.is_ready
+        assert time.time() - t0 >= 0.3
+    finally:
+        bus.stop()
+        bus.close()
+
+
+def test_probe_timeout():
+    sim.reset(n_pumps=0)
+    with pytest.warns(RuntimeWarning):
+        bus = QmixBus(ready_timeout=0.1)
+    try:
+        assert bus.is_ready is False
+    finally:
+        bus.stop()
+        bus.close()
+
+
+def test_sleep_mode(monkeypatch):
+    # Longer than the simulated bus open and start delays.
+    monkeypatch.setattr(bus_module, 'STARTUP_DELAY', 0.15)
+    t0 = time.time()
+    bus = QmixBus(ready_mode='sleep')
+    try:
+        assert bus.is_ready is None
+        assert time.time() - t0 >= 0.3
+    finally:
+        bus.stop()
+        bus.close()
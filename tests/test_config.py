@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+
+import pytest
+
+from pyqmix import config
+
+
+@pytest.fixture
+def dumps(monkeypatch):
+    config.flush()
+    calls = []
+    dump = config.yaml.dump
+
+    def record(data, stream):
+        calls.append(data)
+        dump(data, stream)
+
+    monkeypatch.setattr(config.yaml, 'dump', record)
+    return calls
+
+
+def test_batch_writes_once(dumps):
+    with config.batch():
+        for index in range(10):
+            config.add_pump(index)
+            config.set_pump_name(index, 'pump %i' % index)
+        assert not dumps
+    assert len(dumps) == 1
+    assert os.path.exists(config.PYQMIX_CONFIG_FILE)
+
+
+def test_burst_is_flushed_once(dumps, monkeypatch):
+    monkeypatch.setattr(config, 'FLUSH_DELAY', 0.1)
+    for index in range(10):
+        config.add_pump(index)
+    assert not dumps
+    assert len(config.read_config()['pumps']) == 10
+
+    time.sleep(0.5)
+    assert len(dumps) == 1
+    assert len(config.read_config()['pumps']) == 10
+
+
+def test_flush(dumps):
+    config.set_qmix_dll_dir('C:/Qmix')
+    config.flush()
+    assert len(dumps) == 1
+    with open(config.PYQMIX_CONFIG_FILE) as f:
+        assert 'C:/Qmix' in f.read()
+
+
+def test_concurrent_setters():
+    def add(index):
+        config.add_pump(index)
+        config.set_pump_name(index, 'pump %i' % index)
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    pumps = config.read_config()['pumps']
+    assert sorted(pumps) == list(range(20))
+    assert all(pumps[i]['name'] == 'pump %i' % i for i in range(20))
+
+
+def test_read_config_returns_copy():
+    config.set_qmix_dll_dir('C:/Qmix')
+    config.read_config()['qmix_dll_dir'] = 'D:/'
+    assert config.read_config()['qmix_dll_dir'] == 'C:/Qmix'
+
+
+def test_remove_missing_pump():
+    with pytest.raises(KeyError):
+        config.remove_pump(3)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from pyqmix.continuous import ContinuousFlowPair
+
+
+@pytest.fixture
+def small_pumps(pumps):
+    # 2.5 mL syringes, refilled in about 0.6 s.
+    for pump in pumps:
+        pump.set_syringe_params(inner_diameter_mm=32.5713,
+                                max_piston_stroke_mm=3)
+    return pumps
+
+
+def test_handover(small_pumps):
+    pair = ContinuousFlowPair(*small_pumps, window=0.4, valve_lead=0.2)
+    with pair:
+        pair.start(1.5)
+        time.sleep(3.5)
+        assert pair.is_running
+        assert pair.active_pump in small_pumps
+
+    assert pair.error is None
+    assert not any(pump.is_pumping for pump in small_pumps)
+
+    report = pair.report()
+    assert report['n_handovers'] >= 1
+    assert report['max_gap'] < 0.05
+    handover = pair.handovers[0]
+    assert handover.from_pump is not handover.to_pump
+    assert abs(handover.timing_error) < 0.05
+
+
+def test_refill_rate_too_low(small_pumps):
+    pair = ContinuousFlowPair(*small_pumps, refill_rate=1.5)
+    with pytest.raises(ValueError):
+        pair.start(1.5)
+    assert not pair.is_running
+
+
+def test_units_must_match(pumps):
+    pumps[1].set_flow_unit(time_unit='per_minute')
+    with pytest.raises(ValueError):
+        ContinuousFlowPair(*pumps)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pickle
+
+import pytest
+
+from pyqmix import error
+from pyqmix.error import (QmixError, QmixBusyError, QmixTimeoutError,
+                          QmixCommunicationError, error_from_code)
+
+
+@pytest.mark.parametrize('symbol, cls', [
+    ('ERR_BUSY', QmixBusyError),
+    ('ERR_CANO_DLL_TIMEOUT', QmixTimeoutError),
+    ('ERR_CANO_DLL_TXFULL', QmixBusyError),
+    ('ERR_CANO_DLL_BUS_OFF', QmixCommunicationError)])
+def test_error_class(symbol, cls):
+    code = error._SYMBOLS[symbol]
+    e = error_from_code(-code)
+    assert type(e) is cls
+    assert isinstance(e, QmixError)
+    assert isinstance(e, RuntimeError)
+    assert e.symbol == symbol
+    assert e.error_number == -code
+    assert e.error_code == hex(code)
+
+
+def test_unknown_code():
+    e = error_from_code(-0x7ffff)
+    assert type(e) is QmixError
+    assert e.symbol is None
+    assert e.error_string
+
+
+def test_pickle():
+    e = error_from_code(-error._SYMBOLS['ERR_BUSY'])
+    copy = pickle.loads(pickle.dumps(e))
+    assert type(copy) is QmixBusyError
+    assert str(copy) == str(e)
+
+
+def test_messages_are_cached(monkeypatch):
+    code = error._SYMBOLS['ERR_BUSY']
+    message = error.error_message(code)
+
+    def fail(*args):
+        raise AssertionError('Error message looked up again.')
+
+    monkeypatch.setattr(error, '_load_messages', fail)
+    monkeypatch.setattr(error, '_dll_message', fail)
+    assert error.error_message(-code) == message
+    assert str(error_from_code(-code)).startswith(message)
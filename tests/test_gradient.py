@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from pyqmix import PumpGroup  # noqa: E402
+from pyqmix.gradient import GradientSchedule, GradientPlayer  # noqa: E402
+
+
+def test_schedule_validation():
+    with pytest.raises(ValueError):
+        GradientSchedule([0, 1], [[1, 0]], 2)
+    with pytest.raises(ValueError):
+        GradientSchedule([0, 1], [[1, 0], [-1, 0]], 2)
+    with pytest.raises(ValueError):
+        GradientSchedule([0, 1], [[1, 0], [1, 0]], 1)
+    with pytest.raises(ValueError):
+        GradientSchedule.from_composition([0, 1], [[1, 0], [0, 0]], 1)
+
+
+def test_from_composition():
+    schedule = GradientSchedule.from_composition(
+        [0, 1, 2, 3], [[1, 0], [1, 0], [1, 1], [1, 3]], total_flow=2)
+    assert schedule.times.tolist() == [0, 2, 3]
+    assert schedule.flows.tolist() == [[2, 0], [1, 1], [0.5, 1.5]]
+    assert np.allclose(schedule.total_flow, 2)
+    assert schedule.duration == 4
+    assert schedule.volumes()[-1].tolist() == [5.5, 2.5]
+
+
+def test_linear():
+    schedule = GradientSchedule.linear((1, 0), (0, 1), total_flow=1,
+                                       duration=1, interval=0.1)
+    assert len(schedule) == 10
+    assert np.allclose(schedule.total_flow, 1)
+    assert np.all(np.diff(schedule.flows[:, 0]) < 0)
+
+
+def test_check():
+    schedule = GradientSchedule([0], [[1, 2]], 1)
+    schedule.check(max_flow_rates=[2, 2], fill_levels=[2, 2])
+    with pytest.raises(ValueError):
+        schedule.check(max_flow_rates=[2, 1], fill_levels=[2, 2])
+    with pytest.raises(ValueError):
+        schedule.check(max_flow_rates=[2, 2], fill_levels=[2, 1])
+
+
+def test_player_validation(pumps):
+    with pytest.raises(ValueError):
+        GradientPlayer(pumps[:1], GradientSchedule([0], [[0.1, 0.1]], 1))
+
+    # Needs 3 mL from a syringe filled to 2 mL.
+    with pytest.raises(ValueError):
+        PumpGroup(pumps).play_gradient(
+            GradientSchedule([0], [[1, 0.1]], 3))
+    assert not any(pump.is_pumping for pump in pumps)
+
+
+def test_playback(pumps):
+    levels = [pump.fill_level for pump in pumps]
+    schedule = GradientSchedule([0, 0.2], [[1, 0], [0.5, 0.5]], 0.4)
+    player = PumpGroup(pumps).play_gradient(schedule, wait_until_done=True,
+                                            timeout=5)
+    assert player.error is None
+    assert player.timing_report()['max'] < 0.05
+    assert not any(pump.is_pumping for pump in pumps)
+
+    dispensed = [level - pump.fill_level
+                 for pump, level in zip(pumps, levels)]
+    assert dispensed == pytest.approx([0.3, 0.1], abs=0.05)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import pytest
+
+from pyqmix import PumpGroup
+from pyqmix.error import QmixError
+from pyqmix.waiting import WaitCancelled
+
+
+def test_skew(pumps):
+    group = PumpGroup(pumps)
+    group.dispense(0.2, 1, wait_until_done=True)
+    assert 0 <= group.issue_skew < 0.1
+    assert 0 <= group.start_skew < 0.5
+
+
+def test_invalid_parameters_start_no_pump(pumps):
+    group = PumpGroup(pumps)
+    with pytest.raises(ValueError):
+        group.dispense([0.2, 100], 1)
+    assert not any(pump.is_pumping for pump in pumps)
+    assert group.issue_times is None
+
+
+def test_failed_issue_stops_started_pumps(pumps, sim_system):
+    sim_system.inject_fault(1)
+    group = PumpGroup(pumps)
+    with pytest.raises(QmixError):
+        group.dispense(0.5, 1)
+    assert not pumps[0].is_pumping
+
+
+def test_stop(pumps):
+    group = PumpGroup(pumps)
+    group.dispense(1, 1)
+    group.stop()
+    assert not group.is_pumping
+
+
+def test_pump_cancel_aborts_group_wait(pumps):
+    group = PumpGroup(pumps)
+    group.dispense(1, 1)
+    timer = threading.Timer(0.2, pumps[1].cancel)
+    timer.start()
+    start = time.time()
+    try:
+        with pytest.raises(WaitCancelled):
+            group.wait(timeout=5)
+    finally:
+        timer.cancel()
+        group.stop()
+    assert time.time() - start < 0.8
+
+
+def test_group_cancel_aborts_group_wait(pumps):
+    group = PumpGroup(pumps)
+    timer = threading.Timer(0.2, group.cancel)
+    timer.start()
+    try:
+        with pytest.raises(WaitCancelled):
+            group.dispense(1, 1, wait_until_done=True)
+    finally:
+        timer.cancel()
+    assert not group.is_pumping
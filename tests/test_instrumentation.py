@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from pyqmix import instrumentation
+from pyqmix._device import _SDKDevice
+from pyqmix.error import QmixError
+
+
+def test_counts_calls(pump):
+    with instrumentation.instrument() as stats:
+        assert instrumentation.is_enabled()
+        for _ in range(3):
+            pump.get_fill_level()
+    assert not instrumentation.is_enabled()
+
+    assert stats['LCP_GetFillLevel'].calls == 3
+    assert stats['LCP_GetFillLevel'].errors == 0
+    assert stats.total_calls >= 3
+    assert 'LCP_GetFillLevel' in stats.report()
+
+
+def test_counts_errors(pump, sim_system):
+    sim_system.fail_next('LCP_GetFillLevel')
+    with instrumentation.instrument() as stats:
+        with pytest.raises(QmixError):
+            pump.get_fill_level()
+    assert stats['LCP_GetFillLevel'].errors == 1
+
+
+def test_hooks(pump):
+    calls = []
+
+    def pre_hook(device, func_name, args):
+        calls.append(('pre', func_name))
+
+    def post_hook(device, func_name, args, result, duration, error):
+        assert error is None
+        assert duration >= 0
+        calls.append(('post', func_name))
+
+    with instrumentation.instrument(pre_hook, post_hook):
+        pump.get_fill_level()
+    assert calls == [('pre', 'LCP_GetFillLevel'),
+                     ('post', 'LCP_GetFillLevel')]
+
+
+def test_disable_restores_call():
+    call = _SDKDevice.__dict__['_call']
+    instrumentation.enable()
+    assert _SDKDevice.__dict__['_call'] is not call
+    instrumentation.disable()
+    assert _SDKDevice.__dict__['_call'] is call
+
+
+def test_percentile():
+    stats = instrumentation.FunctionStats('LCP_IsPumping')
+    for duration in [1e-5] * 99 + [1e-2]:
+        stats._record(duration, False)
+    assert stats.percentile(50) < 2e-5
+    assert stats.percentile(100) == 1e-2
+    with pytest.raises(ValueError):
+        stats.percentile(101)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from pyqmix import instrumentation
+
+
+def test_scan(bus):
+    inventory = bus.inventory
+    assert inventory.n_pumps == 2
+    assert inventory.n_valves == 2
+    assert inventory.n_dio_channels == 4
+    assert inventory.dio_names[0] == 'QmixIO_1_DO0'
+    assert bus.inventory is inventory
+
+
+def test_name_lookup_is_cached(bus):
+    inventory = bus.inventory
+    name = 'neMESYS_Low_Pressure_2_Pump'
+    assert inventory.pump_index(name) == 1
+    with instrumentation.instrument() as stats:
+        assert inventory.pump_index(name) == 1
+    assert 'LCP_LookupPumpByName' not in stats
+
+    assert inventory.valve_index('neMESYS_Low_Pressure_1_Valve') == 0
+    assert inventory.dio_index('QmixIO_1_DO2') == 2
+
+
+def test_unknown_devices(bus):
+    inventory = bus.inventory
+    with pytest.raises(ValueError):
+        inventory.pump_index('foo')
+    with pytest.raises(ValueError):
+        inventory.dio_index('foo')
+    with pytest.raises(ValueError):
+        inventory.valve_handle(2)
+    with pytest.raises(ValueError):
+        inventory.pump()
+
+
+def test_devices_skip_handle_lookups(bus):
+    inventory = bus.inventory
+    with instrumentation.instrument() as stats:
+        pump = inventory.pump(1)
+        valve = inventory.valve(0)
+        dio = inventory.dio(name='QmixIO_1_DO1')
+    for func_name in ('LCP_GetPumpHandle', 'LCP_GetValveHandle',
+                      'LCV_GetValveHandle', 'LCDIO_GetOutChanHandle'):
+        assert func_name not in stats
+
+    assert pump.fill_level >= 0
+    assert valve.position in (0, 1)
+    assert dio.index == 1
+
+
+def test_stop_discards_inventory(bus):
+    inventory = bus.inventory
+    bus.stop()
+    with pytest.raises(RuntimeError):
+        bus.inventory
+    bus.start()
+    assert bus.inventory is not inventory
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+
+from pyqmix import config
+from pyqmix.journal import DrivePosJournal, RECORD_SIZE
+
+
+def _journal_path():
+    return os.path.join(config.PYQMIX_CONFIG_DIR, 'test.journal')
+
+
+def test_replays_latest_records():
+    journal = DrivePosJournal(_journal_path())
+    journal.append(0, 100)
+    journal.append(1, 200)
+    journal.append(0, 300)
+    # Simulate a crash: no compaction.
+    journal.close()
+
+    recovered = DrivePosJournal(_journal_path())
+    assert recovered.latest(0) == 300
+    assert recovered.latest(1) == 200
+    assert recovered.latest(2) is None
+
+
+def test_ignores_torn_record():
+    path = _journal_path()
+    journal = DrivePosJournal(path)
+    journal.append(0, 100)
+    journal.append(0, 200)
+    journal.close()
+
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - RECORD_SIZE // 2)
+
+    recovered = DrivePosJournal(path)
+    assert recovered.latest(0) == 100
+
+    # New records directly follow the last intact one.
+    recovered.append(0, 300)
+    recovered.close()
+    assert DrivePosJournal(path).latest(0) == 300
+    assert os.path.getsize(path) == 2 * RECORD_SIZE
+
+
+def test_compaction_stores_counters_in_config():
+    config.add_pump(0)
+    journal = DrivePosJournal(_journal_path())
+    journal.append(0, 100)
+    journal.compact()
+    journal.close()
+
+    assert config.read_config()['pumps'][0]['drive_pos_counter'] == 100
+    assert DrivePosJournal(_journal_path()).latest(0) == 100
+
+
+def test_explicit_config_value_wins():
+    config.add_pump(0)
+    journal = DrivePosJournal(_journal_path())
+    journal.append(0, 100)
+    journal.compact()
+
+    config.set_pump_drive_pos_counter(0, 500)
+    assert journal.latest(0) == 500
+
+    journal.compact()
+    journal.close()
+    assert config.read_config()['pumps'][0]['drive_pos_counter'] == 500
+    assert DrivePosJournal(_journal_path()).latest(0) == 500
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+from pyqmix import headers, library, QmixPump
+
+
+def test_load_library_is_shared():
+    pump_library = library.load_library('pump')
+    assert library.load_library('pump') is pump_library
+    assert library.loaded_libraries()['pump'] is pump_library
+    assert pump_library.mode == 'sim'
+
+
+def test_devices_share_library(pumps):
+    pump_library = library.load_library('pump')
+    for pump in pumps:
+        assert pump._library is pump_library
+        assert pump._functions is pump_library.functions
+    assert pumps[0].valve._library is library.load_library('valve')
+
+
+def test_unknown_library():
+    with pytest.raises(ValueError):
+        library.load_library('foo')
+
+
+def test_missing_function():
+    with pytest.raises(AttributeError):
+        library.load_library('pump').functions['LCP_Foo']
+
+
+def test_concurrent_loads_open_once(monkeypatch):
+    monkeypatch.setattr(library, '_libraries', dict())
+    opened = []
+    open_library = library._open_library
+
+    def record(name):
+        opened.append(name)
+        return open_library(name)
+
+    monkeypatch.setattr(library, '_open_library', record)
+
+    results = []
+    threads = [threading.Thread(
+        target=lambda: results.append(library.load_library('valve')))
+        for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert opened == ['valve']
+    assert all(result is results[0] for result in results)
+
+
+def test_new_pump_does_not_reload(bus, monkeypatch):
+    library.load_library('pump')
+    library.load_library('valve')
+
+    def fail(name):
+        raise AssertionError('Library %s loaded again.' % name)
+
+    monkeypatch.setattr(library, '_open_library', fail)
+    QmixPump(index=0)
+
+
+def test_parse_functions():
+    header = ('long LCP_GetNoOfPumps();\n'
+              'long LCP_GetPumpHandle(long Index, dev_hdl* PumpHandle);')
+    assert headers.parse_functions(header) == ['LCP_GetNoOfPumps',
+                                               'LCP_GetPumpHandle']
+
+
+def test_functions_resolved_once(pump, monkeypatch):
+    pump_library = library.load_library('pump')
+    assert 'LCP_GetFillLevel' in pump_library.functions
+    # Calls go through the function table, not the library object.
+    monkeypatch.setattr(pump_library, 'lib', None)
+    assert pump.get_fill_level() > 0
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from pyqmix.monitor import PumpMonitor
+from pyqmix.waiting import WaitTimeout
+
+
+@pytest.fixture
+def monitor(pumps):
+    monitor = PumpMonitor(pumps, rate=50)
+    yield monitor
+    monitor.stop()
+    for pump in monitor.pumps:
+        monitor.unregister(pump)
+
+
+def test_invalid_rate():
+    with pytest.raises(ValueError):
+        PumpMonitor(rate=0, auto_start=False)
+
+
+def test_register(monitor, pumps):
+    assert monitor.pumps == pumps
+    assert all(pump.monitor is monitor for pump in pumps)
+
+    monitor.unregister(pumps[1])
+    assert monitor.pumps == [pumps[0]]
+    assert pumps[1].monitor is None
+
+
+def test_states(monitor, pumps):
+    assert monitor.wait_for_update(timeout=1)
+    assert monitor.wait_for_update(timeout=1)
+    states = monitor.states()
+    assert set(states) == set(pumps)
+    state = monitor.state(pumps[0])
+    assert not state.is_pumping
+    assert state.fill_level == pytest.approx(2, abs=1e-3)
+
+
+def test_callback(monitor):
+    sweeps = []
+    monitor.add_callback(sweeps.append)
+    monitor.wait_for_update(timeout=1)
+    monitor.wait_for_update(timeout=1)
+    monitor.remove_callback(sweeps.append)
+    assert sweeps
+    assert monitor.last_error is None
+
+
+def test_wait_until_timeout(monitor):
+    with pytest.raises(WaitTimeout):
+        monitor.wait_until(lambda: False, timeout=0.1)
+
+
+def test_wait_until_stopped(monitor):
+    monitor.stop()
+    assert not monitor.is_running
+    with pytest.raises(RuntimeError):
+        monitor.wait_until(lambda: False, timeout=1)
+
+
+def test_short_move_completes_with_monitor(monitor, pump):
+    t0 = time.time()
+    pump.dispense(0.0005, pump.max_flow_rate, wait_until_done=True,
+                  timeout=2)
+    assert time.time() - t0 < 0.5
+    assert not pump.is_pumping
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import concurrent.futures
+
+import pytest
+
+from pyqmix import PumpGroup, operation as operation_module
+from pyqmix.monitor import PumpMonitor
+from pyqmix.waiting import WaitTimeout
+
+
+@pytest.fixture
+def tracked(monkeypatch):
+    operations = []
+    track = operation_module._watcher.track
+
+    def record(operation):
+        operations.append(operation)
+        track(operation)
+
+    monkeypatch.setattr(operation_module._watcher, 'track', record)
+    return operations
+
+
+def test_result_after_polling(pump):
+    operation = pump.dispense(0.3, 1)
+    while pump.is_pumping:
+        time.sleep(0.01)
+    assert operation.result(timeout=3) is None
+
+
+def test_resolves_without_being_used(pump):
+    operation = pump.dispense(0.3, 1)
+    done, _ = concurrent.futures.wait([operation], timeout=3)
+    assert operation in done
+
+
+def test_short_operation_resolves(pump):
+    operation = pump.dispense(0.0005, pump.max_flow_rate)
+    assert operation.result(timeout=3) is None
+    assert operation.progress == 1
+
+
+def test_short_operation_resolves_with_monitor(pump):
+    monitor = PumpMonitor([pump], rate=20)
+    try:
+        operation = pump.dispense(0.0005, pump.max_flow_rate)
+        assert operation.result(timeout=3) is None
+    finally:
+        monitor.stop()
+
+
+def test_superseded_operation_resolves(pump):
+    first = pump.dispense(0.5, 1)
+    second = pump.aspirate(0.2, 1)
+    assert first.result(timeout=3) is None
+    assert second.result(timeout=3) is None
+
+
+def test_waited_operation_is_not_tracked(pump, tracked):
+    operation = pump.dispense(0.2, 1, wait_until_done=True)
+    assert operation.done()
+    assert not tracked
+
+
+def test_timed_out_operation_is_tracked(pump, tracked):
+    with pytest.raises(WaitTimeout):
+        pump.dispense(0.5, 1, wait_until_done=True, timeout=0.05)
+    assert len(tracked) == 1
+    assert tracked[0].result(timeout=3) is None
+
+
+def test_cancel_stops_pump(pump):
+    operation = pump.dispense(1, 1)
+    assert operation.cancel()
+    assert operation.cancelled()
+    assert not pump.is_pumping
+
+
+def test_cancel_superseded_operation(pump):
+    first = pump.dispense(0.5, 1)
+    second = pump.aspirate(0.5, 1)
+    assert first.cancel()
+    assert pump.is_pumping
+    assert not second.done()
+    second.cancel()
+
+
+def test_group_operations_resolve(pumps):
+    operations = PumpGroup(pumps).dispense(0.3, 1)
+    _, not_done = concurrent.futures.wait(operations, timeout=3)
+    assert not not_done
+
+
+def test_waited_group_operations_are_not_tracked(pumps, tracked):
+    operations = PumpGroup(pumps).dispense(0.2, 1, wait_until_done=True)
+    assert all(operation.done() for operation in operations)
+    assert not tracked
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+from pyqmix.profile import FlowProfile, ProfilePlayer
+
+
+def test_profile_validation():
+    with pytest.raises(ValueError):
+        FlowProfile([0, 1], [1], 2)
+    with pytest.raises(ValueError):
+        FlowProfile([0.5, 1], [1, 1], 2)
+    with pytest.raises(ValueError):
+        FlowProfile([0, 1, 1], [1, 1, 1], 2)
+    with pytest.raises(ValueError):
+        FlowProfile([0, 1], [1, 1], 1)
+
+
+def test_compile_merges_samples():
+    profile = FlowProfile.compile([0, 1, 2, 3, 4], [1, 1.05, 2, 2, -1],
+                                  tolerance=0.1)
+    assert profile.times == [0, 2, 4]
+    assert profile.flows == pytest.approx([1.025, 2, -1])
+    assert profile.duration == 5
+
+
+def test_steps():
+    profile = FlowProfile.steps([1, 0, -0.5], [1, 0.5, 2])
+    assert profile.times == [0, 1, 1.5]
+    assert profile.duration == 3.5
+    assert profile.volumes() == [1, 1, 0]
+    assert profile.max_flow_rate == 1
+    with pytest.raises(ValueError):
+        FlowProfile.steps([1, 0], [1])
+
+
+def test_ramp_within_tolerance():
+    profile = FlowProfile.ramp(0, 1, 1, tolerance=0.05, min_interval=0)
+    assert 5 < len(profile) < 20
+    assert profile.flows[0] == pytest.approx(0.05, abs=0.05)
+    assert profile.flows[-1] == pytest.approx(0.95, abs=0.05)
+
+
+def test_player_validation(pump):
+    too_fast = FlowProfile.steps([2 * pump.max_flow_rate], [0.1])
+    with pytest.raises(ValueError):
+        ProfilePlayer(pump, too_fast)
+
+    # Dispenses 3 mL from a syringe filled to 2 mL.
+    empties = FlowProfile.steps([1], [3])
+    with pytest.raises(ValueError):
+        ProfilePlayer(pump, empties)
+
+    overfills = FlowProfile.steps([-4], [13])
+    with pytest.raises(ValueError):
+        pump.play_profile(overfills)
+    assert not pump.is_pumping
+
+
+def test_playback(pump):
+    level = pump.fill_level
+    profile = FlowProfile.steps([1, 0.5, -0.5], [0.2, 0.2, 0.2])
+    player = pump.play_profile(profile, wait_until_done=True, timeout=5)
+
+    assert player.done
+    assert player.error is None
+    report = player.timing_report()
+    assert report['planned'] == 3
+    assert report['issued'] + report['skipped'] == 3
+    assert report['max'] < 0.05
+    assert not pump.is_pumping
+    assert pump.fill_level == pytest.approx(level - 0.2, abs=0.05)
+
+
+def test_cancel_stops_playback(pump):
+    profile = FlowProfile.steps([0.1], [10])
+    player = pump.play_profile(profile)
+    threading.Timer(0.2, pump.cancel).start()
+    player.wait(timeout=2)
+    assert not pump.is_pumping
+    with pytest.raises(RuntimeError):
+        player.start()
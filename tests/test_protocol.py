@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from pyqmix.protocol import Protocol
+
+
+def _steps(after=None):
+    return [dict(id='a', device='pump', action='dispense',
+                 args=dict(volume=0.4, flow_rate=1)),
+            dict(id='b', device='same_pump', action='aspirate',
+                 args=dict(volume=0.2, flow_rate=1), after=after)]
+
+
+def test_rejects_concurrent_steps_on_same_device(pump):
+    protocol = Protocol(_steps())
+    level = pump.fill_level
+    with pytest.raises(ValueError):
+        protocol.run(dict(pump=pump, same_pump=pump))
+    assert pump.fill_level == level
+
+
+def test_runs_dependent_steps_on_same_device(pump):
+    protocol = Protocol(_steps(after=['a']) +
+                        [dict(id='rest', action='sleep',
+                              args=dict(duration=0.05), after=['a'])])
+    level = pump.fill_level
+    run = protocol.run(dict(pump=pump, same_pump=pump), timeout=10)
+
+    a, b = run.timeline['a'], run.timeline['b']
+    assert a.end <= b.start
+    assert abs(level - pump.fill_level - 0.2) < 1e-3
+
+
+def test_runs_independent_steps_concurrently(pumps):
+    protocol = Protocol([
+        dict(id='a', device='pump_1', action='dispense',
+             args=dict(volume=0.4, flow_rate=1)),
+        dict(id='b', device='pump_2', action='dispense',
+             args=dict(volume=0.4, flow_rate=1))])
+    run = protocol.run(dict(pump_1=pumps[0], pump_2=pumps[1]), timeout=10)
+    assert run.timeline['b'].start < run.timeline['a'].end
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from pyqmix import instrumentation
+
+
+def test_short_move_completes(pump):
+    # Ends long before the first poll.
+    for _ in range(5):
+        t0 = time.time()
+        pump.dispense(0.0005, pump.max_flow_rate, wait_until_done=True,
+                      timeout=2)
+        assert time.time() - t0 < 0.5
+        assert not pump.is_pumping
+
+
+def test_move_that_never_starts_completes(pump):
+    # Setting the current fill level does not move the plunger.
+    t0 = time.time()
+    pump.set_fill_level(pump.fill_level, 1, wait_until_done=True)
+    assert time.time() - t0 < 2
+
+
+def test_wait_until_done_dispenses_volume(pump):
+    level = pump.fill_level
+    pump.dispense(0.5, 1, wait_until_done=True, timeout=5)
+    assert abs(level - pump.fill_level - 0.5) < 1e-3
+
+
+def test_flow_scale(pump):
+    # 1 mL/s pumps 1 mL per second, 1 mL/min a sixtieth of that.
+    assert pump.flow_scale == pytest.approx(1.)
+    pump.set_flow_unit(time_unit='per_minute')
+    assert pump.flow_scale == pytest.approx(1. / 60)
+    pump.set_volume_unit(prefix='micro')
+    assert pump.flow_scale == pytest.approx(1000. / 60)
+
+
+def test_unit_reads_are_cached(pump):
+    def read():
+        return (pump.volume_unit, pump.flow_unit, pump.syringe_params,
+                pump.volume_max, pump.max_flow_rate)
+
+    values = read()
+    with instrumentation.instrument() as stats:
+        for _ in range(3):
+            assert read() == values
+    assert stats.total_calls == 0
+
+
+def test_setters_update_cache(pump):
+    max_flow_rate = pump.max_flow_rate
+    pump.set_flow_unit(time_unit='per_minute')
+    assert pump.flow_unit['time_unit'] == 'per_minute'
+    assert pump.max_flow_rate == pytest.approx(60 * max_flow_rate)
+
+    volume_max = pump.volume_max
+    pump.set_syringe_params(inner_diameter_mm=32.5713,
+                            max_piston_stroke_mm=3)
+    assert pump.syringe_params['max_piston_stroke_mm'] == 3
+    assert pump.volume_max < volume_max
+
+
+def test_refresh(pump):
+    with instrumentation.instrument() as stats:
+        pump.refresh()
+    assert stats['LCP_GetVolumeUnit'].calls == 1
+    assert stats['LCP_GetFlowRateMax'].calls == 1
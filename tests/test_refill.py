@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+from pyqmix.profile import FlowProfile
+from pyqmix.refill import plan_refills, RefillScheduler
+
+
+def test_plan_refills(pump):
+    # Starts at 2 mL; each dispense step needs 1.5 mL.
+    profile = FlowProfile.steps([1, 0, 1], [1.5, 2, 1.5])
+    plan = plan_refills(pump, profile, refill_rate=2, target_level=2)
+
+    assert len(plan.refills) == 1
+    refill = plan.refills[0]
+    assert refill.start == pytest.approx(1.6)
+    assert refill.end == pytest.approx(2.35)
+    assert refill.volume == pytest.approx(1.5)
+    assert plan.profile.times == pytest.approx([0, 1.5, 1.6, 2.35, 3.5])
+    assert plan.profile.flows == [1, 0, -2, 0, 1]
+    assert plan.min_level == pytest.approx(0.5)
+    assert plan.final_level == pytest.approx(0.5)
+
+
+def test_plan_refills_runs_empty(pump):
+    profile = FlowProfile.steps([1, 0, 1], [1.5, 2, 1.5])
+    with pytest.raises(ValueError):
+        plan_refills(pump, profile, refill_rate=2, min_volume=4)
+    with pytest.raises(ValueError):
+        plan_refills(pump, profile, refill_rate=2 * pump.max_flow_rate)
+
+
+def test_idle_pumps_are_refilled(pumps):
+    # Both pumps hold 2 mL, below 5% of the 50 mL syringes.
+    with RefillScheduler(pumps, refill_rate=4, low_level=0.05,
+                         target_level=0.1, auto_start=False) as scheduler:
+        deadline = time.time() + 5
+        while (time.time() < deadline and
+               any(pump.fill_level < 4.99 for pump in pumps)):
+            time.sleep(0.05)
+
+    assert scheduler.n_refills == 2
+    assert scheduler.error is None
+    assert [pump.fill_level for pump in pumps] == pytest.approx([5, 5],
+                                                                abs=1e-3)
+
+
+def test_invalid_parameters(pumps):
+    with pytest.raises(ValueError):
+        RefillScheduler(pumps, refill_rate=0, auto_start=False)
+    with pytest.raises(ValueError):
+        RefillScheduler(pumps, refill_rate=1, low_level=0.5,
+                        target_level=0.4, auto_start=False)
+
+
+def test_deliver(pumps):
+    # 2.5 mL syringes.
+    for pump in pumps:
+        pump.set_syringe_params(inner_diameter_mm=32.5713,
+                                max_piston_stroke_mm=3)
+
+    with RefillScheduler(pumps, refill_rate=4, low_level=0.2,
+                         handover_lead=0.3, rate=50,
+                         auto_start=False) as scheduler:
+        assert scheduler.predicted_continuity(1.5)['gap_free']
+        scheduler.deliver(1.5)
+        time.sleep(3)
+        assert scheduler.active_pump in pumps
+        continuity = scheduler.continuity()
+
+    assert scheduler.error is None
+    assert scheduler.active_pump is None
+    assert not any(pump.is_pumping for pump in pumps)
+    assert continuity['n_handovers'] >= 1
+    assert continuity['max_gap'] < 0.1
+    assert scheduler.n_refills >= 1
+
+    with pytest.raises(ValueError):
+        scheduler.deliver(0)
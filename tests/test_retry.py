@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from pyqmix import retry
+from pyqmix.error import QmixError, QmixBusyError, QmixTimeoutError
+from pyqmix.error import _SYMBOLS as SYMBOLS
+
+
+@pytest.fixture
+def policy():
+    policy = retry.RetryPolicy(max_attempts=3, delay=0)
+    retry.set_default_policy(policy)
+    yield policy
+    retry.set_default_policy(None)
+
+
+def test_is_idempotent():
+    assert retry.is_idempotent('LCP_GetFillLevel')
+    assert retry.is_idempotent('LCP_IsPumping')
+    assert retry.is_idempotent('LCP_SetFillLevel')
+    assert not retry.is_idempotent('LCP_Dispense')
+
+
+def test_not_retried_without_policy(pump, sim_system):
+    sim_system.fail_next('LCP_GetFillLevel', SYMBOLS['ERR_BUSY'])
+    with pytest.raises(QmixBusyError):
+        pump.get_fill_level()
+
+
+def test_not_executed_error_is_retried(policy, pump, sim_system):
+    sim_system.fail_next('LCP_Dispense', SYMBOLS['ERR_BUSY'], count=2)
+    pump.dispense(0.1, 1, wait_until_done=True, timeout=5)
+    assert policy.n_retries == 2
+    assert policy.n_recovered == 1
+
+
+def test_uncertain_error_only_retried_if_idempotent(policy, pump,
+                                                     sim_system):
+    timeout = SYMBOLS['ERR_CANO_DLL_TIMEOUT']
+    sim_system.fail_next('LCP_GetFillLevel', timeout)
+    assert pump.get_fill_level() > 0
+
+    sim_system.fail_next('LCP_Dispense', timeout)
+    with pytest.raises(QmixTimeoutError):
+        pump.dispense(0.1, 1)
+    assert policy.n_retries == 1
+
+
+def test_exhausted(policy, pump, sim_system):
+    sim_system.fail_next('LCP_GetFillLevel', SYMBOLS['ERR_BUSY'], count=3)
+    with pytest.raises(QmixBusyError):
+        pump.get_fill_level()
+    assert policy.n_retries == 2
+    assert policy.n_exhausted == 1
+
+
+def test_device_policy(policy, pump, sim_system):
+    pump.retry_policy = None
+    sim_system.fail_next('LCP_GetFillLevel', SYMBOLS['ERR_BUSY'])
+    with pytest.raises(QmixError):
+        pump.get_fill_level()
+
+    pump.retry_policy = retry.INHERIT
+    sim_system.fail_next('LCP_GetFillLevel', SYMBOLS['ERR_BUSY'])
+    assert pump.get_fill_level() > 0
+
+
+def test_get_delay():
+    policy = retry.RetryPolicy(delay=0.01, backoff=2, max_delay=0.03)
+    assert [policy.get_delay(i) for i in range(1, 5)] == [0, 0.01, 0.02,
+                                                          0.03]
+    with pytest.raises(ValueError):
+        retry.RetryPolicy(max_attempts=0)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from pyqmix import sim
+from pyqmix.error import QmixError
+
+
+@pytest.fixture
+def frozen(sim_system, pump):
+    # Time only passes via `advance()`.
+    sim_system.clock.speed = 0
+    return sim_system
+
+
+def test_virtual_clock():
+    clock = sim.VirtualClock(speed=0)
+    clock.advance(1.5)
+    assert clock.now() == 1.5
+    with pytest.raises(ValueError):
+        clock.advance(-1)
+    with pytest.raises(ValueError):
+        clock.speed = -1
+
+
+def test_bus_state(sim_system, bus):
+    assert sim_system.bus_state == 'started'
+    bus.stop()
+    assert sim_system.bus_state == 'open'
+    bus.start()
+
+
+def test_motion_follows_clock(frozen, pump):
+    level = pump.fill_level
+    pump.dispense(0.5, 0.25)
+    assert pump.is_pumping
+
+    frozen.clock.advance(1)
+    assert level - 0.5 < pump.fill_level < level
+
+    frozen.clock.advance(10)
+    assert not pump.is_pumping
+    assert pump.fill_level == pytest.approx(level - 0.5, abs=1e-6)
+
+
+def test_rejects_excessive_flow_rate(pump):
+    with pytest.raises(QmixError):
+        pump._call('LCP_Dispense', pump._handle[0], 0.1,
+                   2 * pump.max_flow_rate)
+
+
+def test_valve_latency(frozen, pump):
+    position = pump.valve.position
+    pump.valve.switch_position(1 - position)
+    assert pump.valve.position == position
+
+    frozen.clock.advance(0.1)
+    assert pump.valve.position == 1 - position
+
+
+def test_inject_fault(sim_system, pump):
+    pump.dispense(1, 1)
+    sim_system.inject_fault(0)
+    assert not pump.is_pumping
+    assert pump.is_in_fault_state
+    with pytest.raises(QmixError):
+        pump.dispense(0.1, 1)
+
+    pump.clear_fault_state()
+    assert not pump.is_in_fault_state
+
+
+def test_fail_next(sim_system, pump):
+    sim_system.fail_next('LCP_GetFillLevel', count=2)
+    for _ in range(2):
+        with pytest.raises(QmixError):
+            pump.get_fill_level()
+    assert pump.get_fill_level() > 0
+
+
+def test_power_cycle(sim_system, pump):
+    sim_system.power_cycle()
+    assert pump.drive_pos_counter == 0
+    assert not pump.is_enabled
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from pyqmix.monitor import PumpMonitor  # noqa: E402
+from pyqmix.telemetry import (RingBuffer, TelemetryRecorder,  # noqa: E402
+                              TelemetrySink, read_telemetry,
+                              read_telemetry_info)
+
+
+def _buffer(capacity):
+    return RingBuffer(capacity, dtype=[('value', 'i8')])
+
+
+def test_partially_filled():
+    buffer = _buffer(4)
+    for i in range(3):
+        buffer.append((i,))
+
+    assert len(buffer) == 3
+    assert buffer.dropped == 0
+    assert buffer.view()['value'].tolist() == [0, 1, 2]
+
+
+@pytest.mark.parametrize('n', [4, 5, 7, 8, 9, 23])
+def test_wraparound(n):
+    buffer = _buffer(4)
+    for i in range(n):
+        buffer.append((i,))
+
+    assert len(buffer) == 4
+    assert buffer.total == n
+    assert buffer.dropped == n - 4
+    assert buffer.view()['value'].tolist() == list(range(n - 4, n))
+    assert buffer.view(2)['value'].tolist() == [n - 2, n - 1]
+
+
+def test_view_is_not_a_copy():
+    buffer = _buffer(4)
+    for i in range(6):
+        buffer.append((i,))
+
+    view = buffer.view()
+    assert view.base is not None
+    assert view.flags['C_CONTIGUOUS']
+
+
+def test_clear():
+    buffer = _buffer(4)
+    for i in range(6):
+        buffer.append((i,))
+    buffer.clear()
+
+    assert len(buffer) == 0
+    assert buffer.view().size == 0
+
+
+def _wait_for_samples(buffer, n, timeout=3):
+    deadline = time.time() + timeout
+    while buffer.total < n and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_recorder_samples_in_place(pump):
+    with TelemetryRecorder([pump], capacity=8, rate=100,
+                           auto_start=False) as recorder:
+        assert recorder.monitor is None
+        pump.dispense(0.3, 1)
+        _wait_for_samples(recorder.buffers[pump], 20)
+
+    data = recorder.snapshot(pump)
+    assert len(data) == 8
+    assert recorder.buffers[pump].dropped > 0
+    assert np.all(np.diff(data['timestamp']) > 0)
+    assert np.all(np.diff(data['fill_level']) <= 0)
+    assert recorder.last_error is None
+    assert pump.monitor is None
+
+
+def test_recorder_records_monitor_samples(pump):
+    monitor = PumpMonitor(rate=100)
+    try:
+        recorder = TelemetryRecorder([pump], capacity=100, monitor=monitor)
+        _wait_for_samples(recorder.buffers[pump], 5)
+        recorder.stop()
+    finally:
+        monitor.stop()
+
+    assert pump.monitor is monitor
+    data = recorder.snapshot(pump)
+    assert len(data) >= 5
+    assert np.allclose(data['fill_level'], pump.fill_level)
+
+
+def test_sink_chunks(tmpdir, pump):
+    path = str(tmpdir.join('telemetry'))
+    sink = TelemetrySink(path, [pump], chunk_size=4, auto_start=False)
+    for i in range(10):
+        sink.append(float(i), pump, 2. - i, 1., float(i))
+    sink.close()
+
+    assert sink.n_rows == 10
+    data = read_telemetry(path)
+    assert np.array_equal(data['timestamp'], np.arange(10.))
+    assert np.all(data['pump'] == 0)
+    assert np.all(data['valve_position'] == -1)
+
+    info = read_telemetry_info(path)
+    assert info['chunk_size'] == 4
+    assert info['pumps'] == [dict(number=0, index=pump.index,
+                                  name=pump.name)]
+
+    with pytest.raises(RuntimeError):
+        sink.append(10., pump, 0., 0., 0.)
+    with pytest.raises(ValueError):
+        TelemetrySink(path)
+
+
+def test_sink_commits_rows(tmpdir, pump):
+    path = str(tmpdir.join('telemetry'))
+    sink = TelemetrySink(path, [pump], buffer_size=3, flush_interval=60,
+                         auto_start=False)
+    try:
+        for i in range(2):
+            sink.append(float(i), 0, 1., 1., 1.)
+        # Readers only see committed rows.
+        assert len(read_telemetry(path)['timestamp']) == 0
+        sink.append(2., 0, 1., 1., 1.)
+        assert len(read_telemetry(path)['timestamp']) == 3
+    finally:
+        sink.close()
+
+
+def test_sink_records_pumps(tmpdir, pump):
+    path = str(tmpdir.join('telemetry'))
+    with TelemetrySink(path, [pump], rate=100, flush_interval=0.05,
+                       record_valves=True, auto_start=False) as sink:
+        pump.dispense(0.3, 1)
+        deadline = time.time() + 3
+        while sink.n_rows < 20 and time.time() < deadline:
+            time.sleep(0.01)
+
+    assert sink.last_error is None
+    data = read_telemetry(path)
+    assert len(data['timestamp']) >= 20
+    assert np.all(np.diff(data['fill_level']) <= 0)
+    assert np.all(data['valve_position'] >= 0)